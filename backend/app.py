@@ -1,11 +1,41 @@
 
-from flask import Flask, jsonify, request, send_file, Response
+from flask import Flask, jsonify, request, Response
 from flask_cors import CORS
 import pandas as pd
 import os
 import requests
 import io
+import hashlib
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 import mimetypes
+import time
+from urllib.parse import quote
+from config import (BASE_EXPORT_URL, DOWNLOAD_CACHE_DIR, DOWNLOAD_CACHE_MAX_BYTES,
+                    RANGE_CACHE_DIR, RANGE_CACHE_MAX_BYTES, RANGE_CACHE_BLOCK_SIZE, BROADCAST_BUFFER_BYTES,
+                    RESOLVER_TTL, RESOLVER_NEGATIVE_TTL, SEARCH_DEFAULT_LIMIT, SEARCH_MAX_LIMIT,
+                    SEARCH_STREAM_MAX_LIMIT, COMPRESS_MIN_BYTES, SEARCH_CACHE_MAX_BYTES,
+                    FLAC_HEADER_PROBE_BYTES, SEEK_INDEX_MAX_ENTRIES, SEEK_SCAN_MAX_BYTES,
+                    DOWNLOAD_SEGMENTS, DOWNLOAD_MIN_SEGMENT_BYTES, DOWNLOAD_SEGMENT_RETRIES,
+                    ZIP_MAX_TRACKS, ZIP_FETCH_AHEAD, PREFETCH_ENABLED, PREFETCH_TOP_RESULTS,
+                    PREFETCH_HEAD_SECONDS, PREFETCH_DEFAULT_BYTES_PER_SECOND, TRACKS_CSV_PATH)
+from utils.catalog import active_catalog, InvalidCursor
+from utils.file_cache import FileCache
+from utils.range_cache import RangeCache
+from utils.segmented_fetch import SegmentedFetch
+from utils.drive_resolver import DriveResolver, DriveFileNotFound
+from utils.upstream import CircuitOpenError
+from utils.admission import Admission, Overloaded, Held, BULK, INTERACTIVE, client_key, stream_priority
+from utils.http_range import parse_range, RangeNotSatisfiable
+from utils.flac_seek import SeekIndex, FrameLocator, seek_target
+from utils.local_file import file_validators, plan_file_response, mmap_body, seek_to_body
+from utils.response_encoding import dumps, choose_encoding, compress, StreamCompressor
+from utils.response_cache import ResponseCache
+from utils.search_engine import query_key
+from utils.zip_stream import ZipStream
+from utils.relay import Relay
+from utils.prefetch import Prefetcher, is_playback_start
+from utils import metrics
 
 app = Flask(__name__)
 
@@ -16,13 +46,14 @@ CORS(app,
              "origins": ["*"],  # Allow all origins
              "methods": ["GET", "POST", "PUT", "DELETE", "OPTIONS"],  # Allow all methods
              "allow_headers": ["Content-Type", "Authorization", "X-Requested-With"],
+             "expose_headers": ["X-Next-Cursor"],
              "supports_credentials": True
          },
          r"/stream/*": {
              "origins": ["*"],
              "methods": ["GET", "HEAD", "OPTIONS"],
              "allow_headers": ["Range", "Content-Type"],
-             "expose_headers": ["Content-Range", "Accept-Ranges", "Content-Length"]
+             "expose_headers": ["Content-Range", "Accept-Ranges", "Content-Length", "X-Seek-Time"]
          }
      },
      origins="*",  # Global fallback
@@ -33,93 +64,281 @@ CORS(app,
 )
 
 # Constants
-TEMP_DOWNLOAD_DIR = 'temp_downloads'
-BASE_EXPORT_URL = "https://drive.google.com/uc?export=download&id="
-
-def get_confirm_token(response):
-    """Extract confirmation token from Google Drive response"""
-    for key, value in response.cookies.items():
-        if key.startswith('download_warning'):
-            return value
-    return None
-
-def get_content_type(filename):
-    """Get the content type based on file extension"""
-    extension = os.path.splitext(filename)[1].lower()
-    if extension == '.flac':
-        return 'audio/flac'
-    elif extension == '.mp3':
-        return 'audio/mpeg'
-    elif extension == '.m4a':
-        return 'audio/mp4'
-    elif extension == '.wav':
-        return 'audio/wav'
-    return 'application/octet-stream'
-
-def download_and_cache_file(file_id):
-    """Download and cache a file from Google Drive with confirmation handling"""
+NDJSON_BATCH_SIZE = 200  # Streamed search results are flushed to the client in batches this size
+DOWNLOAD_CHUNK_SIZE = 64 * 1024
+
+download_cache = FileCache(DOWNLOAD_CACHE_DIR, DOWNLOAD_CACHE_MAX_BYTES)
+range_cache = RangeCache(RANGE_CACHE_DIR, RANGE_CACHE_MAX_BYTES, RANGE_CACHE_BLOCK_SIZE,
+                         BROADCAST_BUFFER_BYTES)
+resolver = DriveResolver(BASE_EXPORT_URL, RESOLVER_TTL, RESOLVER_NEGATIVE_TTL)
+search_cache = ResponseCache(SEARCH_CACHE_MAX_BYTES)
+seek_index = SeekIndex(FLAC_HEADER_PROBE_BYTES, SEEK_INDEX_MAX_ENTRIES)
+admission = Admission()
+
+app.wsgi_app = metrics.MetricsMiddleware(app.wsgi_app)
+
+
+def cache_lookups(counter):
+    return lambda: {(name,): cache.stats()[counter]
+                    for name, cache in (('download', download_cache), ('search', search_cache),
+                                        ('seek', seek_index))}
+
+
+metrics.Collected('cache_hits_total', 'Cache lookups answered from the cache', ('cache',),
+                  'counter', cache_lookups('hits'))
+metrics.Collected('cache_misses_total', 'Cache lookups that missed', ('cache',),
+                  'counter', cache_lookups('misses'))
+metrics.Collected('cache_attaches_total', 'Download cache misses that followed a download in progress',
+                  ('cache',), 'counter', lambda: {('download',): download_cache.stats()['attaches']})
+metrics.Ratio('cache_hit_ratio', 'Share of cache lookups that hit, over all workers',
+              'cache_hits_total', 'cache_misses_total')
+
+
+def range_bytes():
+    stats = range_cache.stats()
+    return {('disk',): stats['hit_bytes'], ('broadcast',): stats['miss_bytes'],
+            ('upstream',): stats['upstream_bytes']}
+
+
+metrics.Collected('range_cache_bytes_total',
+                  'Range cache bytes served from disk or a shared upstream read, and read from Drive',
+                  ('source',), 'counter', range_bytes)
+
+
+def prefetch_head(file_id, admit):
+    """
+    Prefetch job: resolve a track, read its FLAC header into the seek index
+    and its first PREFETCH_HEAD_SECONDS into the range cache, each upstream
+    read admitted and paced by admit(). Returns the head bytes read from
+    Drive (0 if they were cached), or None to skip.
+    """
+    if download_cache.contains(file_id):
+        return None
+    resolution = resolver.resolve(file_id)
+    total = resolution.total_length
+    if total is None or not resolution.accepts_ranges:
+        return None
+    meta = seek_index.get(file_id, total, lambda first, last: read_range(resolution, first, last))
+    duration = meta.duration if meta is not None else None
+    bytes_per_second = total / duration if duration else PREFETCH_DEFAULT_BYTES_PER_SECOND
+    last = min(total, int(PREFETCH_HEAD_SECONDS * bytes_per_second)) - 1
+    if range_cache.cached(file_id, total, 0, last):
+        return 0
+
+    # Only the runs this read fetches itself count: blocks already on disk,
+    # or read by another listener's broadcast, cost no Drive bytes
+    fetched = []
+
+    def fetch_range(first, last):
+        upstream = open_range(resolution, first, last)
+        fetched.append(last - first + 1)
+        return upstream
+
+    chunks = range_cache.read(file_id, total, 0, last, fetch_range, admit)
     try:
-        session = requests.Session()
-        
-        # First request to get the confirmation token
-        file_url = f"{BASE_EXPORT_URL}{file_id}"
-        response = session.get(file_url, stream=True)
+        for _ in chunks:
+            pass
+    finally:
+        chunks.close()
+    return sum(fetched)
+
+
+prefetcher = Prefetcher(prefetch_head, admission) if PREFETCH_ENABLED else None
+
 
-        if response.status_code == 404:
-            raise Exception("File not found. Ensure the file ID is correct and the file is publicly accessible.")
+def prefetch_outcomes():
+    stats = prefetcher.stats()
+    return {(outcome,): stats[outcome] for outcome in ('warmed', 'busy', 'over_budget', 'dropped',
+                                                       'errors')}
 
-        # Check if we need to confirm the download
-        token = get_confirm_token(response)
-        if token:
-            params = {'id': file_id, 'confirm': token}
-            response = session.get(BASE_EXPORT_URL, params=params, stream=True)
 
-        # Use file ID as fallback file name
-        file_name = f"{file_id}.file"
+if prefetcher is not None:
+    metrics.Collected('prefetch_total', 'Prefetch jobs by outcome (warmed, or skipped and why)',
+                      ('outcome',), 'counter', prefetch_outcomes)
+    metrics.Collected('prefetch_used_total', 'Prefetched heads whose track was then played', (),
+                      'counter', lambda: {(): prefetcher.stats()['used']})
+    metrics.Collected('prefetch_unused_total', 'Prefetched heads not played within PREFETCH_TTL', (),
+                      'counter', lambda: {(): prefetcher.stats()['expired']})
+    metrics.Ratio('prefetch_hit_ratio', 'Share of prefetched heads that were played, over all workers',
+                  'prefetch_used_total', 'prefetch_unused_total')
 
-        # Extract filename from headers if available
-        if 'content-disposition' in response.headers:
-            content_disposition = response.headers['content-disposition']
-            if 'filename=' in content_disposition:
-                file_name = content_disposition.split('filename=')[-1].strip('"')
 
-        # Ensure the download directory exists
-        if not os.path.exists(TEMP_DOWNLOAD_DIR):
-            os.makedirs(TEMP_DOWNLOAD_DIR)
+@app.before_request
+def label_route():
+    # Metrics are labelled by URL rule, so /stream/<file_id> is one series
+    if request.url_rule is not None:
+        request.environ['metrics.route'] = request.url_rule.rule
 
-        file_path = os.path.join(TEMP_DOWNLOAD_DIR, file_name)
+def open_from_drive(file_id, ticket):
+    """
+    Start downloading a file from Google Drive using its cached resolution.
+    Files large enough to split are fetched as DOWNLOAD_SEGMENTS concurrent
+    ranges; the rest, and files Drive will not serve by range, in one stream.
+    Either way the reads are paced by ticket, released when the body is closed.
+    """
+    resolution = resolver.resolve(file_id)
+    meta = {'filename': resolution.filename, 'content_type': resolution.content_type,
+            'size': resolution.total_length}
+    if (DOWNLOAD_SEGMENTS > 1 and resolution.accepts_ranges and resolution.total_length
+            and resolution.total_length >= 2 * DOWNLOAD_MIN_SEGMENT_BYTES):
+        return meta, SegmentedFetch(file_id, resolution.total_length,
+                                    lambda first, last: resolver.open(resolution, first, last),
+                                    lambda: resolver.open(resolution),
+                                    DOWNLOAD_SEGMENTS, DOWNLOAD_MIN_SEGMENT_BYTES,
+                                    DOWNLOAD_SEGMENT_RETRIES, ticket)
 
-        # Write the file content to disk
-        with open(file_path, 'wb') as file:
-            for chunk in response.iter_content(chunk_size=8192):
-                if chunk:  # Filter out keep-alive chunks
-                    file.write(chunk)
+    response = resolver.open(resolution)
 
-        return file_path
+    # Never cache an error page as the track
+    if response.status_code != 200:
+        response.close()
+        resolver.invalidate(file_id)
+        raise Exception(f"Failed to download file (upstream status {response.status_code})")
 
+    size = response.headers.get('Content-Length')
+    if response.headers.get('Content-Encoding', 'identity') != 'identity' or not (size and size.isdigit()):
+        size = resolution.total_length
+
+    meta['size'] = int(size) if size is not None else None
+    # Chunks share one buffer; the cache writes each out before asking for the next
+    return meta, Held(ticket, iter(Relay(response, pace=ticket.delay)))
+
+def open_download(file_id, client):
+    """
+    (entry, chunks) for a download: chunks is None when the file is already
+    cached, else it streams the file while it is fetched into the cache.
+    Only a fetch from Drive takes a BULK admission slot for client, held
+    until the file is in the cache; raises Overloaded if none comes free.
+    """
+    def open_upstream():
+        ticket = admission.admit(BULK, client)
+        try:
+            return open_from_drive(file_id, ticket)
+        except BaseException:
+            ticket.release()
+            raise
+
+    try:
+        return download_cache.get_or_stream(file_id, open_upstream)
     except requests.RequestException as e:
         print(f"Error downloading file: {str(e)}")
         raise Exception(f"Error downloading file: {str(e)}")
 
+def send_cached_file(entry, extra_headers):
+    """
+    Response for a file in the download cache, with validators, conditional
+    requests and (multi-)ranges. Under gunicorn the body goes out through
+    wsgi.file_wrapper (os.sendfile); otherwise as mmap slices. Returns None
+    if the file was evicted since it was looked up.
+    """
+    try:
+        f = open(entry.path, 'rb')
+    except FileNotFoundError:
+        return None
+    try:
+        st = os.fstat(f.fileno())
+        etag, last_modified = file_validators(st, entry.modified)
+        plan = plan_file_response(request.headers, st.st_size, entry.content_type,
+                                  etag, last_modified, extra_headers)
+        if plan.status in (304, 416) or request.method == 'HEAD':
+            f.close()
+            return Response(status=plan.status, headers=plan.headers)
+        file_wrapper = request.environ.get('wsgi.file_wrapper')
+        if file_wrapper is not None and seek_to_body(f, plan):
+            body = file_wrapper(f, DOWNLOAD_CHUNK_SIZE)
+        else:
+            body = mmap_body(f, plan)
+    except BaseException:
+        f.close()
+        raise
+    return Response(body, plan.status, headers=plan.headers, direct_passthrough=True)
+
+def content_disposition(filename):
+    """attachment header value, with an RFC 5987 filename* for non-ASCII names"""
+    disposition = f"attachment; filename=\"{filename.encode('ascii', 'ignore').decode()}\""
+    if not filename.isascii():
+        disposition += f"; filename*=UTF-8''{quote(filename)}"
+    return disposition
+
+def upstream_unavailable(error):
+    """503 response telling the client when to try again (Drive unavailable, or no upstream slot)"""
+    response = jsonify({'error': str(error)})
+    response.status_code = 503
+    response.headers['Retry-After'] = str(int(error.retry_after + 0.5))
+    return response
+
+def request_client():
+    """Whose bandwidth a request counts against"""
+    return client_key(request.remote_addr, request.headers.get('X-Forwarded-For'))
+
+def primed(chunks):
+    """
+    chunks, run up to its first chunk now: an upstream read that has to
+    start first is admitted, or refused with Overloaded, while the
+    response can still be a 503
+    """
+    try:
+        first = next(chunks, None)
+    except BaseException:
+        chunks.close()
+        raise
+
+    def body():
+        try:
+            if first is not None:
+                yield first
+            yield from chunks
+        finally:
+            chunks.close()
+
+    return body()
+
 def search_tracks(query):
-    """Search tracks in the CSV file"""
+    """Search tracks in the resident catalog"""
     try:
-        csv_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'tracks.csv')
-        df = pd.read_csv(csv_path)
-        
-        # Convert query and searchable columns to lowercase for case-insensitive search
-        query = query.lower()
-        
-        # Search in relevant columns (adjust these based on your CSV structure)
-        mask = df['title'].str.lower().str.contains(query, na=False) | \
-               df['artist'].str.lower().str.contains(query, na=False)
-        
-        results = df[mask].to_dict('records')
-        return results
+        return active_catalog(TRACKS_CSV_PATH).snapshot().search(query)
     except Exception as e:
         print(f"Error searching tracks: {str(e)}")
         raise
 
+def parse_limit(value, maximum):
+    """Validate the limit query parameter"""
+    if value is None or value == '':
+        return min(SEARCH_DEFAULT_LIMIT, maximum)
+    try:
+        limit = int(value)
+    except ValueError:
+        raise ValueError("limit must be an integer")
+    if limit < 1 or limit > maximum:
+        raise ValueError(f"limit must be between 1 and {maximum}")
+    return limit
+
+def wants_ndjson():
+    return (request.args.get('format') == 'ndjson'
+            or 'application/x-ndjson' in request.headers.get('Accept', ''))
+
+def ndjson_body(snapshot, rows, encoding):
+    """Yield search results as newline-delimited JSON, flushed in batches"""
+    compressor = StreamCompressor(encoding)
+    columns = snapshot.columns
+    batch = []
+    for row in rows:
+        batch.append(dumps(dict(zip(columns, row))))
+        if len(batch) >= NDJSON_BATCH_SIZE:
+            yield compressor.flush(b'\n'.join(batch) + b'\n')
+            batch = []
+    if batch:
+        yield compressor.flush(b'\n'.join(batch) + b'\n')
+    tail = compressor.finish()
+    if tail:
+        yield tail
+
+def top_file_ids(snapshot, rows):
+    """file_ids of the first results of a page, for the prefetcher"""
+    if prefetcher is None:
+        return []
+    return [track['file_id'] for track in snapshot.to_dicts(rows[:PREFETCH_TOP_RESULTS])]
+
 @app.route('/api/search', methods=['GET', 'OPTIONS'])
 def search():
     # Handle preflight OPTIONS request
@@ -132,128 +351,437 @@ def search():
     
     try:
         query = request.args.get('q', '')
-        print(f"Searching for: {query}")
-        
-        csv_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'tracks.csv')
-        if not os.path.exists(csv_path):
+        started = time.perf_counter()
+        snapshot = active_catalog(TRACKS_CSV_PATH).snapshot()
+        metrics.SEARCH_PHASE.observe(time.perf_counter() - started, 'snapshot')
+        if not snapshot.exists:
             return jsonify({
                 'error': 'Database file not found',
-                'path': csv_path
+                'path': TRACKS_CSV_PATH
             }), 404
-            
-        results = search_tracks(query)
-        response = jsonify(results)
-        response.headers.add('Access-Control-Allow-Origin', '*')
+
+        stream = wants_ndjson()
+        try:
+            limit = parse_limit(request.args.get('limit'),
+                                SEARCH_STREAM_MAX_LIMIT if stream else SEARCH_MAX_LIMIT)
+            offset = snapshot.decode_cursor(request.args.get('cursor'))
+        except (ValueError, InvalidCursor) as e:
+            return jsonify({'error': str(e)}), 400
+
+        encoding = choose_encoding(request.headers.get('Accept-Encoding'))
+        key = (query_key(query), limit, offset, stream, encoding)
+        etag = f"{snapshot.version_tag}-{hashlib.sha1(repr(key).encode('utf-8')).hexdigest()[:16]}"
+
+        top_ids = []
+        if request.if_none_match.contains(etag):
+            response = Response(status=304)
+        elif stream:
+            started = time.perf_counter()
+            rows, next_offset = snapshot.page(query, offset, limit)
+            metrics.SEARCH_PHASE.observe(time.perf_counter() - started, 'query')
+            top_ids = top_file_ids(snapshot, rows)
+            response = Response(ndjson_body(snapshot, rows, encoding),
+                                mimetype='application/x-ndjson', direct_passthrough=True)
+        else:
+            started = time.perf_counter()
+            cached = search_cache.get(snapshot.version, key)
+            metrics.SEARCH_PHASE.observe(time.perf_counter() - started, 'cache')
+            if cached is None:
+                started = time.perf_counter()
+                rows, next_offset = snapshot.page(query, offset, limit)
+                queried = time.perf_counter()
+                metrics.SEARCH_PHASE.observe(queried - started, 'query')
+                body = dumps(snapshot.to_dicts(rows))
+                body_encoding = encoding if len(body) >= COMPRESS_MIN_BYTES else None
+                body = compress(body, body_encoding)
+                metrics.SEARCH_PHASE.observe(time.perf_counter() - queried, 'encode')
+                top_ids = top_file_ids(snapshot, rows)
+                search_cache.put(snapshot.version, key, body, (next_offset, body_encoding, top_ids))
+            else:
+                body, (next_offset, body_encoding, top_ids) = cached
+            response = Response(body, mimetype='application/json')
+            if body_encoding:
+                response.headers['Content-Encoding'] = body_encoding
+
+        # The first results of a new search are the tracks most likely played next
+        if top_ids and offset == 0 and query.strip():
+            prefetcher.request(top_ids)
+
+        if stream and encoding and response.status_code == 200:
+            response.headers['Content-Encoding'] = encoding
+        if response.status_code == 200 and next_offset is not None:
+            response.headers['X-Next-Cursor'] = snapshot.encode_cursor(next_offset)
+        # Clients and CDNs may store results but must revalidate; a catalog
+        # change alters every ETag
+        response.set_etag(etag)
+        response.headers['Cache-Control'] = 'public, no-cache'
+        response.headers['Vary'] = 'Accept-Encoding'
         return response
     except Exception as e:
         response = jsonify({
             'error': str(e),
             'type': type(e).__name__
-        }), 500
-        response.headers.add('Access-Control-Allow-Origin', '*')
+        })
+        response.status_code = 500
         return response
 
 @app.route('/api/download/<file_id>', methods=['GET'])
 def download(file_id):
     try:
-        file_path = download_and_cache_file(file_id)
-        content_type = get_content_type(file_path)
-        return send_file(file_path, 
-                        as_attachment=True,
-                        mimetype=content_type)
+        entry, chunks = open_download(file_id, request_client())
+        if chunks is None:
+            response = send_cached_file(
+                entry, {'Content-Disposition': content_disposition(entry.filename)})
+            if response is not None:
+                return response
+            entry, chunks = open_download(file_id, request_client())  # Evicted in between: fetch again
+            if chunks is None:
+                raise Exception("Cached file disappeared while being opened")
+
+        # Cache miss: send bytes as they arrive instead of after the whole file
+        headers = {'Content-Disposition': content_disposition(entry.filename)}
+        if entry.size is not None:
+            headers['Content-Length'] = str(entry.size)
+        return Response(chunks, 200, headers=headers, mimetype=entry.content_type,
+                        direct_passthrough=True)
+    except (CircuitOpenError, Overloaded) as e:
+        return upstream_unavailable(e)
     except Exception as e:
         return jsonify({'error': str(e)}), 400
 
+def open_member(file_id, client):
+    """
+    (entry, file, chunks) for one track of an archive: a cached track is
+    opened at once (file), so eviction cannot remove it before its turn;
+    otherwise chunks follows its download into the cache.
+    """
+    entry, chunks = open_download(file_id, client)
+    if chunks is None:
+        try:
+            return entry, open(entry.path, 'rb'), None
+        except FileNotFoundError:
+            entry, chunks = open_download(file_id, client)
+            if chunks is None:
+                raise Exception("Cached file disappeared while being opened")
+    return entry, None, chunks
+
+def close_member(entry, f, chunks):
+    if f is not None:
+        f.close()
+    if chunks is not None:
+        chunks.close()
+
+def read_file(f):
+    with f:
+        while True:
+            chunk = f.read(DOWNLOAD_CHUNK_SIZE)
+            if not chunk:
+                break
+            yield chunk
+
+def member_name(number, width, entry, folder):
+    """Archive path of a track, numbered in request order so names never clash"""
+    filename = (entry.filename or f"{entry.key}.flac").replace('/', '_').replace('\\', '_')
+    name = f"{number:0{width}d} - {filename}"
+    if folder:
+        name = f"{folder.replace('/', '_')}/{name}"
+    return name
+
+def archive_body(file_ids, folder, client):
+    """
+    ZIP64 archive of file_ids, written in order. Up to ZIP_FETCH_AHEAD
+    tracks are opened at once, which starts their downloads into the cache,
+    and each is read back from there when its turn comes; only one chunk
+    of track data is in memory at a time.
+    """
+    archive = ZipStream()
+    pool = ThreadPoolExecutor(ZIP_FETCH_AHEAD)
+    pending = deque()
+    queued = 0
+    width = max(2, len(str(len(file_ids))))
+    try:
+        for number, file_id in enumerate(file_ids, 1):
+            while queued < len(file_ids) and len(pending) < ZIP_FETCH_AHEAD:
+                pending.append(pool.submit(open_member, file_ids[queued], client))
+                queued += 1
+            entry, f, chunks = pending.popleft().result()
+            try:
+                body = read_file(f) if f is not None else chunks
+                yield from archive.member(member_name(number, width, entry, folder), body,
+                                          entry.modified)
+            finally:
+                close_member(entry, f, chunks)
+        yield from archive.finish()
+    except Exception as e:
+        # The status line is long gone: cut the archive short so it fails to open
+        print(f"[Archive] Aborted after {archive.offset} bytes: {str(e)}")
+        raise
+    finally:
+        for future in pending:
+            future.cancel()
+        pool.shutdown(wait=True)
+        for future in pending:
+            if not future.cancelled() and future.exception() is None:
+                close_member(*future.result())
+
+@app.route('/api/download/batch', methods=['GET', 'POST'])
+def download_batch():
+    """
+    Several tracks as one ZIP: ?ids=a,b,c (or a JSON body {"file_ids": [...]})
+    in the order given, or ?album=<name> (or {"album": ...}) for the tracks
+    of one catalog album.
+    """
+    params = request.get_json(silent=True) if request.method == 'POST' else None
+    if not isinstance(params, dict):
+        params = {}
+    file_ids = params.get('file_ids') or [i for i in request.args.get('ids', '').split(',') if i.strip()]
+    album = str(params.get('album') or request.args.get('album', ''))
+    folder = None
+    if album.strip() and not file_ids:
+        tracks = active_catalog(TRACKS_CSV_PATH).snapshot().album(album)
+        if not tracks:
+            return jsonify({'error': f"No album named {album!r}"}), 404
+        file_ids = [track['file_id'] for track in tracks]
+        folder = tracks[0]['album']
+    if not isinstance(file_ids, list) or not file_ids or \
+            not all(isinstance(i, str) and i.strip() for i in file_ids):
+        return jsonify({'error': 'Give a list of file_ids or an album'}), 400
+    if len(file_ids) > ZIP_MAX_TRACKS:
+        return jsonify({'error': f"At most {ZIP_MAX_TRACKS} tracks per archive"}), 400
+
+    file_ids = [i.strip() for i in file_ids]
+    # Each track fetched from Drive takes its own bulk slot; the first is
+    # opened now, so an archive that cannot start is a 503 rather than cut short
+    try:
+        body = primed(archive_body(file_ids, folder, request_client()))
+    except (CircuitOpenError, Overloaded) as e:
+        return upstream_unavailable(e)
+    except Exception as e:
+        return jsonify({'error': str(e)}), 400
+    headers = {'Content-Disposition': content_disposition(f"{folder or 'tracks'}.zip"),
+               'Cache-Control': 'no-store'}
+    return Response(body, 200, headers=headers, mimetype='application/zip',
+                    direct_passthrough=True)
+
+@app.route('/api/cache/stats', methods=['GET'])
+def cache_stats():
+    return jsonify({
+        'download': download_cache.stats(),
+        'range': range_cache.stats(),
+        'search': search_cache.stats(),
+        'seek': seek_index.stats(),
+        'prefetch': prefetcher.stats() if prefetcher is not None else None
+    })
+
+@app.route('/metrics', methods=['GET'])
+def metrics_endpoint():
+    """Prometheus text format, merged across every worker"""
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
+def open_range(resolution, first, last):
+    """Single upstream request for bytes first..last of a resolved file"""
+    upstream = resolver.open(resolution, first, last)
+    if upstream.status_code != 206:
+        upstream.close()
+        resolver.invalidate(resolution.file_id)
+        raise Exception(f"Upstream did not honor range request (status {upstream.status_code})")
+    return upstream
+
+def read_range(resolution, first, last):
+    upstream = open_range(resolution, first, last)
+    try:
+        return upstream.content
+    finally:
+        upstream.close()
+
+def parse_seek_time(value):
+    """Seconds from a ?t= parameter, or None if absent or not a number"""
+    try:
+        seconds = float(value)
+    except (TypeError, ValueError):
+        return None
+    return seconds if seconds == seconds else None
+
+def find_seek_start(resolution, seconds):
+    """
+    (FlacMetadata, frame search start offset, target sample) for a time seek,
+    or None if the track should be streamed from the start instead. Reads
+    the FLAC header upstream only the first time a track is seeked.
+    """
+    meta = seek_index.get(resolution.file_id, resolution.total_length,
+                          lambda first, last: read_range(resolution, first, last))
+    start = seek_target(meta, seconds, resolution.total_length)
+    return None if start is None else (meta, start[0], start[1])
+
+def seek_headers(content_type, total_length, meta, frame_offset, sample):
+    """Headers of a time-seek response: a STREAMINFO-only header followed by the frames from frame_offset"""
+    header = meta.stream_header(meta.total_samples - sample)
+    return header, {
+        'Content-Type': content_type,
+        'Content-Length': str(len(header) + total_length - frame_offset),
+        'Accept-Ranges': 'none',
+        'Cache-Control': 'no-cache',
+        'X-Seek-Time': f"{sample / meta.sample_rate:.3f}",
+    }
+
+def stream_from_time(resolution, meta, offset, target, client):
+    """
+    Response for /stream?t=: one cached-or-upstream read from the seek point
+    to the end of the file, skipping ahead to the frame that contains the
+    target sample before anything is sent. Upstream reads are admitted as
+    INTERACTIVE for client.
+    """
+    total = resolution.total_length
+    chunks = range_cache.read(resolution.file_id, total, offset, total - 1,
+                              lambda first, last: open_range(resolution, first, last),
+                              lambda: admission.admit(INTERACTIVE, client))
+    locator = FrameLocator(meta, target, offset, SEEK_SCAN_MAX_BYTES)
+    try:
+        for chunk in chunks:
+            if locator.feed(chunk):
+                break
+        frame_offset, sample, received = locator.result()
+    except BaseException:
+        chunks.close()
+        raise
+    header, headers = seek_headers(resolution.content_type, total, meta, frame_offset, sample)
+
+    def body():
+        try:
+            yield header
+            if received:
+                yield received
+            yield from chunks
+        finally:
+            chunks.close()
+
+    return Response(body(), 200, headers=headers, direct_passthrough=True)
+
+def open_cached_seek(entry, seconds):
+    """
+    (header, headers, file) of a time seek into a track in the download
+    cache, the file positioned at the frame to start from; the same
+    response stream_from_time() sends, read from local disk only. None if
+    the file was evicted since it was looked up or cannot be seeked to
+    that time (it is then served whole).
+    """
+    try:
+        f = open(entry.path, 'rb')
+    except FileNotFoundError:
+        return None
+    try:
+        size = os.fstat(f.fileno()).st_size
+        meta = seek_index.get(entry.key, size,
+                              lambda first, last: os.pread(f.fileno(), last - first + 1, first))
+        start = seek_target(meta, seconds, size)
+        if start is None:
+            f.close()
+            return None
+        offset, target = start
+        locator = FrameLocator(meta, target, offset, SEEK_SCAN_MAX_BYTES)
+        f.seek(offset)
+        while True:
+            chunk = f.read(DOWNLOAD_CHUNK_SIZE)
+            if not chunk or locator.feed(chunk):
+                break
+        frame_offset, sample, _ = locator.result()
+        f.seek(frame_offset)
+    except BaseException:
+        f.close()
+        raise
+    header, headers = seek_headers(entry.content_type, size, meta, frame_offset, sample)
+    return header, headers, f
+
+def seek_cached_file(entry, seconds):
+    """Response for /stream?t= from the download cache, or None (see open_cached_seek())"""
+    seek = open_cached_seek(entry, seconds)
+    if seek is None:
+        return None
+    header, headers, f = seek
+
+    def body():
+        try:
+            yield header
+            yield from read_file(f)
+        finally:
+            f.close()
+
+    return Response(body(), 200, headers=headers, direct_passthrough=True)
+
 @app.route('/stream/<file_id>')
 def stream(file_id):
     try:
-        session = requests.Session()
-        file_url = f"{BASE_EXPORT_URL}{file_id}"
-        
-        # Initial request to handle Google Drive's download page
-        response = session.get(file_url, stream=True)
-        if response.status_code != 200:
+        # A play from the start or from a time uses (or passes over) a prefetched head
+        seconds = parse_seek_time(request.args.get('t'))
+        if prefetcher is not None and (seconds is not None or
+                                       is_playback_start(request.headers.get('Range'))):
+            prefetcher.started(file_id)
+
+        # Tracks already downloaded are served from disk without asking Drive,
+        # time seeks included
+        entry = download_cache.get(file_id)
+        if entry is not None:
+            response = seek_cached_file(entry, seconds) if seconds is not None else None
+            if response is None:
+                response = send_cached_file(entry, {'Cache-Control': 'no-cache'})
+            if response is not None:
+                return response
+
+        try:
+            resolution = resolver.resolve(file_id)
+        except DriveFileNotFound:
             return jsonify({'error': 'Failed to access file'}), 404
 
-        # Handle Google Drive confirmation token
-        token = get_confirm_token(response)
-        if token:
-            params = {'id': file_id, 'confirm': token}
-            response = session.get(BASE_EXPORT_URL, params=params, stream=True)
-            if response.status_code != 200:
-                return jsonify({'error': 'Failed to confirm download'}), 400
-
-        # Determine content type and size
-        content_type = response.headers.get('Content-Type', 'audio/flac')
-        if 'content-disposition' in response.headers:
-            filename = response.headers['content-disposition'].split('filename=')[-1].strip('"')
-            content_type = get_content_type(filename)
-
-        content_length = response.headers.get('Content-Length')
-        if not content_length:
-            # If content length is not provided, we need to get it
-            response = session.get(file_url, stream=True, headers={'Range': 'bytes=0-1'})
-            content_length = response.headers.get('Content-Range', '').split('/')[-1]
-            if not content_length or content_length == '*':
-                return jsonify({'error': 'Could not determine file size'}), 400
-            # Reset the response for actual streaming
-            response = session.get(file_url, stream=True)
-
-        content_length = int(content_length)
-        
+        content_type = resolution.content_type
+        content_length = resolution.total_length
+        if content_length is None:
+            return jsonify({'error': 'Could not determine file size'}), 400
+
+        # ?t=<seconds> starts playback at a time instead of a byte offset.
+        # Times past the end (or non-FLAC files) play from the start.
+        if seconds is not None:
+            seek = find_seek_start(resolution, seconds)
+            if seek is not None:
+                return stream_from_time(resolution, *seek, request_client())
+
         # Handle range requests (for seeking in audio player)
-        range_header = request.headers.get('Range')
-        if range_header:
-            try:
-                bytes_range = range_header.replace('bytes=', '').split('-')
-                start = int(bytes_range[0])
-                end = int(bytes_range[1]) if bytes_range[1] else content_length - 1
-                
-                if start >= content_length:
-                    return Response(status=416)  # Range Not Satisfiable
-                
-                # Adjust end if it exceeds content_length
-                end = min(end, content_length - 1)
-                length = end - start + 1
-
-                # Make a new request with the range
-                headers = {'Range': f'bytes={start}-{end}'}
-                response = session.get(file_url, headers=headers, stream=True)
-                
-                if response.status_code == 206:  # Partial Content
-                    headers = {
-                        'Content-Type': content_type,
-                        'Accept-Ranges': 'bytes',
-                        'Content-Range': f'bytes {start}-{end}/{content_length}',
-                        'Content-Length': str(length),
-                        'Cache-Control': 'no-cache'
-                    }
-                    return Response(
-                        response.iter_content(chunk_size=8192),
-                        206,
-                        headers=headers,
-                        direct_passthrough=True
-                    )
-            except (ValueError, IndexError) as e:
-                print(f"Range parsing error: {str(e)}")
-                # If range parsing fails, fall back to full file
-                response = session.get(file_url, stream=True)
-
-        # Return full file if no range request or range parsing failed
+        try:
+            byte_range = parse_range(request.headers.get('Range'), content_length)
+        except RangeNotSatisfiable:
+            return Response(status=416)  # Range Not Satisfiable
+
+        if byte_range:
+            start, end = byte_range
+            status = 206
+        else:
+            start, end = 0, content_length - 1
+            status = 200
+
         headers = {
             'Content-Type': content_type,
             'Accept-Ranges': 'bytes',
-            'Content-Length': str(content_length),
+            'Content-Length': str(end - start + 1),
             'Cache-Control': 'no-cache'
         }
+        if status == 206:
+            headers['Content-Range'] = f'bytes {start}-{end}/{content_length}'
 
+        # Blocks already seen are served from local disk; each missing run
+        # of blocks costs one upstream request (and admission slot), shared
+        # with every other listener in this worker that needs those bytes
+        # while it runs
+        priority, client = stream_priority(start, end), request_client()
         return Response(
-            response.iter_content(chunk_size=8192),
-            200,
+            primed(range_cache.read(file_id, content_length, start, end,
+                                    lambda first, last: open_range(resolution, first, last),
+                                    lambda: admission.admit(priority, client))),
+            status,
             headers=headers,
             direct_passthrough=True
         )
 
+    except (CircuitOpenError, Overloaded) as e:
+        return upstream_unavailable(e)
     except requests.RequestException as e:
         print(f"Streaming error (RequestException): {str(e)}")
         return jsonify({'error': 'Failed to stream file'}), 500
@@ -281,4 +809,5 @@ def test():
     return response
 
 if __name__ == '__main__':
+    metrics.start()
     app.run(debug=True)
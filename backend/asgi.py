@@ -0,0 +1,474 @@
+"""
+Asyncio serving mode.
+
+/stream and /api/download are served natively on the event loop with an
+async upstream client, so a slow listener costs an open socket instead of a
+whole worker. Every other route (search, test, cache stats, ...) is handed to
+the Flask app unchanged. Select it with SERVER_MODE=asgi (see gunicorn.conf.py).
+"""
+import asyncio
+import json
+import os
+import time
+from urllib.parse import parse_qs
+import httpx
+from asgiref.wsgi import WsgiToAsgi
+from app import (app as flask_app, resolver, range_cache, download_cache, open_download,
+                 content_disposition, parse_seek_time, find_seek_start, seek_headers, open_cached_seek,
+                 read_file, admission, prefetcher)
+from config import (UPSTREAM_CONNECT_TIMEOUT, UPSTREAM_READ_TIMEOUT,
+                    ASYNC_UPSTREAM_MAX_CONNECTIONS, SEEK_SCAN_MAX_BYTES)
+from utils.drive_resolver import DriveFileNotFound
+from utils.http_range import parse_range, RangeNotSatisfiable
+from utils.flac_seek import FrameLocator
+from utils.local_file import file_validators, plan_file_response, mmap_body, seek_to_body
+from utils import metrics
+from utils.admission import Overloaded, INTERACTIVE, client_key, stream_priority
+from utils.prefetch import is_playback_start
+from utils.upstream import CircuitOpenError, get_client, RETRYABLE_STATUSES
+
+# ASGI zero-copy send: the scope extension and the message type share this name
+ZEROCOPY_EXTENSION = 'http.response.zerocopysend'
+
+wsgi_app = WsgiToAsgi(flask_app)
+_http_client = None
+
+
+def get_async_client():
+    """Return the event loop's shared httpx client, creating it on first use"""
+    global _http_client
+    if _http_client is None:
+        _http_client = httpx.AsyncClient(
+            timeout=httpx.Timeout(UPSTREAM_READ_TIMEOUT, connect=UPSTREAM_CONNECT_TIMEOUT),
+            limits=httpx.Limits(max_connections=ASYNC_UPSTREAM_MAX_CONNECTIONS,
+                                max_keepalive_connections=ASYNC_UPSTREAM_MAX_CONNECTIONS),
+            follow_redirects=True,
+        )
+    return _http_client
+
+
+def _cors_headers(scope):
+    origin = dict(scope['headers']).get(b'origin')
+    return [
+        (b'access-control-allow-origin', origin or b'*'),
+        (b'access-control-expose-headers', b'Content-Range, Accept-Ranges, Content-Length, X-Seek-Time'),
+    ]
+
+
+async def _send_json(scope, send, status, payload, extra_headers=()):
+    body = json.dumps(payload).encode('utf-8')
+    headers = [(b'content-type', b'application/json'),
+               (b'content-length', str(len(body)).encode())]
+    headers.extend(extra_headers)
+    headers.extend(_cors_headers(scope))
+    await send({'type': 'http.response.start', 'status': status, 'headers': headers})
+    await send({'type': 'http.response.body', 'body': body})
+
+
+async def _send_unavailable(scope, send, error):
+    await _send_json(scope, send, 503, {'error': str(error)},
+                     [(b'retry-after', str(int(error.retry_after + 0.5)).encode())])
+
+
+async def _start_and_send_body(send, status, headers, chunks):
+    """Send the response start, then the body; chunks is closed even if the start fails"""
+    try:
+        await send({'type': 'http.response.start', 'status': status, 'headers': headers})
+    except BaseException:
+        await chunks.aclose()
+        raise
+    await _send_body(send, chunks)
+
+
+def _client(scope):
+    """Whose bandwidth a request counts against; see app.request_client()"""
+    client = scope.get('client')
+    forwarded = dict(scope['headers']).get(b'x-forwarded-for')
+    return client_key(client[0] if client else None,
+                      forwarded.decode('latin-1') if forwarded else None)
+
+
+async def _primed(chunks):
+    """Async twin of app.primed(): chunks, run up to its first chunk before the response starts"""
+    try:
+        first = await chunks.__anext__()
+    except StopAsyncIteration:
+        first = None
+    except BaseException:
+        await chunks.aclose()
+        raise
+
+    async def body():
+        try:
+            if first is not None:
+                yield first
+            async for chunk in chunks:
+                yield chunk
+        finally:
+            await chunks.aclose()
+
+    return body()
+
+
+async def _send_body(send, chunks):
+    """Relay an async iterator of chunks, always closing it (e.g. on client disconnect)"""
+    try:
+        async for chunk in chunks:
+            await send({'type': 'http.response.body', 'body': chunk, 'more_body': True})
+        await send({'type': 'http.response.body', 'body': b''})
+    finally:
+        await chunks.aclose()
+
+
+async def _upstream_range(resolution, first, last):
+    """Async equivalent of resolver.open() for one ranged GET, sharing the circuit breaker"""
+    breaker = get_client().breaker
+    trial = breaker.before_call()
+    headers = {'Range': f'bytes={first}-{last}'}
+    if resolution.cookies:
+        headers['Cookie'] = '; '.join(f'{k}={v}' for k, v in resolution.cookies.items())
+
+    request = get_async_client().build_request('GET', resolution.url, params=resolution.params,
+                                               headers=headers)
+    started = time.perf_counter()
+    try:
+        try:
+            response = await get_async_client().send(request, stream=True)
+        except httpx.HTTPError:
+            breaker.record_failure(trial)
+            raise
+        if response.status_code in RETRYABLE_STATUSES:
+            breaker.record_failure(trial)
+        else:
+            breaker.record_success()
+    finally:
+        # A cancelled or otherwise failed half-open trial must not stay in flight
+        breaker.end_trial(trial)
+    metrics.UPSTREAM_TTFB.observe(time.perf_counter() - started)
+    received = 0
+    reading = 0.0
+    try:
+        if response.status_code != 206:
+            resolver.invalidate(resolution.file_id)
+            raise Exception(f"Upstream did not honor range request (status {response.status_code})")
+        chunks = response.aiter_bytes()
+        while True:
+            started = time.perf_counter()
+            try:
+                chunk = await chunks.__anext__()
+            except StopAsyncIteration:
+                break
+            reading += time.perf_counter() - started
+            received += len(chunk)
+            yield chunk
+    finally:
+        await response.aclose()
+        metrics.UPSTREAM_BYTES.inc(amount=received)
+        if received and reading > 0:
+            metrics.UPSTREAM_THROUGHPUT.observe(received / reading)
+
+
+async def _seek_body(resolution, meta, offset, target, client):
+    """Async twin of app.stream_from_time(): (headers, body chunks) of a time seek"""
+    total = resolution.total_length
+    chunks = range_cache.aread(resolution.file_id, total, offset, total - 1,
+                               lambda first, last: _upstream_range(resolution, first, last),
+                               lambda: admission.aadmit(INTERACTIVE, client))
+    locator = FrameLocator(meta, target, offset, SEEK_SCAN_MAX_BYTES)
+    try:
+        async for chunk in chunks:
+            if locator.feed(chunk):
+                break
+        frame_offset, sample, received = locator.result()
+    except BaseException:
+        await chunks.aclose()
+        raise
+    header, headers = seek_headers(resolution.content_type, total, meta, frame_offset, sample)
+
+    async def body():
+        try:
+            yield header
+            if received:
+                yield received
+            async for chunk in chunks:
+                yield chunk
+        finally:
+            await chunks.aclose()
+
+    return headers, body()
+
+
+async def stream(scope, receive, send, file_id):
+    query = parse_qs(scope.get('query_string', b'').decode('latin-1'))
+    seconds = parse_seek_time(query.get('t', [None])[0])
+
+    if prefetcher is not None and (seconds is not None or is_playback_start(
+            dict(scope['headers']).get(b'range', b'').decode('latin-1'))):
+        prefetcher.started(file_id)
+
+    # Tracks already downloaded are served from disk without asking Drive,
+    # time seeks included
+    entry = download_cache.get(file_id)
+    if entry is not None:
+        if seconds is not None and await _send_cached_seek(scope, send, entry, seconds):
+            return
+        if await _send_cached_file(scope, send, entry, {'Cache-Control': 'no-cache'}):
+            return
+
+    try:
+        resolution = await asyncio.to_thread(resolver.resolve, file_id)
+    except DriveFileNotFound:
+        return await _send_json(scope, send, 404, {'error': 'Failed to access file'})
+    except CircuitOpenError as e:
+        return await _send_unavailable(scope, send, e)
+    except Exception as e:
+        print(f"Streaming error (General): {str(e)}")
+        return await _send_json(scope, send, 500, {'error': 'Internal server error'})
+
+    content_length = resolution.total_length
+    if content_length is None:
+        return await _send_json(scope, send, 400, {'error': 'Could not determine file size'})
+
+    # ?t=<seconds>: see app.stream(). The header lookup may block on one
+    # small upstream request, so it runs on a worker thread.
+    if seconds is not None:
+        try:
+            seek = await asyncio.to_thread(find_seek_start, resolution, seconds)
+            if seek is not None:
+                seek = await _seek_body(resolution, *seek, _client(scope))
+        except (CircuitOpenError, Overloaded) as e:
+            return await _send_unavailable(scope, send, e)
+        except Exception as e:
+            print(f"Streaming error (General): {str(e)}")
+            return await _send_json(scope, send, 500, {'error': 'Internal server error'})
+        if seek is not None:
+            seek_response_headers, body = seek
+            headers = [(name.lower().encode(), value.encode())
+                       for name, value in seek_response_headers.items()]
+            headers.extend(_cors_headers(scope))
+            return await _start_and_send_body(send, 200, headers, body)
+
+    range_header = dict(scope['headers']).get(b'range', b'').decode('latin-1')
+    try:
+        byte_range = parse_range(range_header, content_length)
+    except RangeNotSatisfiable:
+        return await _send_json(scope, send, 416, {'error': 'Range Not Satisfiable'})
+
+    if byte_range:
+        start, end = byte_range
+        status = 206
+    else:
+        start, end = 0, content_length - 1
+        status = 200
+
+    headers = [
+        (b'content-type', resolution.content_type.encode()),
+        (b'accept-ranges', b'bytes'),
+        (b'content-length', str(end - start + 1).encode()),
+        (b'cache-control', b'no-cache'),
+    ]
+    if status == 206:
+        headers.append((b'content-range', f'bytes {start}-{end}/{content_length}'.encode()))
+    headers.extend(_cors_headers(scope))
+
+    priority, client = stream_priority(start, end), _client(scope)
+    try:
+        body = await _primed(range_cache.aread(
+            file_id, content_length, start, end,
+            lambda first, last: _upstream_range(resolution, first, last),
+            lambda: admission.aadmit(priority, client)))
+    except (CircuitOpenError, Overloaded) as e:
+        return await _send_unavailable(scope, send, e)
+    except Exception as e:
+        print(f"Streaming error (General): {str(e)}")
+        return await _send_json(scope, send, 500, {'error': 'Internal server error'})
+    await _start_and_send_body(send, status, headers, body)
+
+
+class _ScopeHeaders:
+    """Case-insensitive .get() over an ASGI scope's request headers"""
+
+    def __init__(self, scope):
+        self._headers = {name.decode('latin-1').lower(): value.decode('latin-1')
+                         for name, value in scope['headers']}
+
+    def get(self, name, default=None):
+        return self._headers.get(name.lower(), default)
+
+
+async def _iterate(chunks):
+    try:
+        for chunk in chunks:
+            yield chunk
+    finally:
+        chunks.close()
+
+
+async def _send_cached_file(scope, send, entry, extra_headers):
+    """
+    Async twin of app.send_cached_file(). The body goes out with the
+    server's zero-copy extension when it offers one, else as mmap slices.
+    Returns False if the file was evicted since it was looked up.
+    """
+    try:
+        f = open(entry.path, 'rb')
+    except FileNotFoundError:
+        return False
+    try:
+        st = os.fstat(f.fileno())
+        etag, last_modified = file_validators(st, entry.modified)
+        plan = plan_file_response(_ScopeHeaders(scope), st.st_size, entry.content_type,
+                                  etag, last_modified, extra_headers)
+        headers = [(name.lower().encode(), value.encode('latin-1'))
+                   for name, value in plan.headers.items()]
+        headers.extend(_cors_headers(scope))
+        await send({'type': 'http.response.start', 'status': plan.status, 'headers': headers})
+        if plan.status in (304, 416) or scope['method'] == 'HEAD':
+            f.close()
+            await send({'type': 'http.response.body', 'body': b''})
+            return True
+        if ZEROCOPY_EXTENSION in scope.get('extensions', {}) and seek_to_body(f, plan):
+            with f:
+                await send({'type': ZEROCOPY_EXTENSION, 'file': f,
+                            'count': int(plan.headers['Content-Length'])})
+            return True
+    except BaseException:
+        f.close()
+        raise
+    await _send_body(send, _iterate(mmap_body(f, plan)))
+    return True
+
+
+async def _send_cached_seek(scope, send, entry, seconds):
+    """
+    Async twin of app.seek_cached_file(). Returns False if the file was
+    evicted or cannot be seeked to that time.
+    """
+    try:
+        seek = await asyncio.to_thread(open_cached_seek, entry, seconds)
+    except Exception as e:
+        print(f"Streaming error (General): {str(e)}")
+        await _send_json(scope, send, 500, {'error': 'Internal server error'})
+        return True
+    if seek is None:
+        return False
+    header, seek_response_headers, f = seek
+    headers = [(name.lower().encode(), value.encode()) for name, value in seek_response_headers.items()]
+    headers.extend(_cors_headers(scope))
+
+    async def body():
+        try:
+            yield header
+            async for chunk in _iterate(read_file(f)):
+                yield chunk
+        finally:
+            f.close()
+
+    await _start_and_send_body(send, 200, headers, body())
+    return True
+
+
+async def _iterate_in_thread(chunks):
+    """Drive a blocking chunk iterator (a download filling the cache) from worker threads"""
+    try:
+        while True:
+            chunk = await asyncio.to_thread(next, chunks, None)
+            if chunk is None:
+                break
+            yield chunk
+    finally:
+        chunks.close()
+
+
+async def download(scope, receive, send, file_id):
+    # A hit is sent from the disk cache on the event loop. A miss is sent as
+    # it is fetched into the cache (or as another client's fetch progresses);
+    # waiting for those bytes happens on worker threads.
+    client = _client(scope)
+    try:
+        entry, chunks = await asyncio.to_thread(open_download, file_id, client)
+    except (CircuitOpenError, Overloaded) as e:
+        return await _send_unavailable(scope, send, e)
+    except Exception as e:
+        return await _send_json(scope, send, 400, {'error': str(e)})
+
+    filename = entry.filename or f"{file_id}.file"
+    if chunks is None:
+        if await _send_cached_file(scope, send, entry,
+                                   {'Content-Disposition': content_disposition(filename)}):
+            return
+        # Evicted between lookup and open: fetch it again
+        entry, chunks = await asyncio.to_thread(open_download, file_id, client)
+        if chunks is None:
+            return await _send_json(scope, send, 500, {'error': 'Internal server error'})
+
+    headers = [
+        (b'content-type', entry.content_type.encode()),
+        (b'content-disposition', content_disposition(filename).encode('latin-1')),
+        (b'access-control-allow-credentials', b'true'),
+    ]
+    if entry.size is not None:
+        headers.append((b'content-length', str(entry.size).encode()))
+    headers.extend(_cors_headers(scope))
+    await _start_and_send_body(send, 200, headers, _iterate_in_thread(chunks))
+
+
+async def lifespan(scope, receive, send):
+    while True:
+        message = await receive()
+        if message['type'] == 'lifespan.startup':
+            await send({'type': 'lifespan.startup.complete'})
+        elif message['type'] == 'lifespan.shutdown':
+            if _http_client is not None:
+                await _http_client.aclose()
+            await send({'type': 'lifespan.shutdown.complete'})
+            return
+
+
+def _match(path, prefix):
+    """Return the single path segment after prefix, or None"""
+    if path.startswith(prefix):
+        rest = path[len(prefix):]
+        if rest and '/' not in rest:
+            return rest
+    return None
+
+
+async def _measured(handler, route, scope, receive, send, file_id):
+    """Run a native handler recording the metrics MetricsMiddleware records for Flask routes"""
+    started = time.perf_counter()
+    sent = 0
+
+    async def measured_send(message):
+        nonlocal sent
+        if message['type'] == 'http.response.start':
+            metrics.REQUEST_LATENCY.observe(time.perf_counter() - started, route, scope['method'],
+                                            str(message['status']))
+        elif message['type'] == 'http.response.body':
+            sent += len(message.get('body', b''))
+        elif message['type'] == ZEROCOPY_EXTENSION:
+            sent += message.get('count', 0)
+        await send(message)
+
+    metrics.ACTIVE_RESPONSES.inc(route)
+    try:
+        await handler(scope, receive, measured_send, file_id)
+    finally:
+        metrics.ACTIVE_RESPONSES.dec(route)
+        metrics.RESPONSE_BYTES.inc(route, amount=sent)
+
+
+async def app(scope, receive, send):
+    if scope['type'] == 'lifespan':
+        return await lifespan(scope, receive, send)
+
+    if scope['type'] == 'http' and scope['method'] == 'GET':
+        file_id = _match(scope['path'], '/stream/')
+        if file_id:
+            return await _measured(stream, '/stream/<file_id>', scope, receive, send, file_id)
+        file_id = _match(scope['path'], '/api/download/')
+        if file_id and file_id != 'batch':  # Archives stream from the Flask app
+            return await _measured(download, '/api/download/<file_id>', scope, receive, send,
+                                   file_id)
+
+    await wsgi_app(scope, receive, send)
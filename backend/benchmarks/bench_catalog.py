@@ -0,0 +1,51 @@
+"""
+Micro-benchmark: write and search cost of the CSV and SQLite catalog backends.
+
+Run from the backend directory:
+    python -m benchmarks.bench_catalog --sizes 1000 10000 100000
+"""
+import argparse
+import os
+import statistics
+import tempfile
+from benchmarks.bench_search import QUERIES, make_catalog, time_call
+from utils.catalog import Catalog
+from utils.catalog_db import SqliteCatalog
+
+
+def new_tracks(start, count):
+    return [{'title': f'New Upload {i}', 'artist': 'Arijit Singh', 'album': 'Uploads',
+             'file_id': f'upload{i:08d}'} for i in range(start, start + count)]
+
+
+def run(sizes, repeat, batch, limit):
+    print(f"{'rows':>8} {'csv upsert ms':>14} {'sqlite upsert ms':>17} {'sqlite search ms':>17}")
+    for size in sizes:
+        df = make_catalog(size)
+        records = df.to_dict('records')
+        with tempfile.TemporaryDirectory() as tmp:
+            csv_catalog = Catalog(os.path.join(tmp, 'tracks.csv'))
+            csv_catalog.replace_tracks(records)
+            store = SqliteCatalog(os.path.join(tmp, 'tracks.db'))
+            store.replace_tracks(records)
+
+            counter = iter(range(0, 10 ** 9, batch))
+            csv_write = time_call(lambda: csv_catalog.upsert_tracks(new_tracks(next(counter), batch)),
+                                  max(1, repeat // 4))
+            sqlite_write = time_call(lambda: store.upsert_tracks(new_tracks(next(counter), batch)), repeat)
+
+            snapshot = store.snapshot()
+            search = statistics.mean(
+                time_call(lambda: snapshot.page(q, 0, limit), repeat) for q in QUERIES)
+
+        print(f"{size:>8} {csv_write:>14.3f} {sqlite_write:>17.3f} {search:>17.3f}")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 10000, 100000])
+    parser.add_argument('--repeat', type=int, default=20)
+    parser.add_argument('--batch', type=int, default=10, help='tracks added per upload')
+    parser.add_argument('--limit', type=int, default=50, help='results per search page')
+    args = parser.parse_args()
+    run(args.sizes, args.repeat, args.batch, args.limit)
@@ -0,0 +1,84 @@
+"""
+Benchmark: /api/download on a cache miss, against a throttled fake Drive.
+
+Reports time to first byte and to the full body for one cold download, then
+starts several clients on another cold file at once and counts the upstream
+downloads they cause (the resolver's one-byte probe is not counted).
+--segments sets how many concurrent ranges each cold download is split
+into; the fake Drive throttles each connection separately, as Drive does.
+
+Run from the backend directory:
+    python -m benchmarks.bench_download --size 20000000 --bandwidth 10000000 --clients 8 --segments 4
+"""
+import argparse
+import os
+import tempfile
+import threading
+import time
+from benchmarks.fake_drive import start_fake_drive
+
+
+def timed_download(client, file_id, results):
+    started = time.perf_counter()
+    response = client.get(f'/api/download/{file_id}', buffered=False)
+    first = None
+    size = 0
+    try:
+        for chunk in response.response:
+            if first is None:
+                first = time.perf_counter() - started
+            size += len(chunk)
+    finally:
+        response.close()
+    results.append((first, time.perf_counter() - started, size))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--size', type=int, default=20_000_000, help='track size in bytes')
+    parser.add_argument('--bandwidth', type=int, default=10_000_000, help='upstream bytes/second')
+    parser.add_argument('--clients', type=int, default=8)
+    parser.add_argument('--segments', type=int, default=1, help='concurrent ranges per download')
+    args = parser.parse_args()
+
+    drive = start_fake_drive(args.size, bandwidth=args.bandwidth)
+    with tempfile.TemporaryDirectory() as tmp:
+        # Must be set before the app (and config) is imported
+        os.environ['DRIVE_EXPORT_URL'] = drive.export_url
+        os.environ['DOWNLOAD_CACHE_DIR'] = os.path.join(tmp, 'downloads')
+        os.environ['DOWNLOAD_SEGMENTS'] = str(args.segments)
+        os.environ['DOWNLOAD_MIN_SEGMENT_BYTES'] = str(args.size // args.segments)
+        from app import app, download_cache
+        client = app.test_client()
+
+        results = []
+        timed_download(client, 'single', results)
+        first, total, size = results[0]
+        assert size == args.size, size
+        print(f"cold download: first byte {first * 1000:.0f} ms, complete {total:.2f} s")
+
+        results = []
+        timed_download(client, 'single', results)
+        print(f"cached download: first byte {results[0][0] * 1000:.0f} ms, "
+              f"complete {results[0][1]:.2f} s")
+
+        downloads = drive.bytes_requested
+        results = []
+        threads = [threading.Thread(target=timed_download, args=(app.test_client(), 'shared', results))
+                   for _ in range(args.clients)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        assert all(size == args.size for _, _, size in results)
+        full_fetches = (drive.bytes_requested - downloads) // args.size
+        print(f"{args.clients} concurrent clients: {full_fetches} upstream download(s), "
+              f"slowest first byte {max(r[0] for r in results) * 1000:.0f} ms")
+        # The last client can finish just before the download is committed
+        while download_cache.get('shared') is None:
+            time.sleep(0.01)
+    drive.shutdown()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,79 @@
+"""
+Benchmark: many listeners streaming the same cold track at once.
+
+Starts --listeners clients on /stream/<id> a little apart, as a popular new
+track would see, against a throttled fake Drive. One of them reads slowly
+and drops out of the shared ring buffer. Reports upstream requests and
+bytes against bytes served, from the fake Drive and /api/cache/stats.
+
+Run from the backend directory:
+    python -m benchmarks.bench_listeners --size 8000000 --bandwidth 4000000 --listeners 16
+"""
+import argparse
+import json
+import os
+import tempfile
+import threading
+import time
+from benchmarks.fake_drive import start_fake_drive, make_payload
+
+
+def listen(client, file_id, payload, delay, results):
+    """Stream the whole track; delay seconds after each chunk simulates a slow reader"""
+    response = client.get(f'/stream/{file_id}', buffered=False)
+    data = bytearray()
+    try:
+        for chunk in response.response:
+            data += chunk
+            if delay:
+                time.sleep(delay)
+    finally:
+        response.close()
+    results.append(bytes(data) == payload)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--size', type=int, default=8_000_000, help='track size in bytes')
+    parser.add_argument('--bandwidth', type=int, default=4_000_000, help='upstream bytes/second')
+    parser.add_argument('--listeners', type=int, default=16)
+    parser.add_argument('--stagger', type=float, default=0.05, help='seconds between listener starts')
+    args = parser.parse_args()
+
+    drive = start_fake_drive(args.size, bandwidth=args.bandwidth)
+    payload = make_payload(args.size)
+    with tempfile.TemporaryDirectory() as tmp:
+        # Must be set before the app (and config) is imported
+        os.environ['DRIVE_EXPORT_URL'] = drive.export_url
+        os.environ['RANGE_CACHE_DIR'] = os.path.join(tmp, 'ranges')
+        os.environ['DOWNLOAD_CACHE_DIR'] = os.path.join(tmp, 'downloads')
+        from app import app
+
+        requests, upstream = drive.requests, drive.bytes_requested
+        results = []
+        threads = []
+        started = time.perf_counter()
+        for i in range(args.listeners):
+            delay = 0.05 if i == 1 else 0
+            thread = threading.Thread(target=listen, args=(app.test_client(), 'popular', payload,
+                                                           delay, results))
+            thread.start()
+            threads.append(thread)
+            time.sleep(args.stagger)
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - started
+        assert len(results) == args.listeners and all(results), results
+
+        stats = json.loads(app.test_client().get('/api/cache/stats').data)['range']
+        served = args.size * args.listeners
+        print(f"{args.listeners} listeners in {elapsed:.2f} s: "
+              f"{drive.requests - requests} upstream request(s), "
+              f"{(drive.bytes_requested - upstream) / served:.3f} upstream bytes per byte served")
+        print(f"range cache: upstream_ratio {stats['upstream_ratio']:.3f}, "
+              f"broadcast {json.dumps(stats['broadcast'])}")
+    drive.shutdown()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,78 @@
+"""
+Benchmark: CPU cost of relaying an upstream body, iter_content vs. Relay.
+
+Each method reads a track from an unthrottled fake Drive through the shared
+upstream client and writes every chunk to /dev/null, one write per chunk as
+a server writes to its client. CPU time is measured on the relaying thread
+only (the fake Drive's threads are not counted) and reported per GB.
+
+Run from the backend directory:
+    python -m benchmarks.bench_relay --size 64000000 --repeat 8
+"""
+import argparse
+import os
+import resource
+import time
+from benchmarks.fake_drive import start_fake_drive
+from utils.relay import Relay
+from utils.upstream import get_client
+
+
+def thread_cpu():
+    usage = resource.getrusage(resource.RUSAGE_THREAD)
+    return usage.ru_utime + usage.ru_stime
+
+
+def iter_content_chunks(chunk_size):
+    def chunks(response):
+        try:
+            yield from response.iter_content(chunk_size=chunk_size)
+        finally:
+            response.close()
+    return chunks
+
+
+def relay_chunks(response):
+    return iter(Relay(response))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--size', type=int, default=64_000_000, help='track size in bytes')
+    parser.add_argument('--repeat', type=int, default=8, help='transfers per method')
+    args = parser.parse_args()
+
+    drive = start_fake_drive(args.size)
+    client = get_client()
+    sink = os.open(os.devnull, os.O_WRONLY)
+
+    methods = [
+        ('iter_content 8 KiB', iter_content_chunks(8192)),
+        ('iter_content 64 KiB', iter_content_chunks(64 * 1024)),
+        ('Relay (adaptive)', relay_chunks),
+    ]
+    print(f"{'method':>20} {'CPU s/GB':>9} {'MB/s':>8} {'chunks/transfer':>16}")
+    for name, chunks_of in methods:
+        cpu = 0.0
+        wall = 0.0
+        chunks = 0
+        for _ in range(args.repeat):
+            response = client.get(f'{drive.export_url}bench', headers={'Range': 'bytes=0-'})
+            started_cpu, started = thread_cpu(), time.perf_counter()
+            size = 0
+            for chunk in chunks_of(response):
+                os.write(sink, chunk)
+                size += len(chunk)
+                chunks += 1
+            cpu += thread_cpu() - started_cpu
+            wall += time.perf_counter() - started
+            assert size == args.size, size
+        total = args.size * args.repeat
+        print(f"{name:>20} {cpu / (total / 1e9):>9.2f} {total / wall / 1e6:>8.0f} "
+              f"{chunks / args.repeat:>16.0f}")
+    os.close(sink)
+    drive.shutdown()
+
+
+if __name__ == '__main__':
+    main()
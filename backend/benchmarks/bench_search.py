@@ -0,0 +1,107 @@
+"""
+Micro-benchmark: ranked SearchIndex vs. the pandas scan /api/search used to do.
+
+Run from the backend directory:
+    python -m benchmarks.bench_search --sizes 1000 10000 100000
+"""
+import argparse
+import itertools
+import os
+import random
+import statistics
+import tempfile
+import time
+import pandas as pd
+from utils.search_engine import SearchIndex
+
+WORDS = [
+    'dil', 'pyaar', 'ishq', 'mohabbat', 'zindagi', 'sapna', 'raat', 'din', 'chand',
+    'tere', 'mere', 'saath', 'yaad', 'aankhon', 'baarish', 'safar', 'rang', 'jaana',
+    'kahin', 'door', 'paas', 'hawa', 'dhadkan', 'jaadu', 'nazar', 'khwaab', 'sawaar',
+    'chaiyya', 'mastani', 'haseena', 'tamanna', 'duniya', 'aasmaan', 'zameen', 'pal',
+]
+ARTISTS = [
+    'Kishore Kumar', 'Mohammed Rafi', 'Lata Mangeshkar', 'Asha Bhosle', 'Arijit Singh',
+    'Shreya Ghoshal', 'Sonu Nigam', 'Sukhwinder Singh', 'Jagjit Singh', 'A.R. Rahman',
+    'Mukesh', 'Hemant Kumar', 'Sunidhi Chauhan', 'Udit Narayan', 'Alka Yagnik',
+]
+QUERIES = ['rafi', 'kishore kumar', 'dil', 'zindagi safar', 'chaiya', 'mastani', 'arjit sing']
+
+
+SYLLABLES = ['ka', 'ra', 'ma', 'na', 'ja', 'sa', 'dil', 'pya', 'ri', 'ya', 'tu', 'mein',
+             'ha', 'zi', 'ba', 'la', 'chan', 'dar', 'wa', 'ni', 'go', 'pal', 'shi', 'aa']
+
+
+def make_vocabulary(rng, size):
+    """Known words plus generated pseudo-Hindi words, most common first"""
+    words = list(WORDS)
+    while len(words) < size:
+        words.append(''.join(rng.choice(SYLLABLES) for _ in range(rng.randint(2, 4))))
+    return words
+
+
+def make_catalog(size, seed=0):
+    """Synthetic catalog with film-music style titles, artists and albums"""
+    rng = random.Random(seed)
+    vocabulary = make_vocabulary(rng, max(200, size // 10))
+    # Zipf-like word frequencies: a few words are everywhere, most are rare.
+    # Cumulative once, or every choices() call re-sums the whole vocabulary
+    cum_weights = list(itertools.accumulate(1.0 / (rank + 1) for rank in range(len(vocabulary))))
+
+    def phrase(low, high):
+        return ' '.join(rng.choices(vocabulary, cum_weights=cum_weights, k=rng.randint(low, high))).title()
+
+    rows = []
+    for i in range(size):
+        artist = rng.choice(ARTISTS)
+        if rng.random() < 0.3:
+            artist += ' & ' + rng.choice(ARTISTS)
+        rows.append((phrase(1, 4), artist, phrase(1, 2), f'file{i:08d}'))
+    return pd.DataFrame(rows, columns=['title', 'artist', 'album', 'file_id'])
+
+
+def pandas_scan(df, query):
+    """The per-request scan app.search_tracks used to run (after read_csv)"""
+    query = query.lower()
+    mask = df['title'].str.lower().str.contains(query, na=False) | \
+           df['artist'].str.lower().str.contains(query, na=False)
+    return df[mask].to_dict('records')
+
+
+def time_call(fn, repeat):
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        samples.append(time.perf_counter() - start)
+    return statistics.median(samples) * 1000
+
+
+def run(sizes, repeat, limit):
+    print(f"{'rows':>8} {'read_csv+scan ms':>17} {'scan ms':>9} {'index ms':>9} {'build s':>8}")
+    for size in sizes:
+        df = make_catalog(size)
+        with tempfile.TemporaryDirectory() as tmp:
+            csv_path = os.path.join(tmp, 'tracks.csv')
+            df.to_csv(csv_path, index=False)
+            with_read = statistics.mean(
+                time_call(lambda: pandas_scan(pd.read_csv(csv_path), q), max(1, repeat // 10))
+                for q in QUERIES)
+
+        scan = statistics.mean(time_call(lambda: pandas_scan(df, q), repeat) for q in QUERIES)
+
+        start = time.perf_counter()
+        index = SearchIndex(df.columns, list(df.itertuples(index=False, name=None)))
+        build = time.perf_counter() - start
+        indexed = statistics.mean(time_call(lambda: index.search(q, limit), repeat) for q in QUERIES)
+
+        print(f"{size:>8} {with_read:>17.3f} {scan:>9.3f} {indexed:>9.3f} {build:>8.2f}")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 10000, 100000])
+    parser.add_argument('--repeat', type=int, default=20)
+    parser.add_argument('--limit', type=int, default=50, help='results requested from the index')
+    args = parser.parse_args()
+    run(args.sizes, args.repeat, args.limit)
@@ -0,0 +1,204 @@
+"""
+Benchmark: seeking into a FLAC track, /stream?t= vs. byte-range guessing.
+
+A player that can only ask for byte ranges has to guess where a time is,
+look for a frame header in what comes back and bisect until it lands near
+the target, then start the real stream. /stream/<id>?t= does the mapping on
+the server from the cached seek table. Both run in-process against a fake
+Drive serving a synthetic FLAC file with real frame headers; every seek uses
+a new file_id, so nothing is in the range cache yet.
+
+Run from the backend directory:
+    python -m benchmarks.bench_seek --seconds 120 --seeks 20
+"""
+import argparse
+import io
+import os
+import random
+import statistics
+import struct
+import tempfile
+import time
+from benchmarks.fake_drive import start_fake_drive
+from utils.flac_meta import crc8, read_flac_metadata
+from utils.flac_seek import FrameLocator
+
+PROBE_BYTES = 64 * 1024    # Size of each range a guessing player asks for
+FIRST_AUDIO_BYTES = 64 * 1024
+
+
+def _crc16_table():
+    table = []
+    for byte in range(256):
+        crc = byte << 8
+        for _ in range(8):
+            crc = ((crc << 1) ^ 0x8005) & 0xFFFF if crc & 0x8000 else (crc << 1) & 0xFFFF
+        table.append(crc)
+    return table
+
+
+_CRC16_TABLE = _crc16_table()
+
+
+def crc16(data):
+    crc = 0
+    table = _CRC16_TABLE
+    for byte in data:
+        crc = ((crc << 8) & 0xFFFF) ^ table[(crc >> 8) ^ byte]
+    return crc
+
+
+def _coded_number(number):
+    """FLAC's UTF-8-like frame number coding"""
+    if number < 0x80:
+        return bytes([number])
+    extra = 1
+    while number >= 1 << (6 * extra + 6 - extra):
+        extra += 1
+    lead = (0xFF00 >> (extra + 1)) & 0xFF
+    out = [lead | (number >> (6 * extra))]
+    for shift in range(extra - 1, -1, -1):
+        out.append(0x80 | ((number >> (6 * shift)) & 0x3F))
+    return bytes(out)
+
+
+def _block(block_type, data, last=False):
+    return bytes([(0x80 if last else 0) | block_type]) + len(data).to_bytes(3, 'big') + data
+
+
+def make_flac_stream(seconds, sample_rate=44100, block_size=4096, seek_interval=10, seed=0):
+    """
+    A valid 16-bit stereo FLAC stream of noise in VERBATIM subframes, with a
+    seek point every seek_interval seconds. Noise keeps false frame sync
+    codes in the audio data, as real music has.
+    """
+    rng = random.Random(seed)
+    total_samples = seconds * sample_rate
+    frames = []
+    frame_offsets = []
+    position = 0
+    for number, first in enumerate(range(0, total_samples, block_size)):
+        samples = min(block_size, total_samples - first)
+        if samples == 4096:
+            size_code, size_bytes = 12, b''
+        else:
+            size_code, size_bytes = 7, (samples - 1).to_bytes(2, 'big')
+        # Fixed blocking, 44.1 kHz, two independent channels, 16 bits
+        header = bytes([0xFF, 0xF8, (size_code << 4) | 9, 0x18]) + _coded_number(number) + size_bytes
+        header += bytes([crc8(header)])
+        subframes = b''.join(b'\x02' + rng.randbytes(samples * 2) for _ in range(2))
+        frame = header + subframes
+        frame += crc16(frame).to_bytes(2, 'big')
+        frames.append(frame)
+        frame_offsets.append(position)
+        position += len(frame)
+
+    frame_sizes = [len(frame) for frame in frames]
+    packed = (sample_rate << 44) | (1 << 41) | (15 << 36) | total_samples
+    streaminfo = struct.pack('>HH', block_size, block_size) + min(frame_sizes).to_bytes(3, 'big') + \
+        max(frame_sizes).to_bytes(3, 'big') + packed.to_bytes(8, 'big') + bytes(16)
+    seektable = b''
+    for second in range(0, seconds, seek_interval):
+        index = second * sample_rate // block_size
+        seektable += struct.pack('>QQH', index * block_size, frame_offsets[index], block_size)
+    vendor = b'reference libFLAC 1.4.3'
+    vorbis = struct.pack('<I', len(vendor)) + vendor + struct.pack('<I', 0)
+    header = b'fLaC' + _block(0, streaminfo) + _block(3, seektable) + _block(4, vorbis) + \
+        _block(1, bytes(8192), last=True)
+    return header + b''.join(frames)
+
+
+def read_some(client, url, size, headers=None):
+    """GET url and read up to size bytes of the body, then hang up"""
+    response = client.get(url, headers=headers, buffered=False)
+    data = bytearray()
+    try:
+        for chunk in response.response:
+            data += chunk
+            if len(data) >= size:
+                break
+    finally:
+        response.close()
+    return response.status_code, bytes(data[:size])
+
+
+def seek_by_guessing(client, file_id, meta, total, target):
+    """Bisect with byte ranges until a probe holds the target's frame; returns requests made"""
+    low, high = meta.audio_offset, total
+    guess = meta.audio_offset + (total - meta.audio_offset) * target // meta.total_samples
+    requests = 0
+    while True:
+        requests += 1
+        _, data = read_some(client, f'/stream/{file_id}', PROBE_BYTES,
+                            {'Range': f'bytes={guess}-{guess + PROBE_BYTES - 1}'})
+        locator = FrameLocator(meta, target, guess, PROBE_BYTES)
+        locator.feed(data)
+        frame = locator.frame
+        if frame is not None and frame[1] <= target and locator.done:
+            break
+        if frame is None or frame[1] > target:
+            high = guess
+        else:
+            low = guess + len(data)
+        if high - low <= PROBE_BYTES:
+            frame = (low, None)
+            break
+        guess = (low + high) // 2
+
+    # Then the actual stream from the frame found
+    requests += 1
+    read_some(client, f'/stream/{file_id}', FIRST_AUDIO_BYTES, {'Range': f'bytes={frame[0]}-'})
+    return requests
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--seconds', type=int, default=120, help='track length')
+    parser.add_argument('--seeks', type=int, default=20)
+    args = parser.parse_args()
+
+    payload = make_flac_stream(args.seconds)
+    meta = read_flac_metadata(io.BytesIO(payload))
+    drive = start_fake_drive(0, payload=payload)
+    rng = random.Random(1)
+    targets = [rng.uniform(1, args.seconds - 1) for _ in range(args.seeks)]
+
+    with tempfile.TemporaryDirectory() as tmp:
+        # Must be set before the app (and config) is imported
+        os.environ['DRIVE_EXPORT_URL'] = drive.export_url
+        os.environ['RANGE_CACHE_DIR'] = os.path.join(tmp, 'ranges')
+        from app import app
+        client = app.test_client()
+
+        results = {}
+        for name in ('guess', 't', 't-warm'):
+            upstream = drive.requests
+            requests = []
+            latencies = []
+            for i, seconds in enumerate(targets):
+                # Warm seeks reuse one track, so its header is already cached
+                file_id = 'warm' if name == 't-warm' else f'{name}{i}'
+                if name == 't-warm' and i == 0:
+                    read_some(client, f'/stream/{file_id}?t=0.5', 1)
+                    upstream = drive.requests
+                target = int(seconds * meta.sample_rate)
+                started = time.perf_counter()
+                if name == 'guess':
+                    requests.append(seek_by_guessing(client, file_id, meta, len(payload), target))
+                else:
+                    status, data = read_some(client, f'/stream/{file_id}?t={seconds:.3f}',
+                                             FIRST_AUDIO_BYTES)
+                    assert status == 200 and data[:4] == b'fLaC', status
+                    requests.append(1)
+                latencies.append((time.perf_counter() - started) * 1000)
+            results[name] = (statistics.mean(requests), (drive.requests - upstream) / len(targets),
+                             statistics.median(latencies))
+
+    print(f"{'method':>8} {'requests/seek':>14} {'upstream/seek':>14} {'median ms':>10}")
+    for name, (requests, upstream, latency) in results.items():
+        print(f"{name:>8} {requests:>14.2f} {upstream:>14.2f} {latency:>10.2f}")
+    drive.shutdown()
+
+
+if __name__ == '__main__':
+    main()
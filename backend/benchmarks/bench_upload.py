@@ -0,0 +1,98 @@
+"""
+Benchmark: bulk FLAC ingest against a local fake Drive API.
+
+Compares the old one-file-at-a-time loop (upload, then share, per file) with
+bulk_upload (worker pool, batched sharing, one catalog write), then re-runs
+bulk_upload to show the manifest skipping everything.
+
+Run from the backend directory:
+    python -m benchmarks.bench_upload --files 200 --latency 0.05
+"""
+import argparse
+import os
+import random
+import struct
+import tempfile
+import time
+from benchmarks.fake_drive import start_fake_drive
+
+
+def _block(block_type, data, last=False):
+    return bytes([(0x80 if last else 0) | block_type]) + len(data).to_bytes(3, 'big') + data
+
+
+def make_flac(path, tags, size, seconds=240, sample_rate=44100, picture_size=64 * 1024):
+    """
+    FLAC-shaped file: real STREAMINFO, SEEKTABLE, VORBIS_COMMENT and PICTURE
+    blocks followed by random bytes standing in for the audio frames.
+    """
+    total_samples = seconds * sample_rate
+    packed = (sample_rate << 44) | ((2 - 1) << 41) | ((16 - 1) << 36) | total_samples
+    streaminfo = struct.pack('>HH', 4096, 4096) + (0).to_bytes(3, 'big') * 2 + \
+        packed.to_bytes(8, 'big') + bytes(16)
+    seektable = b''.join(struct.pack('>QQH', n * 10 * sample_rate, n * 17000, 4096)
+                         for n in range(seconds // 10))
+    vendor = b'reference libFLAC 1.4.3'
+    comments = [f"{name.upper()}={value}".encode('utf-8') for name, value in tags.items()]
+    vorbis = struct.pack('<I', len(vendor)) + vendor + struct.pack('<I', len(comments)) + \
+        b''.join(struct.pack('<I', len(c)) + c for c in comments)
+    mime = b'image/jpeg'
+    picture = struct.pack('>II', 3, len(mime)) + mime + struct.pack('>IIIIII', 0, 500, 500, 24, 0,
+                                                                  picture_size) + os.urandom(picture_size)
+    header = b'fLaC' + _block(0, streaminfo) + _block(3, seektable) + _block(4, vorbis) + \
+        _block(6, picture, last=True)
+    with open(path, 'wb') as f:
+        f.write(header + os.urandom(max(0, size - len(header))))
+
+
+def make_library(directory, files, size, seed=0):
+    rng = random.Random(seed)
+    for i in range(files):
+        tags = {'title': f'Track {i}', 'artist': rng.choice(['Kishore Kumar', 'Lata Mangeshkar']),
+                'album': f'Album {i // 10}'}
+        make_flac(os.path.join(directory, f"{i:05d} - Track {i}.flac"), tags, size)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--files', type=int, default=200)
+    parser.add_argument('--size', type=int, default=256 * 1024, help='bytes per file')
+    parser.add_argument('--latency', type=float, default=0.05, help='seconds per Drive API call')
+    parser.add_argument('--workers', type=int, default=8)
+    args = parser.parse_args()
+
+    drive = start_fake_drive(1, latency=args.latency)
+    with tempfile.TemporaryDirectory() as tmp:
+        # Must be set before the uploader (and config) is imported
+        os.environ['DRIVE_API_ROOT'] = drive.api_root
+        os.environ['CATALOG_BACKEND'] = 'sqlite'
+        os.environ['CATALOG_DB_PATH'] = os.path.join(tmp, 'tracks.db')
+        from utils import drive_uploader
+
+        library = os.path.join(tmp, 'library')
+        os.makedirs(library)
+        make_library(library, args.files, args.size)
+        names = sorted(os.listdir(library))
+
+        start = time.perf_counter()
+        for name in names:
+            drive_uploader.upload_music_file(os.path.join(library, name), 'folder')
+        sequential = time.perf_counter() - start
+
+        manifest = os.path.join(tmp, 'manifest.jsonl')
+        start = time.perf_counter()
+        drive_uploader.bulk_upload(library, 'folder', args.workers, manifest)
+        bulk = time.perf_counter() - start
+
+        start = time.perf_counter()
+        drive_uploader.bulk_upload(library, 'folder', args.workers, manifest)
+        rerun = time.perf_counter() - start
+
+    print(f"{'files':>6} {'sequential s':>13} {'bulk s':>8} {'re-run s':>9} {'API calls':>10}")
+    print(f"{args.files:>6} {sequential:>13.2f} {bulk:>8.2f} {rerun:>9.2f} {sum(drive.api_calls.values()):>10}")
+    print(f"files on fake Drive: {len(drive.files)}, public: {len(drive.public_files)}")
+    drive.shutdown()
+
+
+if __name__ == '__main__':
+    main()
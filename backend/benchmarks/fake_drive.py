@@ -0,0 +1,354 @@
+"""
+Local stand-in for Google Drive used by the benchmarks.
+
+Downloads (drive.google.com/uc): every file_id resolves to the same
+deterministic payload. Range requests are honored and each response can be
+throttled to a per-connection bandwidth so streams last as long as real
+playback would. --confirm puts every file behind Drive's "can't scan for
+viruses" page: a download_warning cookie whose token has to come back as
+the confirm parameter. --error-rate answers that share of downloads with a
+503, as Drive does under load.
+
+Uploads (the Drive v3 API subset drive_uploader uses): resumable
+files.create, permissions.create and batch requests. Uploaded bytes are only
+counted and hashed, not kept. --latency adds a fixed delay to every request
+(before the response headers) to stand in for the round trip to Google.
+
+    python -m benchmarks.fake_drive --port 8765 --size 20000000 --bandwidth 500000 \
+        --latency 0.05 --error-rate 0.01 --confirm
+
+Point the backend at it with
+DRIVE_EXPORT_URL="http://127.0.0.1:8765/uc?export=download&id=" and the
+uploader with DRIVE_API_ROOT="http://127.0.0.1:8765/".
+"""
+import argparse
+import email.policy
+import hashlib
+import itertools
+import json
+import random
+import re
+import threading
+import time
+from email.mime.multipart import MIMEMultipart
+from email.mime.nonmultipart import MIMENonMultipart
+from email.parser import BytesParser
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+
+WRITE_CHUNK_SIZE = 64 * 1024
+
+
+def make_payload(size, seed=0):
+    """Deterministic pseudo-random bytes, so clients can verify what they got"""
+    return random.Random(seed).randbytes(size)
+
+
+class FakeDriveHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    server_version = 'FakeDrive/1.0'
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send_json(self, status, payload, headers=()):
+        body = json.dumps(payload).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json; charset=UTF-8')
+        self.send_header('Content-Length', str(len(body)))
+        for name, value in headers:
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _read_body(self):
+        return self.rfile.read(int(self.headers.get('Content-Length') or 0))
+
+    def do_POST(self):
+        server = self.server
+        path = urlparse(self.path).path
+        body = self._read_body()
+        server.count_api_call(path)
+        if server.latency:
+            time.sleep(server.latency)
+
+        if path == '/upload/drive/v3/files':
+            upload_id = server.start_upload(json.loads(body or b'{}'))
+            location = f"http://{self.headers['Host']}/upload/drive/v3/files?uploadType=resumable&upload_id={upload_id}"
+            self.send_response(200)
+            self.send_header('Location', location)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+        elif path == '/batch/drive/v3':
+            self._batch(body)
+        elif re.match(r'/drive/v3/files/[^/]+/permissions$', path):
+            file_id = path.split('/')[4]
+            status, payload = server.grant_permission(file_id, json.loads(body or b'{}'))
+            self._send_json(status, payload)
+        else:
+            self._send_json(404, {'error': {'code': 404, 'message': 'Not found'}})
+
+    def do_PUT(self):
+        server = self.server
+        upload_id = (parse_qs(urlparse(self.path).query).get('upload_id') or [''])[-1]
+        body = self._read_body()
+        if server.latency:
+            time.sleep(server.latency)
+        match = re.match(r'bytes (\d+)-(\d+)/(\d+|\*)', self.headers.get('Content-Range', ''))
+        total = None
+        if match:
+            total = None if match.group(3) == '*' else int(match.group(3))
+        elif body:
+            total = len(body)
+        result = server.append_upload(upload_id, body, total)
+        if result is None:
+            self._send_json(404, {'error': {'code': 404, 'message': 'Unknown upload'}})
+        elif isinstance(result, int):
+            # Incomplete: report how much has been received, as Drive does
+            self.send_response(308)
+            if result:
+                self.send_header('Range', f'bytes=0-{result - 1}')
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+        else:
+            self._send_json(200, result)
+
+    def _batch(self, body):
+        """Run each part of a multipart/mixed batch as a permissions.create call"""
+        message = BytesParser().parsebytes(
+            f"Content-Type: {self.headers['Content-Type']}\r\n\r\n".encode('ascii') + body)
+        response = MIMEMultipart('mixed')
+        for part in message.get_payload():
+            request_line = part.get_payload().split('\n', 1)[0]
+            path = urlparse(request_line.split(' ')[1]).path
+            inner_body = part.get_payload().split('\n\n', 1)[-1].strip() or '{}'
+            status, payload = 404, {'error': {'code': 404, 'message': 'Not found'}}
+            if re.match(r'/drive/v3/files/[^/]+/permissions$', path):
+                status, payload = self.server.grant_permission(path.split('/')[4], json.loads(inner_body))
+            content_id = part['Content-ID'][1:-1]
+            answer = MIMENonMultipart('application', 'http')
+            answer['Content-ID'] = f"<response-{content_id}>"
+            answer.set_payload(f"HTTP/1.1 {status} {'OK' if status == 200 else 'Error'}\r\n"
+                               f"Content-Type: application/json\r\n\r\n{json.dumps(payload)}")
+            response.attach(answer)
+        # Drive answers with CRLF line endings, which the client relies on
+        encoded = response.as_bytes(policy=email.policy.HTTP).split(b'\r\n\r\n', 1)[1]
+        self.send_response(200)
+        self.send_header('Content-Type', f'multipart/mixed; boundary="{response.get_boundary()}"')
+        self.send_header('Content-Length', str(len(encoded)))
+        self.end_headers()
+        self.wfile.write(encoded)
+
+    def do_GET(self):
+        server = self.server
+        query = parse_qs(urlparse(self.path).query)
+        file_id = (query.get('id') or [''])[-1]
+        if not file_id:
+            self.send_error(404)
+            return
+
+        if server.latency:
+            time.sleep(server.latency)
+        if server.fail():
+            body = b'Service Unavailable'
+            self.send_response(503)
+            self.send_header('Retry-After', '1')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+            return
+        if server.confirm and not self._confirmed(file_id, query):
+            self._send_confirm_page(file_id)
+            return
+
+        payload = server.payload
+        total = len(payload)
+        range_header = self.headers.get('Range')
+        match = re.match(r'bytes=(\d+)-(\d*)$', range_header or '')
+        if match:
+            start = int(match.group(1))
+            end = min(int(match.group(2)) if match.group(2) else total - 1, total - 1)
+            if start >= total:
+                self.send_response(416)
+                self.send_header('Content-Range', f'bytes */{total}')
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+                return
+            self.send_response(206)
+            self.send_header('Content-Range', f'bytes {start}-{end}/{total}')
+        else:
+            start, end = 0, total - 1
+            self.send_response(200)
+
+        self.send_header('Content-Type', 'audio/flac')
+        self.send_header('Content-Disposition', f'attachment; filename="{file_id}.flac"')
+        self.send_header('Content-Length', str(end - start + 1))
+        self.end_headers()
+        server.count_request(end - start + 1)
+
+        view = memoryview(payload)
+        position = start
+        started = time.monotonic()
+        try:
+            while position <= end:
+                size = min(WRITE_CHUNK_SIZE, end - position + 1)
+                self.wfile.write(view[position:position + size])
+                position += size
+                if server.bandwidth:
+                    # Sleep until the bytes sent so far fit the bandwidth budget
+                    ahead = (position - start) / server.bandwidth - (time.monotonic() - started)
+                    if ahead > 0:
+                        time.sleep(ahead)
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+
+
+    def _confirmed(self, file_id, query):
+        """Whether the request carries the token (as parameter and cookie) of the confirm page"""
+        token = confirm_token(file_id)
+        cookies = self.headers.get('Cookie', '')
+        return (query.get('confirm') or [''])[-1] == token and \
+            f'download_warning_{file_id}={token}' in cookies
+
+    def _send_confirm_page(self, file_id):
+        token = confirm_token(file_id)
+        body = (f'<html><body>Google Drive can\'t scan this file for viruses. '
+                f'<a href="/uc?export=download&amp;confirm={token}&amp;id={file_id}">'
+                f'Download anyway</a></body></html>').encode('utf-8')
+        self.server.count_confirm()
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/html; charset=utf-8')
+        self.send_header('Set-Cookie', f'download_warning_{file_id}={token}; Path=/')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+def confirm_token(file_id):
+    return hashlib.sha1(file_id.encode('utf-8')).hexdigest()[:8]
+
+
+class FakeDriveServer(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 1024
+
+    def __init__(self, address, payload, bandwidth=0, latency=0, error_rate=0, confirm=False,
+                 seed=0):
+        super().__init__(address, FakeDriveHandler)
+        self.payload = payload
+        self.bandwidth = bandwidth
+        self.latency = latency
+        self.error_rate = error_rate
+        self.confirm = confirm
+        self.requests = 0
+        self.bytes_requested = 0
+        self.errors = 0
+        self.confirm_pages = 0
+        self._random = random.Random(seed)
+        self.api_calls = {}
+        self.uploads = {}
+        self.files = {}
+        self.public_files = set()
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+
+    def handle_error(self, request, client_address):
+        # Clients hanging up mid-stream is expected during load tests
+        pass
+
+    def count_request(self, size):
+        with self._lock:
+            self.requests += 1
+            self.bytes_requested += size
+
+    def fail(self):
+        """Whether to answer this download with an error (and count it)"""
+        if not self.error_rate:
+            return False
+        with self._lock:
+            if self._random.random() >= self.error_rate:
+                return False
+            self.errors += 1
+            return True
+
+    def count_confirm(self):
+        with self._lock:
+            self.confirm_pages += 1
+
+    def count_api_call(self, path):
+        with self._lock:
+            self.api_calls[path] = self.api_calls.get(path, 0) + 1
+
+    def start_upload(self, metadata):
+        with self._lock:
+            upload_id = str(next(self._ids))
+            self.uploads[upload_id] = {'metadata': metadata, 'received': 0,
+                                       'sha256': hashlib.sha256()}
+        return upload_id
+
+    def append_upload(self, upload_id, data, total):
+        """Add a chunk; returns bytes received so far, the created file, or None"""
+        with self._lock:
+            upload = self.uploads.get(upload_id)
+            if upload is None:
+                return None
+            upload['received'] += len(data)
+            upload['sha256'].update(data)
+            if total is None or upload['received'] < total:
+                return upload['received']
+            del self.uploads[upload_id]
+            file_id = f"fake{next(self._ids):08d}"
+            self.files[file_id] = {'name': upload['metadata'].get('name'),
+                                   'parents': upload['metadata'].get('parents', []),
+                                   'size': upload['received'],
+                                   'sha256': upload['sha256'].hexdigest()}
+            return {'id': file_id}
+
+    def grant_permission(self, file_id, permission):
+        with self._lock:
+            if file_id not in self.files:
+                return 404, {'error': {'code': 404, 'message': f'File not found: {file_id}'}}
+            if permission.get('type') == 'anyone':
+                self.public_files.add(file_id)
+            return 200, {'id': 'anyoneWithLink', 'type': permission.get('type'),
+                         'role': permission.get('role')}
+
+    @property
+    def api_root(self):
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}/"
+
+    @property
+    def export_url(self):
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}/uc?export=download&id="
+
+
+def start_fake_drive(size, bandwidth=0, host='127.0.0.1', port=0, latency=0, payload=None,
+                     error_rate=0, confirm=False):
+    """Run a FakeDriveServer (serving payload, or size random bytes) on a background thread"""
+    if payload is None:
+        payload = make_payload(size)
+    server = FakeDriveServer((host, port), payload, bandwidth, latency, error_rate, confirm)
+    threading.Thread(target=server.serve_forever, name='fake-drive', daemon=True).start()
+    return server
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--size', type=int, default=20_000_000, help='payload size in bytes')
+    parser.add_argument('--bandwidth', type=int, default=0,
+                        help='per-connection bytes/second (0 = unthrottled)')
+    parser.add_argument('--latency', type=float, default=0, help='seconds added to every request')
+    parser.add_argument('--error-rate', type=float, default=0,
+                        help='share of downloads answered with 503')
+    parser.add_argument('--confirm', action='store_true',
+                        help='require the confirm token and cookie for every download')
+    args = parser.parse_args()
+
+    server = FakeDriveServer((args.host, args.port), make_payload(args.size), args.bandwidth,
+                             args.latency, args.error_rate, args.confirm)
+    print(f"Fake Drive serving {args.size} bytes at {server.export_url}", flush=True)
+    server.serve_forever()
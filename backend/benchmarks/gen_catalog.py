@@ -0,0 +1,47 @@
+"""
+Synthetic catalog generator: a tracks.csv (and optionally a SQLite catalog)
+of any size, with the film-music style titles bench_search uses.
+
+File ids are file00000000, file00000001, ...; the fake Drive serves every
+id, so the generated catalog works end to end against it. The same --seed
+always produces the same catalog.
+
+Run from the backend directory:
+    python -m benchmarks.gen_catalog --rows 100000 --output /tmp/tracks.csv --sqlite /tmp/tracks.db
+"""
+import argparse
+import os
+import time
+from benchmarks.bench_search import make_catalog
+
+
+def generate(rows, output, sqlite_path=None, seed=0):
+    """Write rows synthetic tracks to output (CSV) and, if given, sqlite_path"""
+    df = make_catalog(rows, seed)
+    directory = os.path.dirname(os.path.abspath(output))
+    os.makedirs(directory, exist_ok=True)
+    tmp_path = f"{output}.{os.getpid()}.tmp"
+    df.to_csv(tmp_path, index=False)
+    os.replace(tmp_path, output)
+    if sqlite_path:
+        from utils.catalog_db import SqliteCatalog
+        SqliteCatalog(sqlite_path).replace_tracks(df.to_dict('records'))
+    return df
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--rows', type=int, default=100_000)
+    parser.add_argument('--output', default='tracks.csv', help='CSV file to write')
+    parser.add_argument('--sqlite', help='also build a SQLite catalog at this path')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    started = time.perf_counter()
+    df = generate(args.rows, args.output, args.sqlite, args.seed)
+    print(f"{len(df)} tracks ({df['album'].nunique()} albums) written to {args.output}"
+          f"{' and ' + args.sqlite if args.sqlite else ''} in {time.perf_counter() - started:.1f} s")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,145 @@
+"""
+Load test: concurrent /stream listeners per server process, WSGI vs ASGI mode.
+
+Starts a throttled fake Drive and one single-process gunicorn per mode, then
+opens N concurrent /stream requests (distinct file ids) that each read for a
+fixed duration, and reports how many actually received audio.
+
+    python -m benchmarks.load_streams --streams 10 50 200 --duration 8
+"""
+import argparse
+import asyncio
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import httpx
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def wait_for(url, timeout=30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            # Only the status matters: don't read a (throttled) track body
+            with httpx.stream('GET', url, timeout=1) as response:
+                if response.status_code < 500:
+                    return
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.2)
+    raise RuntimeError(f"{url} did not come up")
+
+
+def start_fake_drive(size, bandwidth):
+    port = free_port()
+    proc = subprocess.Popen(
+        [sys.executable, '-m', 'benchmarks.fake_drive', '--port', str(port),
+         '--size', str(size), '--bandwidth', str(bandwidth)],
+        cwd=BACKEND_DIR, stdout=subprocess.DEVNULL)
+    url = f"http://127.0.0.1:{port}/uc?export=download&id="
+    wait_for(url + 'probe')
+    return proc, url
+
+
+def start_server(mode, export_url, cache_dir, duration):
+    port = free_port()
+    env = dict(os.environ,
+               SERVER_MODE=mode,
+               DRIVE_EXPORT_URL=export_url,
+               RANGE_CACHE_DIR=os.path.join(cache_dir, mode, 'ranges'),
+               DOWNLOAD_CACHE_DIR=os.path.join(cache_dir, mode, 'downloads'),
+               # Raw capacity is measured, so no request is turned away
+               ADMISSION_MAX_UPSTREAM='0')
+    proc = subprocess.Popen(
+        ['gunicorn', '--workers', '1', '--bind', f'127.0.0.1:{port}',
+         '--timeout', str(int(duration * 4 + 30)), '--log-level', 'warning'],
+        cwd=BACKEND_DIR, env=env, stdout=subprocess.DEVNULL)
+    base = f"http://127.0.0.1:{port}"
+    wait_for(base + '/api/test')
+    return proc, base
+
+
+async def listen(client, url, duration, started_at):
+    """Read one stream for duration seconds; return (ttfb or None, bytes read)"""
+    state = {'ttfb': None, 'received': 0}
+
+    async def read():
+        async with client.stream('GET', url) as response:
+            async for chunk in response.aiter_bytes():
+                if state['ttfb'] is None:
+                    state['ttfb'] = time.monotonic() - started_at
+                state['received'] += len(chunk)
+
+    # Listeners still queued behind a busy worker simply time out unserved
+    remaining = started_at + duration - time.monotonic()
+    try:
+        await asyncio.wait_for(read(), remaining)
+    except (asyncio.TimeoutError, httpx.HTTPError):
+        pass
+    return state['ttfb'], state['received']
+
+
+async def run_scenario(base, streams, duration):
+    limits = httpx.Limits(max_connections=streams + 10, max_keepalive_connections=0)
+    timeout = httpx.Timeout(None)
+    async with httpx.AsyncClient(limits=limits, timeout=timeout) as client:
+        started_at = time.monotonic()
+        tasks = [listen(client, f"{base}/stream/bench-{streams}-{i}", duration, started_at)
+                 for i in range(streams)]
+        results = await asyncio.gather(*tasks)
+
+    ttfbs = sorted(t for t, _ in results if t is not None and t < duration)
+    total_bytes = sum(received for _, received in results)
+    return {
+        'streams': streams,
+        'served': len(ttfbs),
+        'ttfb_p50': statistics.median(ttfbs) if ttfbs else None,
+        'ttfb_max': ttfbs[-1] if ttfbs else None,
+        'mb_per_s': total_bytes / duration / 1e6,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--modes', nargs='+', default=['wsgi', 'asgi'], choices=['wsgi', 'asgi'])
+    parser.add_argument('--streams', type=int, nargs='+', default=[10, 50, 200])
+    parser.add_argument('--duration', type=float, default=8.0, help='seconds each listener reads')
+    parser.add_argument('--size', type=int, default=20_000_000, help='track size in bytes')
+    parser.add_argument('--bandwidth', type=int, default=128_000,
+                        help='upstream bytes/second per connection (roughly playback rate)')
+    args = parser.parse_args()
+
+    drive, export_url = start_fake_drive(args.size, args.bandwidth)
+    try:
+        with tempfile.TemporaryDirectory() as cache_dir:
+            print(f"{'mode':>5} {'streams':>8} {'served':>7} {'ttfb p50 s':>11} "
+                  f"{'ttfb max s':>11} {'MB/s':>7}")
+            for mode in args.modes:
+                server, base = start_server(mode, export_url, cache_dir, args.duration)
+                try:
+                    for streams in args.streams:
+                        r = asyncio.run(run_scenario(base, streams, args.duration))
+                        fmt = lambda v: f"{v:.3f}" if v is not None else '-'
+                        print(f"{mode:>5} {r['streams']:>8} {r['served']:>7} {fmt(r['ttfb_p50']):>11} "
+                              f"{fmt(r['ttfb_max']):>11} {r['mb_per_s']:>7.2f}", flush=True)
+                finally:
+                    server.terminate()
+                    server.wait()
+    finally:
+        drive.terminate()
+        drive.wait()
+
+
+if __name__ == '__main__':
+    main()
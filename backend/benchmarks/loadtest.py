@@ -0,0 +1,298 @@
+"""
+Load test: /api/search, full and ranged /stream, and /api/download against a
+local fake Drive, with results saved as JSON for comparing runs.
+
+Generates a synthetic catalog, starts the fake Drive (with latency,
+bandwidth, error rate and confirm-token pages as configured) and gunicorn
+pointed at both, then runs each scenario for --duration seconds with
+--concurrency clients issuing requests back to back. For each scenario it
+reports latency percentiles (to the complete response), time to first
+byte, requests and megabytes per second, errors, and the peak RSS of the
+gunicorn master and workers, after a warm-up that lets every worker load
+the catalog. Pass --compare with an earlier result file to
+print the change in every figure.
+
+Run from the backend directory:
+    python -m benchmarks.loadtest --rows 100000 --concurrency 16 --duration 10 \\
+        --output results/today.json --compare results/yesterday.json
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import time
+import httpx
+from benchmarks.bench_search import QUERIES
+from benchmarks.gen_catalog import generate
+from benchmarks.load_streams import BACKEND_DIR, free_port, wait_for
+
+SCENARIOS = ['search', 'stream', 'stream-range', 'download']
+RSS_SAMPLE_INTERVAL = 0.25
+# Figures where a higher value is better, for --compare
+HIGHER_IS_BETTER = {'requests_per_s', 'mb_per_s'}
+
+
+def start_fake_drive(args):
+    port = free_port()
+    command = [sys.executable, '-m', 'benchmarks.fake_drive', '--port', str(port),
+               '--size', str(args.size), '--bandwidth', str(args.bandwidth),
+               '--latency', str(args.latency), '--error-rate', str(args.error_rate)]
+    if args.confirm:
+        command.append('--confirm')
+    proc = subprocess.Popen(command, cwd=BACKEND_DIR, stdout=subprocess.DEVNULL)
+    url = f"http://127.0.0.1:{port}/uc?export=download&id="
+    wait_for(url + 'probe')
+    return proc, url
+
+
+def start_server(args, export_url, work_dir, csv_path):
+    port = free_port()
+    env = dict(os.environ,
+               SERVER_MODE=args.mode,
+               DRIVE_EXPORT_URL=export_url,
+               TRACKS_CSV=csv_path,
+               RANGE_CACHE_DIR=os.path.join(work_dir, 'ranges'),
+               DOWNLOAD_CACHE_DIR=os.path.join(work_dir, 'downloads'),
+               METRICS_DIR=os.path.join(work_dir, 'metrics'),
+               ADMISSION_DIR=os.path.join(work_dir, 'admission'),
+               PREFETCH_DIR=os.path.join(work_dir, 'prefetch'))
+    proc = subprocess.Popen(
+        ['gunicorn', '--workers', str(args.workers), '--bind', f'127.0.0.1:{port}',
+         '--timeout', str(int(args.duration * 4 + 30)), '--log-level', 'warning'],
+        cwd=BACKEND_DIR, env=env, stdout=subprocess.DEVNULL)
+    base = f"http://127.0.0.1:{port}"
+    wait_for(base + '/api/test')
+    return proc, base
+
+
+def process_tree_rss(pid):
+    """Resident memory in bytes of pid and its descendants (Linux /proc)"""
+    total = 0
+    pending = [pid]
+    while pending:
+        current = pending.pop()
+        try:
+            with open(f'/proc/{current}/status') as f:
+                for line in f:
+                    if line.startswith('VmRSS:'):
+                        total += int(line.split()[1]) * 1024
+                        break
+            with open(f'/proc/{current}/task/{current}/children') as f:
+                pending.extend(int(child) for child in f.read().split())
+        except (FileNotFoundError, ProcessLookupError):
+            continue
+    return total
+
+
+def percentile(samples, fraction):
+    """Nearest-rank percentile of sorted samples, or None"""
+    if not samples:
+        return None
+    return samples[min(len(samples) - 1, max(0, int(round(fraction * len(samples))) - 1))]
+
+
+class Workload:
+    """Builds the request each scenario sends next"""
+
+    def __init__(self, args, catalog):
+        self.rng = random.Random(args.seed)
+        self.file_ids = list(catalog['file_id'][:args.files])
+        # Known queries plus words and artists that occur in the catalog
+        self.queries = list(QUERIES)
+        for title, artist in catalog[['title', 'artist']].sample(
+                min(200, len(catalog)), random_state=args.seed).itertuples(index=False):
+            self.queries.append(title.split(' ')[0].lower())
+            self.queries.append(artist.split(' ')[-1].lower())
+        self.size = args.size
+        self.range_size = args.range_size
+
+    def request(self, scenario):
+        """(path, headers) of the next request in scenario"""
+        if scenario == 'search':
+            return f"/api/search?q={self.rng.choice(self.queries)}", {}
+        file_id = self.rng.choice(self.file_ids)
+        if scenario == 'stream':
+            return f"/stream/{file_id}", {}
+        if scenario == 'stream-range':
+            length = min(self.range_size, self.size)
+            start = self.rng.randrange(0, self.size - length + 1)
+            return f"/stream/{file_id}", {'Range': f"bytes={start}-{start + length - 1}"}
+        return f"/api/download/{file_id}", {}
+
+
+async def one_request(client, path, headers):
+    """(seconds to complete, seconds to first byte, bytes, ok)"""
+    started = time.perf_counter()
+    first = None
+    received = 0
+    try:
+        async with client.stream('GET', path, headers=headers) as response:
+            async for chunk in response.aiter_raw():
+                if first is None:
+                    first = time.perf_counter() - started
+                received += len(chunk)
+            ok = response.status_code < 400
+    except httpx.HTTPError:
+        ok = False
+    elapsed = time.perf_counter() - started
+    return elapsed, first if first is not None else elapsed, received, ok
+
+
+async def warm_up(base, workers, timeout=300):
+    """
+    Search until every worker answers quickly: each loads the catalog and
+    builds its search index on first use, which is not what is measured.
+    """
+    deadline = time.monotonic() + timeout
+    async with httpx.AsyncClient(base_url=base, timeout=httpx.Timeout(timeout)) as client:
+        while time.monotonic() < deadline:
+            samples = await asyncio.gather(*(one_request(client, '/api/search?q=warmup', {})
+                                             for _ in range(workers * 4)))
+            if all(ok for _, _, _, ok in samples) and max(s[0] for s in samples) < 0.5:
+                return
+    raise RuntimeError("Server did not settle after warm-up")
+
+
+async def run_scenario(base, scenario, workload, concurrency, duration, server_pid):
+    samples = []
+    peak_rss = process_tree_rss(server_pid)
+    limits = httpx.Limits(max_connections=concurrency + 4)
+    async with httpx.AsyncClient(base_url=base, limits=limits, timeout=httpx.Timeout(60.0)) as client:
+        started = time.perf_counter()
+        deadline = started + duration
+
+        async def worker():
+            while time.perf_counter() < deadline:
+                path, headers = workload.request(scenario)
+                samples.append(await one_request(client, path, headers))
+
+        async def sample_rss():
+            nonlocal peak_rss
+            while time.perf_counter() < deadline:
+                await asyncio.sleep(RSS_SAMPLE_INTERVAL)
+                peak_rss = max(peak_rss, process_tree_rss(server_pid))
+
+        await asyncio.gather(sample_rss(), *(worker() for _ in range(concurrency)))
+        elapsed = time.perf_counter() - started
+
+    latencies = sorted(s[0] for s in samples if s[3])
+    ttfbs = sorted(s[1] for s in samples if s[3])
+    total_bytes = sum(s[2] for s in samples)
+    result = {
+        'requests': len(samples),
+        'errors': sum(1 for s in samples if not s[3]),
+        'requests_per_s': len(samples) / elapsed,
+        'mb_per_s': total_bytes / elapsed / 1e6,
+        'rss_peak_mb': peak_rss / 1e6,
+    }
+    for name, values in (('latency', latencies), ('ttfb', ttfbs)):
+        for label, fraction in (('p50', 0.50), ('p95', 0.95), ('p99', 0.99)):
+            value = percentile(values, fraction)
+            result[f'{name}_{label}_ms'] = value * 1000 if value is not None else None
+    return result
+
+
+def print_results(results):
+    columns = ['requests', 'errors', 'requests_per_s', 'mb_per_s', 'latency_p50_ms',
+               'latency_p95_ms', 'latency_p99_ms', 'ttfb_p50_ms', 'rss_peak_mb']
+    headers = ['reqs', 'errors', 'req/s', 'MB/s', 'p50 ms', 'p95 ms', 'p99 ms', 'ttfb p50', 'RSS MB']
+    print(f"{'scenario':>13} " + ' '.join(f"{h:>9}" for h in headers))
+    for scenario, result in results.items():
+        cells = []
+        for column in columns:
+            value = result[column]
+            cells.append('-' if value is None else f"{value:.1f}" if isinstance(value, float) else str(value))
+        print(f"{scenario:>13} " + ' '.join(f"{c:>9}" for c in cells))
+
+
+def compare(results, baseline_path):
+    """Print the relative change of every figure against an earlier run"""
+    with open(baseline_path) as f:
+        baseline = json.load(f)['scenarios']
+    print(f"\nChange against {baseline_path} (+ is better):")
+    for scenario, result in results.items():
+        if scenario not in baseline:
+            continue
+        changes = []
+        for name, value in result.items():
+            before = baseline[scenario].get(name)
+            if name in ('requests', 'errors') or not value or not before:
+                continue
+            change = (value - before) / before * 100
+            if name not in HIGHER_IS_BETTER:
+                change = -change
+            changes.append(f"{name} {change:+.1f}%")
+        print(f"{scenario:>13}: {', '.join(changes)}")
+
+
+def git_revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=BACKEND_DIR,
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--scenarios', nargs='+', default=SCENARIOS, choices=SCENARIOS)
+    parser.add_argument('--mode', default='wsgi', choices=['wsgi', 'asgi'])
+    parser.add_argument('--workers', type=int, default=2, help='gunicorn workers')
+    parser.add_argument('--concurrency', type=int, default=8, help='clients per scenario')
+    parser.add_argument('--duration', type=float, default=10.0, help='seconds per scenario')
+    parser.add_argument('--rows', type=int, default=100_000, help='synthetic catalog size')
+    parser.add_argument('--files', type=int, default=50,
+                        help='distinct tracks requested (fewer means more cache hits)')
+    parser.add_argument('--size', type=int, default=5_000_000, help='track size in bytes')
+    parser.add_argument('--range-size', type=int, default=256 * 1024,
+                        help='bytes per stream-range request')
+    parser.add_argument('--bandwidth', type=int, default=0,
+                        help='upstream bytes/second per connection (0 = unthrottled)')
+    parser.add_argument('--latency', type=float, default=0.02, help='upstream seconds per request')
+    parser.add_argument('--error-rate', type=float, default=0.0,
+                        help='share of upstream downloads answered with 503')
+    parser.add_argument('--confirm', action='store_true', help='upstream confirm-token pages')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help='JSON result file (default results/loadtest-<time>.json)')
+    parser.add_argument('--compare', help='earlier JSON result file to compare against')
+    args = parser.parse_args()
+
+    started = time.strftime('%Y-%m-%dT%H:%M:%S')
+    output = args.output or os.path.join(
+        BACKEND_DIR, 'benchmarks', 'results', f"loadtest-{time.strftime('%Y%m%d-%H%M%S')}.json")
+    with tempfile.TemporaryDirectory() as work_dir:
+        csv_path = os.path.join(work_dir, 'tracks.csv')
+        catalog = generate(args.rows, csv_path, seed=args.seed)
+        drive, export_url = start_fake_drive(args)
+        try:
+            server, base = start_server(args, export_url, work_dir, csv_path)
+            try:
+                asyncio.run(warm_up(base, args.workers))
+                workload = Workload(args, catalog)
+                results = {}
+                for scenario in args.scenarios:
+                    results[scenario] = asyncio.run(run_scenario(
+                        base, scenario, workload, args.concurrency, args.duration, server.pid))
+            finally:
+                server.terminate()
+                server.wait()
+        finally:
+            drive.terminate()
+            drive.wait()
+
+    print_results(results)
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, 'w') as f:
+        json.dump({'revision': git_revision(), 'started': started,
+                   'settings': vars(args), 'scenarios': results}, f, indent=2)
+    print(f"\nResults written to {output}")
+    if args.compare:
+        compare(results, args.compare)
+
+
+if __name__ == '__main__':
+    main()
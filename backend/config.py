@@ -9,13 +9,147 @@ TEMP_DIR = os.path.join(BASE_DIR, 'temp_downloads')
 # Define TEMP_DOWNLOAD_DIR for compatibility
 TEMP_DOWNLOAD_DIR = TEMP_DIR
 
-# File paths
-TRACKS_CSV_PATH = os.path.join(DATA_DIR, 'tracks.csv')
+# File paths. The catalog the API serves and the uploader writes; TRACKS_CSV
+# points it elsewhere (benchmarks use a generated one)
+TRACKS_CSV_PATH = os.environ.get('TRACKS_CSV', os.path.join(DATA_DIR, 'tracks.csv'))
+
+# Catalog storage: 'csv' (tracks.csv held in memory) or 'sqlite' (WAL database with FTS5)
+CATALOG_BACKEND = os.environ.get('CATALOG_BACKEND', 'csv')
+CATALOG_DB_PATH = os.environ.get('CATALOG_DB_PATH', os.path.join(DATA_DIR, 'tracks.db'))
+
+# Local cache of downloaded tracks (LRU-evicted to stay under the byte budget)
+DOWNLOAD_CACHE_DIR = os.environ.get('DOWNLOAD_CACHE_DIR', os.path.join(TEMP_DIR, 'cache'))
+DOWNLOAD_CACHE_MAX_BYTES = int(os.environ.get('DOWNLOAD_CACHE_MAX_BYTES', 2 * 1024 ** 3))
+# Cache misses for tracks of at least two minimum-size segments are fetched as
+# this many concurrent byte ranges; a failed segment is retried on its own
+DOWNLOAD_SEGMENTS = int(os.environ.get('DOWNLOAD_SEGMENTS', 4))
+DOWNLOAD_MIN_SEGMENT_BYTES = int(os.environ.get('DOWNLOAD_MIN_SEGMENT_BYTES', 8 * 1024 * 1024))
+DOWNLOAD_SEGMENT_RETRIES = int(os.environ.get('DOWNLOAD_SEGMENT_RETRIES', 3))
+
+# Upstream relays (utils/relay.py): chunk size bounds, and how much time's
+# worth of data each chunk should carry at the rate a transfer is moving
+RELAY_MIN_CHUNK_SIZE = int(os.environ.get('RELAY_MIN_CHUNK_SIZE', 64 * 1024))
+RELAY_MAX_CHUNK_SIZE = int(os.environ.get('RELAY_MAX_CHUNK_SIZE', 1024 * 1024))
+RELAY_TARGET_INTERVAL = float(os.environ.get('RELAY_TARGET_INTERVAL', 0.05))
+
+# Chunk (and buffer) size of utils.drive_helper's streaming reads
+DRIVE_STREAM_CHUNK_SIZE = int(os.environ.get('DRIVE_STREAM_CHUNK_SIZE', 256 * 1024))
+
+# /api/download/batch: most tracks in one archive, and how many tracks are
+# fetched ahead of the one being written
+ZIP_MAX_TRACKS = int(os.environ.get('ZIP_MAX_TRACKS', 500))
+ZIP_FETCH_AHEAD = int(os.environ.get('ZIP_FETCH_AHEAD', 4))
+
+# Sparse block cache backing /stream range requests
+RANGE_CACHE_DIR = os.environ.get('RANGE_CACHE_DIR', os.path.join(TEMP_DIR, 'ranges'))
+RANGE_CACHE_MAX_BYTES = int(os.environ.get('RANGE_CACHE_MAX_BYTES', 1024 ** 3))
+RANGE_CACHE_BLOCK_SIZE = int(os.environ.get('RANGE_CACHE_BLOCK_SIZE', 256 * 1024))
+# Ring buffer each upstream range read keeps for listeners that join it late
+# or read slower than the fastest one (per read, per worker)
+BROADCAST_BUFFER_BYTES = int(os.environ.get('BROADCAST_BUFFER_BYTES', 4 * 1024 * 1024))
+
+# Time seeking (/stream/<file_id>?t=): size of the Range request that reads a
+# track's FLAC header, how many headers each worker keeps, and how far past
+# the seek point to look for the frame containing the requested time
+FLAC_HEADER_PROBE_BYTES = int(os.environ.get('FLAC_HEADER_PROBE_BYTES', 64 * 1024))
+SEEK_INDEX_MAX_ENTRIES = int(os.environ.get('SEEK_INDEX_MAX_ENTRIES', 4096))
+SEEK_SCAN_MAX_BYTES = int(os.environ.get('SEEK_SCAN_MAX_BYTES', 4 * 1024 * 1024))
 
 # Google Drive configuration
 GOOGLE_DRIVE_CREDENTIALS = json.loads(os.environ.get('GOOGLE_DRIVE_CREDENTIALS', '{}'))
 DRIVE_FOLDER_ID = os.environ.get('DRIVE_FOLDER_ID', '1O5AnabJwMK7z7TmIhW-PUZnrn4Jzx4de')
 
+# Drive API root used by the uploader. Point it at a local fake Drive
+# (benchmarks/fake_drive.py) to test uploads; requests then go unauthenticated.
+DRIVE_API_ROOT = os.environ.get('DRIVE_API_ROOT', 'https://www.googleapis.com/')
+
+# Bulk uploads: concurrent uploads, and the manifest that lets re-runs skip
+# files (by content hash) that are already on Drive
+UPLOAD_WORKERS = int(os.environ.get('UPLOAD_WORKERS', 8))
+UPLOAD_MANIFEST_PATH = os.environ.get('UPLOAD_MANIFEST_PATH', os.path.join(DATA_DIR, 'upload_manifest.jsonl'))
+
+# Base URL for Google Drive file download
+BASE_EXPORT_URL = os.environ.get('DRIVE_EXPORT_URL', "https://drive.google.com/uc?export=download&id=")
+
+# How long resolved download metadata (and 404s) are reused, in seconds
+RESOLVER_TTL = float(os.environ.get('RESOLVER_TTL', 600))
+RESOLVER_NEGATIVE_TTL = float(os.environ.get('RESOLVER_NEGATIVE_TTL', 60))
+
+# Shared upstream HTTP client: the pool should match the worker's concurrency
+UPSTREAM_POOL_SIZE = int(os.environ.get('UPSTREAM_POOL_SIZE', 10))
+UPSTREAM_CONNECT_TIMEOUT = float(os.environ.get('UPSTREAM_CONNECT_TIMEOUT', 5))
+UPSTREAM_READ_TIMEOUT = float(os.environ.get('UPSTREAM_READ_TIMEOUT', 30))
+UPSTREAM_MAX_RETRIES = int(os.environ.get('UPSTREAM_MAX_RETRIES', 2))
+UPSTREAM_BACKOFF_BASE = float(os.environ.get('UPSTREAM_BACKOFF_BASE', 0.2))
+UPSTREAM_BACKOFF_MAX = float(os.environ.get('UPSTREAM_BACKOFF_MAX', 2))
+BREAKER_FAILURE_THRESHOLD = int(os.environ.get('BREAKER_FAILURE_THRESHOLD', 5))
+BREAKER_RESET_TIMEOUT = float(os.environ.get('BREAKER_RESET_TIMEOUT', 30))
+
+# Serving mode: 'wsgi' (gunicorn sync workers) or 'asgi' (asyncio streaming, see asgi.py)
+SERVER_MODE = os.environ.get('SERVER_MODE', 'wsgi')
+ASYNC_UPSTREAM_MAX_CONNECTIONS = int(os.environ.get('ASYNC_UPSTREAM_MAX_CONNECTIONS', 1000))
+
+# /api/search paging: page size when no limit is given, and the largest
+# limit accepted for JSON pages and for streamed (NDJSON) responses
+SEARCH_DEFAULT_LIMIT = int(os.environ.get('SEARCH_DEFAULT_LIMIT', 50))
+SEARCH_MAX_LIMIT = int(os.environ.get('SEARCH_MAX_LIMIT', 500))
+SEARCH_STREAM_MAX_LIMIT = int(os.environ.get('SEARCH_STREAM_MAX_LIMIT', 10000))
+
+# Per-worker memory for cached /api/search response bodies
+SEARCH_CACHE_MAX_BYTES = int(os.environ.get('SEARCH_CACHE_MAX_BYTES', 32 * 1024 * 1024))
+
+# Response bodies smaller than this are sent uncompressed
+COMPRESS_MIN_BYTES = int(os.environ.get('COMPRESS_MIN_BYTES', 1024))
+
+# /metrics: each worker writes its values to METRICS_DIR every
+# METRICS_FLUSH_INTERVAL seconds, and the endpoint merges all of them
+METRICS_DIR = os.environ.get('METRICS_DIR', os.path.join(TEMP_DIR, 'metrics'))
+METRICS_FLUSH_INTERVAL = float(os.environ.get('METRICS_FLUSH_INTERVAL', 2))
+
+# Admission control for requests that read from Drive, shared by all workers
+# through ADMISSION_DIR (see utils/admission.py). At most ADMISSION_MAX_UPSTREAM
+# run at once (0 = no limit); downloads may use ADMISSION_BULK_SLOTS of them and
+# ranged streams all but ADMISSION_INTERACTIVE_RESERVE. A request without a slot
+# after ADMISSION_QUEUE_TIMEOUT seconds gets a 503 with Retry-After.
+ADMISSION_DIR = os.environ.get('ADMISSION_DIR', os.path.join(TEMP_DIR, 'admission'))
+ADMISSION_MAX_UPSTREAM = int(os.environ.get('ADMISSION_MAX_UPSTREAM', 32))
+ADMISSION_BULK_SLOTS = int(os.environ.get('ADMISSION_BULK_SLOTS', 8))
+ADMISSION_INTERACTIVE_RESERVE = int(os.environ.get('ADMISSION_INTERACTIVE_RESERVE', 8))
+ADMISSION_QUEUE_TIMEOUT = float(os.environ.get('ADMISSION_QUEUE_TIMEOUT', 1.0))
+ADMISSION_RETRY_AFTER = int(os.environ.get('ADMISSION_RETRY_AFTER', 5))
+# Token-bucket bandwidth limits in bytes/second (0 = unlimited), with bursts of
+# ADMISSION_BURST_SECONDS. The first ADMISSION_INTERACTIVE_BYTES of a stream,
+# and small ranges, are never held back.
+ADMISSION_GLOBAL_RATE = int(os.environ.get('ADMISSION_GLOBAL_RATE', 0))
+ADMISSION_CLIENT_RATE = int(os.environ.get('ADMISSION_CLIENT_RATE', 0))
+ADMISSION_BURST_SECONDS = float(os.environ.get('ADMISSION_BURST_SECONDS', 1.0))
+ADMISSION_INTERACTIVE_BYTES = int(os.environ.get('ADMISSION_INTERACTIVE_BYTES', 1024 * 1024))
+# Limit clients by the first X-Forwarded-For address (only behind a trusted proxy)
+ADMISSION_TRUST_FORWARDED = os.environ.get('ADMISSION_TRUST_FORWARDED', '0') == '1'
+
+# Background prefetch of stream heads (off by default, see utils/prefetch.py).
+# The top PREFETCH_TOP_RESULTS results of each first search page, and every
+# PREFETCH_POPULAR_INTERVAL seconds the PREFETCH_POPULAR_COUNT most played
+# tracks, get their first PREFETCH_HEAD_SECONDS read into the range cache by
+# PREFETCH_WORKERS threads per worker (PREFETCH_DEFAULT_BYTES_PER_SECOND sizes
+# the head when the bitrate is unknown).
+PREFETCH_ENABLED = os.environ.get('PREFETCH_ENABLED', '0') == '1'
+PREFETCH_WORKERS = int(os.environ.get('PREFETCH_WORKERS', 2))
+PREFETCH_QUEUE_SIZE = int(os.environ.get('PREFETCH_QUEUE_SIZE', 64))
+PREFETCH_TOP_RESULTS = int(os.environ.get('PREFETCH_TOP_RESULTS', 3))
+PREFETCH_POPULAR_COUNT = int(os.environ.get('PREFETCH_POPULAR_COUNT', 10))
+PREFETCH_POPULAR_INTERVAL = float(os.environ.get('PREFETCH_POPULAR_INTERVAL', 60))
+PREFETCH_HEAD_SECONDS = float(os.environ.get('PREFETCH_HEAD_SECONDS', 10))
+PREFETCH_DEFAULT_BYTES_PER_SECOND = int(os.environ.get('PREFETCH_DEFAULT_BYTES_PER_SECOND', 120_000))
+# Budgets per worker: upstream bytes/second, and bytes of warmed heads not yet
+# played (prefetching pauses above it). Heads unplayed after PREFETCH_TTL
+# seconds count as wasted. Warmed heads are recorded in PREFETCH_DIR, so a
+# play in any worker counts.
+PREFETCH_RATE = int(os.environ.get('PREFETCH_RATE', 1_000_000))
+PREFETCH_MAX_BYTES = int(os.environ.get('PREFETCH_MAX_BYTES', 256 * 1024 * 1024))
+PREFETCH_TTL = float(os.environ.get('PREFETCH_TTL', 900))
+PREFETCH_DIR = os.environ.get('PREFETCH_DIR', os.path.join(TEMP_DIR, 'prefetch'))
+
 def ensure_data_directories():
     """Ensure all required directories exist"""
     directories = [DATA_DIR, TEMP_DIR]
@@ -0,0 +1,22 @@
+# Picks the application and worker class from SERVER_MODE, so the same
+# `gunicorn` command serves either the Flask app (sync workers) or the
+# asyncio streaming mode in asgi.py.
+from config import SERVER_MODE
+
+if SERVER_MODE == 'asgi':
+    wsgi_app = 'asgi:app'
+    worker_class = 'uvicorn.workers.UvicornWorker'
+else:
+    wsgi_app = 'app:app'
+
+
+def on_starting(server):
+    # Values left in METRICS_DIR by a previous run would be added to this one's
+    from utils import metrics
+    metrics.clear()
+
+
+def post_fork(server, worker):
+    # Only server workers write values for /metrics; scripts importing the app do not
+    from utils import metrics
+    metrics.start()
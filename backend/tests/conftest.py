@@ -0,0 +1,10 @@
+import os
+import sys
+import tempfile
+
+# Tests import the backend modules as the app does, from the backend directory,
+# and keep their runtime files (metrics, admission, caches) out of data/
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+_runtime = tempfile.mkdtemp(prefix='flacmusicstore-tests-')
+for name in ('METRICS_DIR', 'ADMISSION_DIR', 'RANGE_CACHE_DIR', 'DOWNLOAD_CACHE_DIR', 'PREFETCH_DIR'):
+    os.environ.setdefault(name, os.path.join(_runtime, name.lower()))
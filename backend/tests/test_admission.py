@@ -0,0 +1,80 @@
+import time
+import pytest
+import requests
+from benchmarks.fake_drive import start_fake_drive
+from utils.admission import Admission, Held, Overloaded, BULK, STREAM
+from utils.file_cache import FileCache
+from utils.range_cache import RangeCache
+from utils.relay import Relay
+
+RATE = 2_000_000
+BLOCK_SIZE = 64 * 1024
+
+
+def make_admission(tmp_path, **limits):
+    limits.setdefault('max_upstream', 1)
+    limits.setdefault('queue_timeout', 0.05)
+    limits.setdefault('global_rate', 0)
+    limits.setdefault('client_rate', 0)
+    return Admission(str(tmp_path / 'admission'), **limits)
+
+
+def test_download_fill_is_paced_even_when_nobody_reads(tmp_path):
+    drive = start_fake_drive(1_000_000)
+    admission = make_admission(tmp_path, global_rate=RATE, burst_seconds=0.05)
+    cache = FileCache(str(tmp_path / 'downloads'), 10 * 1024 * 1024)
+
+    def open_upstream():
+        ticket = admission.admit(BULK, 'client')
+        response = requests.get(drive.export_url + 'track', stream=True)
+        return {'size': len(drive.payload)}, Held(ticket, iter(Relay(response, pace=ticket.delay)))
+
+    try:
+        started = time.monotonic()
+        entry, chunks = cache.get_or_stream('track', open_upstream)
+        chunks.close()  # The client went away; the fill carries on at the paced rate
+        while not cache.contains('track') and time.monotonic() < started + 5:
+            time.sleep(0.01)
+        elapsed = time.monotonic() - started
+        assert cache.contains('track')
+        assert elapsed >= 0.8 * len(drive.payload) / RATE
+        # The slot is given back when the fill ends, and contains() is not a lookup
+        assert admission.try_admit(BULK, 'client') is not None
+        assert cache.stats()['hits'] == 0
+    finally:
+        drive.shutdown()
+
+
+def test_range_cache_admits_only_upstream_reads(tmp_path):
+    drive = start_fake_drive(4 * BLOCK_SIZE)
+    admission = make_admission(tmp_path)
+    cache = RangeCache(str(tmp_path / 'ranges'), 10 * 1024 * 1024, BLOCK_SIZE)
+    total = len(drive.payload)
+    admitted = []
+
+    def fetch_range(first, last):
+        return requests.get(drive.export_url + 'track', headers={'Range': f'bytes={first}-{last}'},
+                            stream=True)
+
+    def admit():
+        admitted.append(admission.admit(STREAM, 'client'))
+        return admitted[-1]
+
+    try:
+        assert b''.join(cache.read('track', total, 0, BLOCK_SIZE - 1, fetch_range, admit)) == \
+            drive.payload[:BLOCK_SIZE]
+        assert len(admitted) == 1
+
+        # With every slot taken, cached bytes are still served and new ones refused
+        holder = admission.admit(STREAM, 'other')
+        try:
+            assert b''.join(cache.read('track', total, 0, BLOCK_SIZE - 1, fetch_range, admit)) == \
+                drive.payload[:BLOCK_SIZE]
+            with pytest.raises(Overloaded):
+                b''.join(cache.read('track', total, BLOCK_SIZE, total - 1, fetch_range, admit))
+        finally:
+            holder.release()
+        assert len(admitted) == 1
+        assert drive.requests == 1
+    finally:
+        drive.shutdown()
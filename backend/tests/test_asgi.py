@@ -0,0 +1,43 @@
+import asyncio
+import asgi
+from utils import metrics
+from utils.file_cache import CacheEntry
+
+ROUTE = '/api/download/<file_id>'
+
+
+def send_cached(tmp_path, extensions):
+    path = tmp_path / 'track.flac'
+    path.write_bytes(b'f' * 5000)
+    entry = CacheEntry('track', str(path), 5000, 'track.flac', 'audio/flac')
+    scope = {'type': 'http', 'method': 'GET', 'headers': [], 'extensions': extensions}
+    messages = []
+
+    async def send(message):
+        messages.append(message)
+
+    async def handler(scope, receive, send, file_id):
+        assert await asgi._send_cached_file(scope, send, entry, {})
+
+    asyncio.run(asgi._measured(handler, ROUTE, scope, None, send, 'track'))
+    return messages
+
+
+def sent_bytes():
+    return dict(metrics.RESPONSE_BYTES.values).get((ROUTE,), 0)
+
+
+def test_cached_file_uses_zerocopy_send_when_offered(tmp_path):
+    before = sent_bytes()
+    messages = send_cached(tmp_path, {'http.response.zerocopysend': {}})
+    assert [m['type'] for m in messages] == ['http.response.start', 'http.response.zerocopysend']
+    assert messages[1]['count'] == 5000
+    assert sent_bytes() - before == 5000
+
+
+def test_cached_file_is_sent_as_body_without_the_extension(tmp_path):
+    before = sent_bytes()
+    messages = send_cached(tmp_path, {})
+    assert 'http.response.zerocopysend' not in [m['type'] for m in messages]
+    assert b''.join(m.get('body', b'') for m in messages[1:]) == b'f' * 5000
+    assert sent_bytes() - before == 5000
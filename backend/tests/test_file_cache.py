@@ -0,0 +1,119 @@
+import os
+import threading
+import pytest
+from utils import file_cache
+from utils.file_cache import FileCache
+
+PAYLOAD = os.urandom(300 * 1024)
+
+
+class Upstream:
+    """open_upstream() for FileCache: counts calls, and holds the body back until released"""
+
+    def __init__(self, fail_after=None):
+        self.calls = 0
+        self.release = threading.Event()
+        self.fail_after = fail_after
+
+    def __call__(self):
+        self.calls += 1
+        return {'filename': 'track.flac', 'size': len(PAYLOAD)}, self.chunks()
+
+    def chunks(self):
+        yield PAYLOAD[:1000]
+        self.release.wait(5)
+        if self.fail_after is not None:
+            yield PAYLOAD[1000:self.fail_after]
+            raise IOError("connection reset")
+        yield PAYLOAD[1000:]
+
+
+def read(result):
+    entry, chunks = result
+    if chunks is None:
+        with open(entry.path, 'rb') as f:
+            return f.read()
+    return b''.join(chunks)
+
+
+def leftovers(directory):
+    return sorted(name for name in os.listdir(directory) if not name.endswith(file_cache.LOCK_SUFFIX))
+
+
+def test_concurrent_misses_share_one_upstream_fetch(tmp_path):
+    cache = FileCache(str(tmp_path), 10 * 1024 * 1024)
+    upstream = Upstream()
+    first = cache.get_or_stream('track', upstream)
+    bodies = []
+    readers = [threading.Thread(target=lambda: bodies.append(read(cache.get_or_stream('track', upstream))))
+               for _ in range(4)]
+    for reader in readers:
+        reader.start()
+    upstream.release.set()
+    assert read(first) == PAYLOAD
+    for reader in readers:
+        reader.join(5)
+    assert bodies == [PAYLOAD] * 4
+    assert upstream.calls == 1
+    # Every client that did not find a complete file is a miss; the ones that followed are attaches
+    stats = cache.stats()
+    assert stats['misses'] + stats['hits'] == 5
+    assert stats['misses'] == 1 + stats['attaches']
+
+
+def test_reader_in_another_worker_attaches_mid_download(tmp_path):
+    writer, other = FileCache(str(tmp_path), 10 * 1024 * 1024), FileCache(str(tmp_path), 10 * 1024 * 1024)
+    upstream = Upstream()
+    entry, chunks = writer.get_or_stream('track', upstream)
+    assert next(chunks) == PAYLOAD[:1000]
+
+    attached = other.get_or_stream('track', upstream)
+    assert attached[0].size == len(PAYLOAD)
+    assert other.stats()['attaches'] == 1
+    upstream.release.set()
+    assert read(attached) == PAYLOAD
+    assert PAYLOAD[:1000] + b''.join(chunks) == PAYLOAD
+    assert upstream.calls == 1
+    assert other.get('track') is not None
+
+
+def test_failed_download_leaves_nothing_behind(tmp_path):
+    cache = FileCache(str(tmp_path), 10 * 1024 * 1024)
+    upstream = Upstream(fail_after=5000)
+    upstream.release.set()
+    with pytest.raises(IOError):
+        read(cache.get_or_stream('track', upstream))
+    assert leftovers(tmp_path) == []
+    assert not cache.contains('track')
+
+    # The key is free again, and the next client fetches it afresh
+    upstream.fail_after = None
+    assert read(cache.get_or_stream('track', upstream)) == PAYLOAD
+    assert upstream.calls == 2
+
+
+def test_failed_setup_closes_the_partial_file(tmp_path, monkeypatch):
+    cache = FileCache(str(tmp_path), 10 * 1024 * 1024)
+    upstream = Upstream()
+    upstream.release.set()
+
+    def failing_dump(*args, **kwargs):
+        raise OSError("disk full")
+
+    opened = []
+    real_open = open
+
+    def tracking_open(path, *args, **kwargs):
+        f = real_open(path, *args, **kwargs)
+        opened.append(f)
+        return f
+
+    monkeypatch.setattr(file_cache.json, 'dump', failing_dump)
+    monkeypatch.setattr(file_cache, 'open', tracking_open, raising=False)
+    with pytest.raises(OSError):
+        cache.get_or_stream('track', upstream)
+    assert opened and all(f.closed for f in opened)
+    assert leftovers(tmp_path) == []
+
+    monkeypatch.undo()
+    assert read(cache.get_or_stream('track', upstream)) == PAYLOAD
@@ -0,0 +1,103 @@
+import io
+import struct
+import pytest
+from utils.flac_meta import (FlacError, PLACEHOLDER_SEEKPOINT, catalog_fields, parse_frame_header,
+                             read_flac_metadata)
+
+SAMPLE_RATE = 44100
+TOTAL_SAMPLES = 180 * SAMPLE_RATE
+MD5 = bytes(range(16))
+
+
+def block(block_type, data, last=False):
+    return bytes([(0x80 if last else 0) | block_type]) + len(data).to_bytes(3, 'big') + data
+
+
+def make_header(tags=(), picture_size=50_000, id3=False):
+    """marker, STREAMINFO, SEEKTABLE (with a placeholder), VORBIS_COMMENT and PICTURE"""
+    packed = (SAMPLE_RATE << 44) | (1 << 41) | (23 << 36) | TOTAL_SAMPLES
+    streaminfo = struct.pack('>HH', 4096, 4096) + (14).to_bytes(3, 'big') + (24_000).to_bytes(3, 'big') + \
+        packed.to_bytes(8, 'big') + MD5
+    seektable = struct.pack('>QQH', 0, 0, 4096) + struct.pack('>QQH', 441_000, 150_000, 4096) + \
+        struct.pack('>QQH', PLACEHOLDER_SEEKPOINT, 0, 0)
+    vendor = b'reference libFLAC 1.4.3'
+    comments = [entry.encode('utf-8') for entry in tags]
+    vorbis = struct.pack('<I', len(vendor)) + vendor + struct.pack('<I', len(comments)) + \
+        b''.join(struct.pack('<I', len(c)) + c for c in comments)
+    header = b'fLaC' + block(0, streaminfo) + block(3, seektable) + block(4, vorbis) + \
+        block(6, bytes(picture_size), last=True)
+    if id3:
+        header = b'ID3\x04\x00\x00' + bytes([0, 0, 1, 0]) + bytes(128) + header
+    return header
+
+
+def test_streaminfo_seektable_and_tags_are_parsed():
+    header = make_header(['TITLE=Tum Hi Ho', 'ARTIST=Arijit Singh', 'artist=Mithoon', 'ALBUM= ',
+                          'not a comment'])
+    meta = read_flac_metadata(io.BytesIO(header + b'\xff\xf8 audio'))
+    assert (meta.sample_rate, meta.channels, meta.bits_per_sample) == (SAMPLE_RATE, 2, 24)
+    assert (meta.min_block_size, meta.max_block_size) == (4096, 4096)
+    assert (meta.min_frame_size, meta.max_frame_size) == (14, 24_000)
+    assert meta.total_samples == TOTAL_SAMPLES
+    assert meta.duration == 180
+    assert meta.md5 == MD5.hex()
+    # The placeholder seek point is dropped
+    assert meta.seektable == [(0, 0, 4096), (441_000, 150_000, 4096)]
+    assert meta.seek_point(500_000) == (441_000, 150_000)
+    assert meta.seek_point(400_000) == (0, 0)
+    assert meta.tag('title') == 'Tum Hi Ho'
+    assert meta.tag('ARTIST') == 'Arijit Singh, Mithoon'
+    assert meta.tag('album', 'none') == 'none'
+    # Audio starts right after the last block; the picture is skipped, not read
+    assert meta.audio_offset == len(header)
+
+
+def test_id3v2_tag_before_the_marker_is_skipped():
+    header = make_header(id3=True)
+    meta = read_flac_metadata(io.BytesIO(header))
+    assert meta.audio_offset == len(header)
+    assert meta.total_samples == TOTAL_SAMPLES
+
+
+def test_stream_header_round_trips_through_the_parser():
+    meta = read_flac_metadata(io.BytesIO(make_header()))
+    partial = read_flac_metadata(io.BytesIO(meta.stream_header(1000)))
+    assert partial.total_samples == 1000
+    assert (partial.sample_rate, partial.channels, partial.bits_per_sample) == (SAMPLE_RATE, 2, 24)
+    assert partial.seektable == [] and partial.md5 == bytes(16).hex()
+
+
+@pytest.mark.parametrize('data', [b'RIFF' + bytes(100), b'fLaC' + block(1, bytes(10), last=True),
+                                  make_header()[:40]])
+def test_malformed_input_raises_flac_error(data):
+    with pytest.raises(FlacError):
+        read_flac_metadata(io.BytesIO(data))
+
+
+def test_frame_header_is_validated():
+    meta = read_flac_metadata(io.BytesIO(make_header()))
+    # Fixed blocking, 4096 samples, 44.1 kHz, stereo, 16 bits, frame number 2
+    header = bytes([0xFF, 0xF8, 0xC9, 0x18, 0x02])
+    crc = 0
+    for byte in header:
+        crc ^= byte
+        for _ in range(8):
+            crc = ((crc << 1) ^ 0x07) & 0xFF if crc & 0x80 else (crc << 1) & 0xFF
+    data = b'\x00' + header + bytes([crc]) + bytes(16)
+    assert parse_frame_header(data, 1, meta) == (2 * 4096, 4096, 6)
+    corrupt = data[:6] + bytes([crc ^ 1]) + data[7:]
+    assert parse_frame_header(corrupt, 1, meta) is None
+    assert parse_frame_header(data, 0, meta) is None
+
+
+def test_catalog_fields_fall_back_to_the_file_name(tmp_path):
+    path = tmp_path / '01 - Kabira.flac'
+    path.write_bytes(make_header(['TITLE=Kabira', 'ALBUMARTIST=Pritam']))
+    fields = catalog_fields(str(path))
+    assert fields['title'] == 'Kabira' and fields['artist'] == 'Pritam'
+    assert fields['album'] == '01 - Kabira'
+    assert (fields['duration'], fields['bit_depth'], fields['channels']) == (180, 24, 2)
+
+    broken = tmp_path / 'broken.flac'
+    broken.write_bytes(b'not flac')
+    assert catalog_fields(str(broken)) == {'title': 'broken', 'artist': 'broken', 'album': 'broken'}
@@ -0,0 +1,141 @@
+import asyncio
+import io
+import time
+import pytest
+import app
+import asgi
+from benchmarks.bench_seek import make_flac_stream
+from utils.flac_meta import FlacError, parse_frame_header, read_flac_metadata
+from utils.flac_seek import FrameLocator, seek_target
+
+SAMPLE_RATE = 44100
+BLOCK_SIZE = 4096
+SECONDS = 6
+# Every frame of the fixture is the same size: a 6-byte header (frame numbers
+# stay below 128), two VERBATIM 16-bit subframes and the CRC-16
+FRAME_SIZE = 6 + 2 * (1 + 2 * BLOCK_SIZE) + 2
+
+DATA = make_flac_stream(SECONDS, SAMPLE_RATE, BLOCK_SIZE, seek_interval=2)
+META = read_flac_metadata(io.BytesIO(DATA))
+
+
+def frame_of(sample):
+    """(file offset, first sample) of the frame holding sample"""
+    index = sample // BLOCK_SIZE
+    return META.audio_offset + index * FRAME_SIZE, index * BLOCK_SIZE
+
+
+def locate(meta, seconds, chunk_size=1000):
+    offset, target = seek_target(meta, seconds, len(DATA))
+    locator = FrameLocator(meta, target, offset, 1024 * 1024)
+    for position in range(offset, len(DATA), chunk_size):
+        if locator.feed(DATA[position:position + chunk_size]):
+            break
+    return target, locator.result()
+
+
+def test_seek_target_starts_at_the_seek_point_before_the_time():
+    offset, target = seek_target(META, 3.5, len(DATA))
+    assert target == int(3.5 * SAMPLE_RATE)
+    # The seek table has a point every 2 seconds; 3.5 s starts from the one at 2 s
+    assert offset == frame_of(2 * SAMPLE_RATE)[0]
+    for seconds in (0, -1, SECONDS, SECONDS + 10):
+        assert seek_target(META, seconds, len(DATA)) is None
+    assert seek_target(None, 3.5, len(DATA)) is None
+
+
+@pytest.mark.parametrize('seconds', [0.01, 2.0, 3.5, 5.9])
+def test_frame_locator_finds_the_frame_holding_the_target(seconds):
+    target, (frame_offset, sample, received) = locate(META, seconds)
+    assert (frame_offset, sample) == frame_of(target)
+    assert received == DATA[frame_offset:frame_offset + len(received)]
+
+
+def test_frame_locator_without_a_seek_table():
+    meta = read_flac_metadata(io.BytesIO(DATA))
+    meta.seektable = []
+    offset, _ = seek_target(meta, 3.5, len(DATA))
+    # The bitrate estimate starts a second early, in the middle of some frame
+    assert offset < frame_of(int(3.5 * SAMPLE_RATE))[0]
+    target, (frame_offset, sample, _) = locate(meta, 3.5, chunk_size=777)
+    assert (frame_offset, sample) == frame_of(target)
+
+
+def test_frame_locator_gives_up_after_the_scan_limit():
+    locator = FrameLocator(META, 1000, 0, 4096)
+    assert locator.feed(bytes(5000))
+    with pytest.raises(FlacError):
+        locator.result()
+
+
+def test_stream_header_makes_the_rest_of_the_file_a_valid_stream():
+    _, (frame_offset, sample, _) = locate(META, 3.5)
+    header = META.stream_header(META.total_samples - sample)
+    stream = header + DATA[frame_offset:]
+    meta = read_flac_metadata(io.BytesIO(stream))
+    assert meta.audio_offset == len(header)
+    assert meta.total_samples == SECONDS * SAMPLE_RATE - sample
+    assert parse_frame_header(stream, meta.audio_offset, META)[:2] == (sample, BLOCK_SIZE)
+
+
+class StartedPrefetcher:
+    def __init__(self):
+        self.plays = []
+
+    def started(self, file_id):
+        self.plays.append(file_id)
+
+
+@pytest.fixture
+def cached_track(monkeypatch):
+    """A track in the download cache, with Drive unreachable and a prefetcher recording plays"""
+    def open_upstream():
+        return {'filename': 'seek.flac', 'content_type': 'audio/flac', 'size': len(DATA)}, \
+            (chunk for chunk in [DATA])
+
+    entry, chunks = app.download_cache.get_or_stream('seek-cached', open_upstream)
+    if chunks is not None:
+        b''.join(chunks)
+    deadline = time.monotonic() + 5
+    while not app.download_cache.contains('seek-cached') and time.monotonic() < deadline:
+        time.sleep(0.01)
+
+    def resolve(file_id):
+        raise AssertionError("Drive was asked for a cached track")
+
+    prefetcher = StartedPrefetcher()
+    monkeypatch.setattr(app.resolver, 'resolve', resolve)
+    monkeypatch.setattr(app, 'prefetcher', prefetcher)
+    monkeypatch.setattr(asgi, 'prefetcher', prefetcher)
+    return prefetcher
+
+
+def expected_seek(seconds):
+    _, (frame_offset, sample, _) = locate(META, seconds)
+    return META.stream_header(META.total_samples - sample) + DATA[frame_offset:], sample
+
+
+def test_time_seek_is_served_from_the_download_cache(cached_track):
+    response = app.app.test_client().get('/stream/seek-cached?t=3.5')
+    body, sample = expected_seek(3.5)
+    assert response.status_code == 200
+    assert response.data == body
+    assert response.headers['Content-Length'] == str(len(body))
+    assert response.headers['X-Seek-Time'] == f"{sample / SAMPLE_RATE:.3f}"
+    assert cached_track.plays == ['seek-cached']
+
+    # Past the end it plays the cached file from the start
+    assert app.app.test_client().get('/stream/seek-cached?t=600').data == DATA
+
+
+def test_time_seek_is_served_from_the_download_cache_in_asgi_mode(cached_track):
+    scope = {'type': 'http', 'method': 'GET', 'query_string': b't=3.5', 'headers': []}
+    messages = []
+
+    async def send(message):
+        messages.append(message)
+
+    asyncio.run(asgi.stream(scope, None, send, 'seek-cached'))
+    assert messages[0]['status'] == 200
+    assert b''.join(m.get('body', b'') for m in messages[1:]) == expected_seek(3.5)[0]
+    assert cached_track.plays == ['seek-cached']
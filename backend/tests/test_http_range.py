@@ -0,0 +1,27 @@
+import pytest
+from utils.http_range import IGNORED, parse_range, RangeNotSatisfiable
+
+
+def ignored():
+    return sum(value for _, value in IGNORED.dump())
+
+
+def test_parse_range():
+    assert parse_range(None, 1000) is None
+    assert parse_range('bytes=100-199', 1000) == (100, 199)
+    assert parse_range('bytes=100-', 1000) == (100, 999)
+    assert parse_range('bytes=900-5000', 1000) == (900, 999)
+    # Suffix ranges are the last N bytes, or the whole file if it is shorter
+    assert parse_range('bytes=-500', 1000) == (500, 999)
+    assert parse_range('bytes=-5000', 1000) == (0, 999)
+    with pytest.raises(RangeNotSatisfiable):
+        parse_range('bytes=1000-', 1000)
+    with pytest.raises(RangeNotSatisfiable):
+        parse_range('bytes=-0', 1000)
+
+
+def test_unusable_ranges_serve_the_whole_file_and_are_counted():
+    before = ignored()
+    for header in ('bytes=100-50', 'bytes=abc-', 'bytes=0-1,5-9', 'items=0-10', 'bytes=100'):
+        assert parse_range(header, 1000) is None, header
+    assert ignored() == before + 5
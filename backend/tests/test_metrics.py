@@ -0,0 +1,44 @@
+import json
+import os
+import subprocess
+import sys
+from utils import metrics
+
+COUNTER = metrics.Counter('test_retired_total', 'Counter for the retirement test')
+
+
+def dead_pid():
+    process = subprocess.Popen([sys.executable, '-c', 'pass'])
+    process.wait()
+    return process.pid
+
+
+def write_worker_file(directory, pid, value):
+    data = {'pid': pid, 'metrics': {'test_retired_total': {
+        'type': 'counter', 'help': 'Counter for the retirement test', 'labels': [],
+        'values': [[[], value]]}}}
+    with open(os.path.join(directory, f'{pid}.json'), 'w') as f:
+        json.dump(data, f)
+
+
+def test_exited_workers_are_folded_into_one_file(tmp_path, monkeypatch):
+    monkeypatch.setattr(metrics, 'METRICS_DIR', str(tmp_path))
+    COUNTER.reset()
+    COUNTER.inc(amount=1)
+    first, second = dead_pid(), dead_pid()
+    write_worker_file(tmp_path, first, 10)
+    write_worker_file(tmp_path, second, 100)
+
+    assert 'test_retired_total 111' in metrics.render().splitlines()
+    assert sorted(os.listdir(tmp_path)) == [metrics.RETIRE_LOCK_FILE, metrics.RETIRED_FILE]
+    # Totals survive later scrapes and further exits
+    third = dead_pid()
+    write_worker_file(tmp_path, third, 1000)
+    assert 'test_retired_total 1111' in metrics.render().splitlines()
+
+
+def test_render_does_not_write_for_a_process_that_was_not_started(tmp_path, monkeypatch):
+    monkeypatch.setattr(metrics, 'METRICS_DIR', str(tmp_path))
+    COUNTER.inc()
+    metrics.render()
+    assert not os.path.exists(os.path.join(tmp_path, f'{os.getpid()}.json'))
@@ -0,0 +1,80 @@
+import time
+import requests
+from benchmarks.fake_drive import start_fake_drive
+from utils.admission import Admission, BULK, STREAM
+from utils.prefetch import Prefetcher
+from utils.range_cache import RangeCache
+
+RATE = 2_000_000
+BLOCK_SIZE = 64 * 1024
+
+
+def make_prefetcher(tmp_path, warm, admission, **options):
+    options.setdefault('rate', 0)
+    return Prefetcher(warm, admission, popular_interval=0, directory=str(tmp_path / 'prefetch'),
+                      **options)
+
+
+def test_head_is_paced_while_read_and_leaves_the_global_bucket_alone(tmp_path):
+    drive = start_fake_drive(16 * BLOCK_SIZE)
+    admission = Admission(str(tmp_path / 'admission'), max_upstream=2, queue_timeout=0.05,
+                          global_rate=RATE, client_rate=0, burst_seconds=0.05)
+    cache = RangeCache(str(tmp_path / 'ranges'), 10 * 1024 * 1024, BLOCK_SIZE)
+    total = len(drive.payload)
+
+    def warm(file_id, admit):
+        fetched = []
+
+        def fetch_range(first, last):
+            fetched.append(last - first + 1)
+            return requests.get(drive.export_url + file_id, headers={'Range': f'bytes={first}-{last}'},
+                                stream=True)
+
+        for _ in cache.read(file_id, total, 0, total - 1, fetch_range, admit):
+            pass
+        return sum(fetched)
+
+    prefetcher = make_prefetcher(tmp_path, warm, admission)
+    try:
+        started = time.monotonic()
+        prefetcher._prefetch('track')
+        assert time.monotonic() - started >= 0.8 * total / RATE
+        assert prefetcher.stats()['warmed_bytes'] == total
+        # Prefetch only took spare tokens: live traffic right after it does not wait
+        ticket = admission.admit(STREAM, 'client')
+        try:
+            assert ticket.delay(BLOCK_SIZE // 2) == 0
+        finally:
+            ticket.release()
+    finally:
+        drive.shutdown()
+
+
+def test_job_is_skipped_without_a_free_slot(tmp_path):
+    admission = Admission(str(tmp_path / 'admission'), max_upstream=1, queue_timeout=0.05,
+                          global_rate=0, client_rate=0)
+    warmed = []
+    prefetcher = make_prefetcher(tmp_path, lambda file_id, admit: warmed.append(file_id), admission)
+    holder = admission.admit(BULK, 'client')
+    try:
+        prefetcher._prefetch('track')
+    finally:
+        holder.release()
+    assert warmed == []
+    assert prefetcher.stats()['busy'] == 1
+
+
+def test_play_in_another_worker_counts_as_used(tmp_path):
+    admission = Admission(str(tmp_path / 'admission'), max_upstream=0, global_rate=0, client_rate=0)
+    warming = make_prefetcher(tmp_path, lambda file_id, admit: 1000, admission)
+    playing = make_prefetcher(tmp_path, lambda file_id, admit: 1000, admission)
+
+    warming._prefetch('track')
+    assert warming.stats()['waiting_bytes'] == 1000
+    playing.started('track')
+    assert playing.stats()['used'] == 1
+    # The warming worker stops holding the head against its budget, and never counts it unused
+    stats = warming.stats()
+    assert (stats['waiting_bytes'], stats['expired']) == (0, 0)
+    playing.started('track')
+    assert playing.stats()['used'] == 1
@@ -0,0 +1,52 @@
+import time
+import requests
+from benchmarks.fake_drive import start_fake_drive
+from utils.range_cache import RangeCache
+
+BLOCK_SIZE = 256 * 1024
+# Throttled, so a listener leaves while its block is still arriving
+BANDWIDTH = 4_000_000
+
+
+def make_fetch(drive, file_id):
+    def fetch_range(first, last):
+        return requests.get(drive.export_url + file_id, headers={'Range': f'bytes={first}-{last}'},
+                            stream=True)
+    return fetch_range
+
+
+def read(cache, drive, file_id, start, end):
+    total = len(drive.payload)
+    data = b''.join(cache.read(file_id, total, start, end, make_fetch(drive, file_id)))
+    # The upstream read finishes its block after the listener has left
+    deadline = time.monotonic() + 5
+    while cache.stats()['broadcast']['active'] and time.monotonic() < deadline:
+        time.sleep(0.01)
+    return data
+
+
+def test_repeated_sub_block_range_is_fetched_once(tmp_path):
+    drive = start_fake_drive(4 * BLOCK_SIZE, bandwidth=BANDWIDTH)
+    try:
+        cache = RangeCache(str(tmp_path), 10 * 1024 * 1024, BLOCK_SIZE)
+        for _ in range(3):
+            assert read(cache, drive, 'track', 100, 199) == drive.payload[100:200]
+        assert drive.requests == 1
+        assert cache.stats()['hit_bytes'] == 200
+        assert cache.cached('track', len(drive.payload), 0, BLOCK_SIZE - 1)
+    finally:
+        drive.shutdown()
+
+
+def test_range_across_blocks_caches_its_last_block(tmp_path):
+    drive = start_fake_drive(4 * BLOCK_SIZE, bandwidth=BANDWIDTH)
+    try:
+        cache = RangeCache(str(tmp_path), 10 * 1024 * 1024, BLOCK_SIZE)
+        end = BLOCK_SIZE + 1000
+        assert read(cache, drive, 'track', 0, end) == drive.payload[:end + 1]
+        assert read(cache, drive, 'track', 10, end) == drive.payload[10:end + 1]
+        assert drive.requests == 1
+        # The rest of the track was not read beyond the block the listener left in
+        assert not cache.cached('track', len(drive.payload), 0, 3 * BLOCK_SIZE - 1)
+    finally:
+        drive.shutdown()
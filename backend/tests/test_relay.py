@@ -0,0 +1,54 @@
+import io
+import requests
+from benchmarks.fake_drive import start_fake_drive
+from utils import relay
+from utils.relay import Relay
+
+
+def relayed(response, **sizes):
+    sizes.setdefault('min_size', 1024)
+    sizes.setdefault('max_size', 64 * 1024)
+    return b''.join(bytes(view) for view in Relay(response, **sizes))
+
+
+def make_response(raw):
+    response = requests.Response()
+    response.status_code = 200
+    response.raw = raw
+    return response
+
+
+class ReadOnlyBody:
+    """A raw body with read() and close() only, as some adapters and test doubles have"""
+
+    def __init__(self, data):
+        self.body = io.BytesIO(data)
+
+    def read(self, amount=-1, **kwargs):
+        return self.body.read(amount)
+
+    def close(self):
+        self.body.close()
+
+
+def test_drive_response_is_read_from_the_socket_reader():
+    drive = start_fake_drive(300_000)
+    try:
+        response = requests.get(drive.export_url + 'track', stream=True)
+        assert relay._socket_readinto(response) is not None
+        assert relayed(response) == drive.payload
+    finally:
+        drive.shutdown()
+
+
+def test_raw_body_without_an_http_client_reader_uses_its_own_readinto():
+    data = bytes(range(256)) * 1000
+    response = make_response(io.BytesIO(data))
+    assert relay._socket_readinto(response) is None
+    assert relayed(response) == data
+
+
+def test_raw_body_without_readinto_falls_back_to_iter_content():
+    data = bytes(range(256)) * 1000
+    response = make_response(ReadOnlyBody(data))
+    assert relayed(response, min_size=1000, max_size=4096) == data
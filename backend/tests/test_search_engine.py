@@ -0,0 +1,35 @@
+from benchmarks.bench_search import make_catalog
+from utils.search_engine import MIN_CHUNK_ROWS, SearchIndex
+
+COLUMNS = ['title', 'artist', 'album', 'file_id']
+
+
+def test_best_match_late_in_postings_is_found_with_a_limit():
+    rows = [('Love Letter', 'Some Singer', 'Song Book', f'file{i}') for i in range(300)]
+    rows.append(('Love Song', 'Some Singer', 'Singles', 'file300'))
+    index = SearchIndex(COLUMNS, rows)
+    assert index.search('love song')[0] == 300
+    assert index.search('love song', 5)[0] == 300
+
+
+def test_results_do_not_depend_on_the_limit():
+    rows = [(f'Dil {word} {i}', 'Artist', 'Album', f'file{i}')
+            for i, word in enumerate(['Diya', 'Hai', 'Chahta'] * 100 + ['Se'] * 50)]
+    index = SearchIndex(COLUMNS, rows)
+    everything = index.search('dil se')
+    for limit in (1, 5, 21, 100, 400):
+        assert index.search('dil se', limit) == everything[:limit]
+
+
+def test_rows_scored_stay_flat_as_the_catalog_grows():
+    # Each query matches thousands of rows at this size; the results settle after a chunk or two
+    df = make_catalog(100_000)
+    index = SearchIndex(df.columns, list(df.itertuples(index=False, name=None)))
+    score = index._score
+    scored = []
+    index._score = lambda rows, *args: scored.append(len(rows)) or score(rows, *args)
+    for query in ('rafi', 'kishore kumar', 'dil', 'mastani'):
+        scored.clear()
+        found = index.search(query, 50)
+        assert sum(scored) <= 4 * max(MIN_CHUNK_ROWS, 2 * 50), query
+        assert found == index.search(query)[:50]
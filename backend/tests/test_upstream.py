@@ -0,0 +1,69 @@
+import pytest
+import requests
+from utils.upstream import CircuitBreaker, CircuitOpenError, UpstreamClient
+
+
+class FakeResponse:
+    status_code = 200
+
+    def close(self):
+        pass
+
+
+class FakeSession:
+    """Raises each queued exception in turn, then answers 200"""
+
+    def __init__(self, errors):
+        self.errors = list(errors)
+
+    def get(self, url, **kwargs):
+        if self.errors:
+            raise self.errors.pop(0)
+        return FakeResponse()
+
+
+def make_client(errors, reset_timeout=0.0):
+    client = UpstreamClient(4, 1, 1, 0, 0, 0, CircuitBreaker(1, reset_timeout))
+    client.session = FakeSession(errors)
+    return client
+
+
+@pytest.mark.parametrize('error', [requests.exceptions.ChunkedEncodingError('broken'),
+                                   requests.exceptions.SSLError('tls'),
+                                   requests.exceptions.InvalidURL('bad'),
+                                   ValueError('not from requests')])
+def test_failed_half_open_trial_does_not_wedge_the_breaker(error):
+    client = make_client([requests.ConnectionError('down'), error])
+    with pytest.raises(requests.ConnectionError):
+        client.get('http://drive/file')
+    # Half-open: this call is the trial, and fails with something other than a connection error
+    with pytest.raises(type(error)):
+        client.get('http://drive/file')
+    assert client.get('http://drive/file').status_code == 200
+    assert client.breaker.state == 'closed'
+
+
+def test_request_exceptions_count_as_failures():
+    client = make_client([requests.exceptions.ChunkedEncodingError('broken')], reset_timeout=60.0)
+    with pytest.raises(requests.exceptions.ChunkedEncodingError):
+        client.get('http://drive/file')
+    with pytest.raises(CircuitOpenError):
+        client.get('http://drive/file')
+
+
+def test_only_the_trial_call_settles_the_trial():
+    breaker = CircuitBreaker(1, 0.0)
+    earlier = breaker.before_call()  # Started while the circuit was closed
+    assert earlier is None
+    breaker.record_failure()
+    trial = breaker.before_call()
+    assert trial is not None
+
+    # The earlier call finishing, even with a failure, leaves the trial in flight
+    breaker.record_failure(earlier)
+    breaker.end_trial(earlier)
+    with pytest.raises(CircuitOpenError):
+        breaker.before_call()
+
+    breaker.end_trial(trial)
+    assert breaker.before_call() is not None
@@ -0,0 +1,81 @@
+import io
+import os
+import zipfile
+import zlib
+from utils.zip_stream import ZipStream
+
+FOUR_GIB = 1 << 32
+
+
+def build(members):
+    archive = ZipStream()
+    data = b''
+    for name, chunks in members:
+        data += b''.join(archive.member(name, chunks, modified=1_700_000_000))
+    return archive, data + b''.join(archive.finish())
+
+
+def test_archive_round_trips_through_zipfile():
+    tracks = [('Album/01 - Kun Faya Kun.flac', [os.urandom(70_000), b'', os.urandom(1234)]),
+              ('Album/02 - Nadaan Parindey.flac', [os.urandom(5)]),
+              ('Album/03 - Empty.flac', [])]
+    archive, data = build(tracks)
+    assert archive.offset == len(data)
+    with zipfile.ZipFile(io.BytesIO(data)) as z:
+        assert z.testzip() is None
+        assert z.namelist() == [name for name, _ in tracks]
+        for (name, chunks), info in zip(tracks, z.infolist()):
+            assert z.read(name) == b''.join(chunks)
+            assert info.compress_type == zipfile.ZIP_STORED
+            assert info.external_attr >> 16 == 0o100644
+            assert info.date_time[0] >= 2023
+
+
+def test_non_ascii_names_are_utf8():
+    name = 'Sufiyana/Tere Bina — ए आर रहमान.flac'
+    _, data = build([(name, [b'x' * 10])])
+    with zipfile.ZipFile(io.BytesIO(data)) as z:
+        assert z.namelist() == [name]
+        assert z.infolist()[0].flag_bits & 0x0800
+
+
+class _Sized(bytes):
+    """Stands for size zero bytes of member data; written as a hole in a sparse file"""
+
+    def __new__(cls, size):
+        chunk = super().__new__(cls, b'')
+        chunk.size = size
+        return chunk
+
+    def __len__(self):
+        return self.size
+
+    def __bool__(self):
+        return True
+
+
+def test_offsets_past_4_gib_round_trip_through_zipfile(tmp_path, monkeypatch):
+    real_crc32 = zlib.crc32
+    monkeypatch.setattr(zlib, 'crc32',
+                        lambda chunk, crc=0: crc if isinstance(chunk, _Sized) else real_crc32(chunk, crc))
+    archive = ZipStream()
+    big = FOUR_GIB + 100
+    path = tmp_path / 'album.zip'
+    with open(path, 'wb') as f:
+        for chunk in archive.member('big.flac', [_Sized(big)]):
+            if isinstance(chunk, _Sized):
+                f.seek(len(chunk), os.SEEK_CUR)
+            else:
+                f.write(chunk)
+        second_offset = archive.offset
+        for chunk in archive.member('small.flac', [b'abc']):
+            f.write(chunk)
+        for chunk in archive.finish():
+            f.write(chunk)
+    assert os.path.getsize(path) == archive.offset
+
+    with zipfile.ZipFile(path) as z:
+        first, second = z.infolist()
+        assert first.file_size == first.compress_size == big
+        assert second.header_offset == second_offset > FOUR_GIB
+        assert z.read('small.flac') == b'abc'
@@ -0,0 +1,344 @@
+"""
+Admission control and pacing for requests that read from Drive.
+
+Every gunicorn worker shares the same limits through files in
+ADMISSION_DIR, the way the download cache shares progress:
+
+- Upstream slots are lock files; an upstream read (a download filling
+  the cache, or a range cache broadcast) holds one (flock) while it runs,
+  so at most ADMISSION_MAX_UPSTREAM such reads run at once across all
+  workers, and responses served from disk take none. Bulk transfers may
+  only take the first ADMISSION_BULK_SLOTS of them and ranged streams
+  leave the last ADMISSION_INTERACTIVE_RESERVE to playback starts and
+  seeks, so those always find room first. A read that finds no slot
+  within ADMISSION_QUEUE_TIMEOUT is turned away with Overloaded (503 and
+  Retry-After) rather than queued.
+- Bandwidth is paced where bytes come in from Drive, with token buckets
+  kept in one shared mmap: a global one (ADMISSION_GLOBAL_RATE) and a
+  table of per-client ones (ADMISSION_CLIENT_RATE). The first
+  ADMISSION_INTERACTIVE_BYTES of a stream take tokens without waiting for
+  them, so bulk transfers and the rest of long streams are what slows
+  down. Optional work (prefetch) takes spare tickets, which only take
+  global tokens when SPARE_RESERVE of the burst is left after, and never
+  run the bucket into debt.
+"""
+import asyncio
+import fcntl
+import mmap
+import os
+import struct
+import threading
+import time
+import zlib
+from config import (ADMISSION_DIR, ADMISSION_MAX_UPSTREAM, ADMISSION_BULK_SLOTS,
+                    ADMISSION_INTERACTIVE_RESERVE, ADMISSION_QUEUE_TIMEOUT, ADMISSION_RETRY_AFTER,
+                    ADMISSION_GLOBAL_RATE, ADMISSION_CLIENT_RATE, ADMISSION_BURST_SECONDS,
+                    ADMISSION_INTERACTIVE_BYTES, ADMISSION_TRUST_FORWARDED)
+from utils import metrics
+
+# Priority classes, most urgent first
+INTERACTIVE, STREAM, BULK = 0, 1, 2
+CLASS_NAMES = ('interactive', 'stream', 'bulk')
+
+POLL_INTERVAL = 0.02  # Seconds between attempts to find a free slot
+CLIENT_BUCKETS = 4096  # Clients are hashed into this many per-client buckets
+BUCKET = struct.Struct('<dd')  # tokens, last refill (time.monotonic(), shared by all processes)
+SPARE_RESERVE = 0.5  # Share of the global burst that spare tickets leave to live traffic
+
+ADMITTED = metrics.Counter('admission_admitted_total', 'Upstream requests given a slot', ('class',))
+REJECTED = metrics.Counter('admission_rejected_total', 'Upstream requests turned away with 503',
+                           ('class',))
+WAITED = metrics.Histogram('admission_wait_seconds', 'Time spent waiting for an upstream slot',
+                           ('class',))
+PACED = metrics.Counter('admission_paced_seconds_total',
+                        'Time responses were held back by the bandwidth limits', ('class',))
+
+
+class Overloaded(Exception):
+    """No upstream slot came free in time; retry_after is a hint in seconds"""
+
+    def __init__(self, retry_after):
+        super().__init__(f"Server is busy, retry in {retry_after:.0f}s")
+        self.retry_after = retry_after
+
+
+def client_key(remote_addr, forwarded_for=None):
+    """The address limits are applied to: the first X-Forwarded-For hop when the proxy is trusted"""
+    if ADMISSION_TRUST_FORWARDED and forwarded_for:
+        return forwarded_for.split(',')[0].strip()
+    return remote_addr or 'unknown'
+
+
+def stream_priority(start, end):
+    """Class of a /stream request for bytes start..end; ?t= seeks are INTERACTIVE"""
+    if start == 0 or end - start + 1 <= ADMISSION_INTERACTIVE_BYTES:
+        return INTERACTIVE
+    return STREAM
+
+
+class SharedBuckets:
+    """
+    Token buckets in a file mapped by every worker: index 0 is the global
+    bucket, 1.. the per-client table. A bucket starts full.
+    """
+
+    def __init__(self, path, count):
+        self.path = path
+        self.count = count
+        self._pid = None
+        self._fd = None
+        self._map = None
+        self._lock = threading.Lock()
+
+    def _open(self):
+        # Opened per process, on first use after any fork
+        if self._pid != os.getpid():
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+            size = self.count * BUCKET.size
+            if os.fstat(fd).st_size < size:
+                os.ftruncate(fd, size)
+            self._fd = fd
+            self._map = mmap.mmap(fd, size)
+            self._pid = os.getpid()
+
+    def take(self, index, amount, rate, burst, wait):
+        """
+        Take amount tokens and return the seconds to wait before sending.
+        With wait False the tokens are taken at once (the bucket may go up
+        to one burst into debt, which others then wait out) and 0 returned.
+        """
+        offset = index * BUCKET.size
+        with self._lock:
+            self._open()
+            # Record locks exclude other processes; _lock the other threads
+            fcntl.lockf(self._fd, fcntl.LOCK_EX, BUCKET.size, offset)
+            try:
+                tokens, updated = BUCKET.unpack_from(self._map, offset)
+                now = time.monotonic()
+                tokens = min(burst, tokens + (now - updated) * rate)
+                tokens -= amount
+                if not wait:
+                    tokens = max(tokens, -burst)
+                BUCKET.pack_into(self._map, offset, tokens, now)
+            finally:
+                fcntl.lockf(self._fd, fcntl.LOCK_UN, BUCKET.size, offset)
+        return -tokens / rate if wait and tokens < 0 else 0.0
+
+    def take_spare(self, index, amount, rate, burst, reserve):
+        """
+        Take amount tokens if at least reserve are left after, and return 0;
+        otherwise take none and return the seconds until there would be.
+        """
+        offset = index * BUCKET.size
+        with self._lock:
+            self._open()
+            fcntl.lockf(self._fd, fcntl.LOCK_EX, BUCKET.size, offset)
+            try:
+                tokens, updated = BUCKET.unpack_from(self._map, offset)
+                now = time.monotonic()
+                tokens = min(burst, tokens + (now - updated) * rate)
+                short = amount + reserve - tokens
+                if short <= 0:
+                    tokens -= amount
+                BUCKET.pack_into(self._map, offset, tokens, now)
+            finally:
+                fcntl.lockf(self._fd, fcntl.LOCK_UN, BUCKET.size, offset)
+        return short / rate if short > 0 else 0.0
+
+
+class SlotPool:
+    """count lock files; a slot is held by whoever holds the flock on it"""
+
+    def __init__(self, directory, count):
+        self.directory = directory
+        self.count = count
+        self._pid = None
+        self._fds = None
+        self._held = set()
+        self._lock = threading.Lock()
+
+    def _fd(self, slot):
+        # Opened per process, on first use after any fork
+        if self._pid != os.getpid():
+            os.makedirs(self.directory, exist_ok=True)
+            self._fds = [None] * self.count
+            self._held = set()
+            self._pid = os.getpid()
+        if self._fds[slot] is None:
+            self._fds[slot] = os.open(os.path.join(self.directory, f"slot-{slot:04d}"),
+                                      os.O_RDWR | os.O_CREAT, 0o644)
+        return self._fds[slot]
+
+    def try_acquire(self, candidates):
+        """Lock the first free slot among candidates and return it, or None"""
+        with self._lock:
+            for slot in candidates:
+                # flock is per open file, so this process's own slots are tracked here
+                if self._pid == os.getpid() and slot in self._held:
+                    continue
+                try:
+                    fcntl.flock(self._fd(slot), fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except BlockingIOError:
+                    continue
+                self._held.add(slot)
+                return slot
+        return None
+
+    def release(self, slot):
+        with self._lock:
+            if self._pid == os.getpid() and slot in self._held:
+                fcntl.flock(self._fds[slot], fcntl.LOCK_UN)
+                self._held.discard(slot)
+
+
+class Ticket:
+    """One admitted upstream read: its slot, and pacing of the bytes it reads"""
+
+    def __init__(self, admission, priority, client, slot, spare=False):
+        self.admission = admission
+        self.priority = priority
+        self.client_index = 1 + zlib.crc32(client.encode('utf-8')) % CLIENT_BUCKETS
+        self.slot = slot
+        self.spare = spare
+        self.sent = 0
+
+    def delay(self, amount):
+        """
+        Seconds to hold back the next amount bytes. A spare ticket first
+        sleeps here until the global bucket has amount tokens to spare.
+        """
+        admission = self.admission
+        # The head of a stream (and a seek) goes first; afterwards it is paced like the rest
+        urgent = self.priority == INTERACTIVE and self.sent < ADMISSION_INTERACTIVE_BYTES
+        self.sent += amount
+        wait = 0.0
+        if admission.global_rate and self.spare:
+            burst = admission.global_rate * admission.burst_seconds
+            reserve = burst * SPARE_RESERVE
+            # In pieces the spare share can hold, so any chunk fits
+            left = amount
+            while left > 0:
+                piece = min(left, burst - reserve)
+                short = admission.buckets.take_spare(0, piece, admission.global_rate, burst, reserve)
+                if short:
+                    PACED.inc(CLASS_NAMES[self.priority], amount=short)
+                    time.sleep(short)
+                else:
+                    left -= piece
+        elif admission.global_rate:
+            wait = admission.buckets.take(0, amount, admission.global_rate,
+                                          admission.global_rate * admission.burst_seconds,
+                                          not urgent)
+        if admission.client_rate:
+            wait = max(wait, admission.buckets.take(self.client_index, amount, admission.client_rate,
+                                                    admission.client_rate * admission.burst_seconds,
+                                                    not urgent))
+        if wait:
+            PACED.inc(CLASS_NAMES[self.priority], amount=wait)
+        return wait
+
+    def release(self):
+        if self.slot is not None:
+            self.admission.slots.release(self.slot)
+            self.slot = None
+
+
+class Admission:
+    """Hands out upstream slots by priority class; see the module docstring"""
+
+    def __init__(self, directory=ADMISSION_DIR, max_upstream=ADMISSION_MAX_UPSTREAM,
+                 bulk_slots=ADMISSION_BULK_SLOTS, interactive_reserve=ADMISSION_INTERACTIVE_RESERVE,
+                 queue_timeout=ADMISSION_QUEUE_TIMEOUT, retry_after=ADMISSION_RETRY_AFTER,
+                 global_rate=ADMISSION_GLOBAL_RATE, client_rate=ADMISSION_CLIENT_RATE,
+                 burst_seconds=ADMISSION_BURST_SECONDS):
+        self.max_upstream = max_upstream
+        self.queue_timeout = queue_timeout
+        self.retry_after = retry_after
+        self.global_rate = global_rate
+        self.client_rate = client_rate
+        self.burst_seconds = burst_seconds
+        self.slots = SlotPool(os.path.join(directory, 'slots'), self.max_upstream)
+        self.buckets = SharedBuckets(os.path.join(directory, 'buckets'), 1 + CLIENT_BUCKETS)
+        # Slots each class may take, in the order tried: bulk and streams from
+        # the bottom, interactive requests from the top, so they rarely meet.
+        # With no slots, every request is admitted (and only paced).
+        stream_slots = max(1, self.max_upstream - interactive_reserve)
+        self.candidates = {
+            INTERACTIVE: list(range(self.max_upstream - 1, -1, -1)),
+            STREAM: list(range(stream_slots)),
+            BULK: list(range(max(1, min(bulk_slots, stream_slots)))),
+        } if self.max_upstream > 0 else None
+
+    def _ticket(self, priority, client, slot, started, spare=False):
+        name = CLASS_NAMES[priority]
+        if slot is None and self.candidates is not None:
+            REJECTED.inc(name)
+            raise Overloaded(self.retry_after)
+        ADMITTED.inc(name)
+        WAITED.observe(time.monotonic() - started, name)
+        return Ticket(self, priority, client, slot, spare)
+
+    def admit(self, priority, client):
+        """Ticket for an upstream read, waiting up to queue_timeout; raises Overloaded"""
+        started = time.monotonic()
+        if self.candidates is None:
+            return self._ticket(priority, client, None, started)
+        deadline = started + self.queue_timeout
+        candidates = self.candidates[priority]
+        slot = self.slots.try_acquire(candidates)
+        while slot is None and time.monotonic() < deadline:
+            time.sleep(POLL_INTERVAL)
+            slot = self.slots.try_acquire(candidates)
+        return self._ticket(priority, client, slot, started)
+
+    def try_admit(self, priority, client, spare=False):
+        """
+        Ticket if a slot is free right now, else None (for optional work that
+        should not queue). A spare ticket only uses global bandwidth that live
+        traffic leaves over; see Ticket.delay().
+        """
+        started = time.monotonic()
+        slot = None
+        if self.candidates is not None:
+            slot = self.slots.try_acquire(self.candidates[priority])
+            if slot is None:
+                return None
+        return self._ticket(priority, client, slot, started, spare)
+
+    async def aadmit(self, priority, client):
+        """admit() for the event loop"""
+        started = time.monotonic()
+        if self.candidates is None:
+            return self._ticket(priority, client, None, started)
+        deadline = started + self.queue_timeout
+        candidates = self.candidates[priority]
+        slot = self.slots.try_acquire(candidates)
+        while slot is None and time.monotonic() < deadline:
+            await asyncio.sleep(POLL_INTERVAL)
+            slot = self.slots.try_acquire(candidates)
+        return self._ticket(priority, client, slot, started)
+
+
+class Held:
+    """
+    Iterable over chunks read while holding ticket. close() (which FileCache
+    calls when a fill ends) releases the ticket and closes chunks, even if
+    iteration never started.
+    """
+
+    def __init__(self, ticket, chunks):
+        self.ticket = ticket
+        self.chunks = chunks
+
+    def __iter__(self):
+        try:
+            yield from self.chunks
+        finally:
+            self.close()
+
+    def close(self):
+        self.ticket.release()
+        close = getattr(self.chunks, 'close', None)
+        if close is not None:
+            close()
@@ -0,0 +1,187 @@
+"""
+Fan-out of one upstream range read to many concurrent listeners.
+
+A Broadcast holds the most recent bytes of one upstream response in a
+bounded ring buffer. The producer (the single reader of the upstream
+response) appends to it and never runs more than the buffer size ahead of
+the fastest listener. Listeners read at their own position; one that falls
+behind the start of the buffer is detached with Detached instead of holding
+everyone else back, and picks up from the range cache, where the producer
+has already stored those bytes.
+
+Broadcast is for threads, AsyncBroadcast for a single event loop.
+"""
+import asyncio
+import itertools
+import threading
+from collections import deque
+
+# Longest a waiting producer or listener sleeps before rechecking its state
+WAIT_TIMEOUT = 1.0
+
+
+class Detached(Exception):
+    """The listener fell behind the ring buffer and must read from elsewhere"""
+
+
+class _Ring:
+    """Buffer and listener bookkeeping shared by both Broadcast flavors (no locking)"""
+
+    def __init__(self, key, start, end, capacity):
+        self.key = key
+        self.start = start
+        self.end = end              # Last byte the upstream response covers
+        self.capacity = capacity
+        self.chunks = deque()       # (file offset, bytes)
+        self.buffered = 0
+        self.window_start = start   # Oldest byte still in the buffer
+        self.head = start           # One past the newest byte received
+        self.listeners = {}         # token -> next file offset to read
+        self.done = False
+        self.closed = False         # No listeners were left, or upstream finished
+        self.error = None
+        self._tokens = itertools.count()
+
+    def _covers(self, offset):
+        """Whether a listener starting at offset can be served from this broadcast"""
+        return (not self.closed and self.error is None and self.window_start <= offset <= self.end
+                and offset <= self.head + self.capacity)
+
+    def _attach(self, offset):
+        if not self._covers(offset):
+            return None
+        token = next(self._tokens)
+        self.listeners[token] = offset
+        return token
+
+    def _producer_blocked(self):
+        """Full: even the fastest listener has a whole buffer still to read"""
+        return bool(self.listeners) and self.head - max(self.listeners.values()) >= self.capacity
+
+    def _append(self, chunk):
+        self.chunks.append((self.head, chunk))
+        self.head += len(chunk)
+        self.buffered += len(chunk)
+        # Keep capacity bytes, but never drop what the fastest listener has yet to read
+        fastest = max(self.listeners.values(), default=self.head)
+        chunks = self.chunks
+        while (self.buffered - len(chunks[0][1]) >= self.capacity
+               and chunks[0][0] + len(chunks[0][1]) <= fastest):
+            _, dropped = chunks.popleft()
+            self.buffered -= len(dropped)
+        self.window_start = chunks[0][0]
+
+    def _take(self, token):
+        """
+        Next bytes for a listener: bytes, b'' if it has to wait, or None once
+        the broadcast is over. Raises Detached or the upstream error.
+        """
+        position = self.listeners[token]
+        if position < self.window_start:
+            self._leave(token)
+            raise Detached(position)
+        if position < self.head:
+            for offset, chunk in self.chunks:
+                if offset <= position < offset + len(chunk):
+                    data = chunk[position - offset:]
+                    self.listeners[token] = position + len(data)
+                    return data
+        if self.error is not None:
+            raise self.error
+        if self.done or position > self.end:
+            return None
+        return b''
+
+    def _leave(self, token):
+        self.listeners.pop(token, None)
+        if not self.listeners:
+            self.closed = True
+
+
+class Broadcast(_Ring):
+    """Thread-safe broadcast; the producer runs on its own thread"""
+
+    def __init__(self, key, start, end, capacity):
+        super().__init__(key, start, end, capacity)
+        self.cond = threading.Condition()
+
+    def attach(self, offset):
+        """Listener token reading from offset, or None if the broadcast cannot serve it"""
+        with self.cond:
+            return self._attach(offset)
+
+    def publish(self, chunk):
+        """Producer: add a chunk; returns False once nobody is listening any more"""
+        with self.cond:
+            while self._producer_blocked():
+                self.cond.wait(WAIT_TIMEOUT)
+            if self.closed:
+                return False
+            self._append(chunk)
+            self.cond.notify_all()
+            return True
+
+    def finish(self, error=None):
+        with self.cond:
+            self.done = True
+            self.closed = True
+            self.error = error
+            self.cond.notify_all()
+
+    def read(self, token):
+        """Block until the listener's next bytes are available; None at the end"""
+        with self.cond:
+            while True:
+                data = self._take(token)
+                if data != b'':
+                    self.cond.notify_all()  # The producer may be waiting for room
+                    return data
+                self.cond.wait(WAIT_TIMEOUT)
+
+    def leave(self, token):
+        with self.cond:
+            self._leave(token)
+            self.cond.notify_all()
+
+
+class AsyncBroadcast(_Ring):
+    """Broadcast for listeners and a producer task on one event loop"""
+
+    def __init__(self, key, start, end, capacity):
+        super().__init__(key, start, end, capacity)
+        self.cond = asyncio.Condition()
+
+    def attach(self, offset):
+        return self._attach(offset)
+
+    async def publish(self, chunk):
+        async with self.cond:
+            while self._producer_blocked():
+                await self.cond.wait()
+            if self.closed:
+                return False
+            self._append(chunk)
+            self.cond.notify_all()
+            return True
+
+    async def finish(self, error=None):
+        async with self.cond:
+            self.done = True
+            self.closed = True
+            self.error = error
+            self.cond.notify_all()
+
+    async def read(self, token):
+        async with self.cond:
+            while True:
+                data = self._take(token)
+                if data != b'':
+                    self.cond.notify_all()
+                    return data
+                await self.cond.wait()
+
+    async def leave(self, token):
+        async with self.cond:
+            self._leave(token)
+            self.cond.notify_all()
+
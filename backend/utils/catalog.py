@@ -0,0 +1,279 @@
+import base64
+import contextlib
+import fcntl
+import os
+import threading
+import time
+import pandas as pd
+from config import CATALOG_BACKEND, CATALOG_DB_PATH
+from utils.search_engine import SearchIndex
+
+# How often (in seconds) a worker re-stats the catalog file to look for changes
+STAT_INTERVAL = float(os.environ.get('CATALOG_STAT_INTERVAL', '1.0'))
+
+CATALOG_COLUMNS = ['title', 'artist', 'album', 'file_id']
+
+# Optional per-track stream details filled in from FLAC headers at ingest
+AUDIO_COLUMNS = ['duration', 'sample_rate', 'bit_depth', 'channels', 'total_samples', 'audio_offset']
+
+_catalogs = {}
+_catalogs_lock = threading.Lock()
+
+
+class InvalidCursor(Exception):
+    """Raised for a pagination cursor that is malformed or from an older catalog"""
+
+
+class PagedSnapshot:
+    """
+    Read-only view of the catalog at one version. Subclasses provide
+    version, version_tag, columns, page(), search() and album().
+    """
+
+    __slots__ = ()
+
+    @property
+    def exists(self):
+        return self.version is not None
+
+    def to_dicts(self, rows):
+        """Materialize row tuples as the dict records the API returns"""
+        columns = self.columns
+        return [dict(zip(columns, row)) for row in rows]
+
+    def encode_cursor(self, offset):
+        """Opaque cursor for the page starting at offset, valid for this snapshot only"""
+        raw = f"{offset}.{self.version_tag}".encode('ascii')
+        return base64.urlsafe_b64encode(raw).decode('ascii').rstrip('=')
+
+    def decode_cursor(self, cursor):
+        """Offset encoded in cursor (0 for no cursor), raising InvalidCursor if stale"""
+        if not cursor:
+            return 0
+        try:
+            raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)).decode('ascii')
+            offset, tag = raw.split('.', 1)
+            offset = int(offset)
+        except ValueError:
+            raise InvalidCursor("Invalid cursor")
+        if tag != self.version_tag or offset < 0:
+            raise InvalidCursor("The catalog has changed since this cursor was issued, search again")
+        return offset
+
+
+class CatalogSnapshot(PagedSnapshot):
+    """Immutable, in-memory copy of a tracks CSV together with its search index"""
+
+    __slots__ = ('path', 'version', 'columns', 'rows', 'index')
+
+    def __init__(self, path, version, columns, rows):
+        self.path = path
+        self.version = version
+        self.columns = tuple(columns)
+        self.rows = rows
+        self.index = SearchIndex(self.columns, rows)
+
+    def __len__(self):
+        return len(self.rows)
+
+    def search(self, query, limit=None):
+        """
+        Ranked, typo-tolerant search over title, artist and album.
+        Returns all tracks (in file order) if query is empty.
+        """
+        rows = self.rows
+        return self.to_dicts(rows[row_id] for row_id in self.index.search(query, limit))
+
+    def album(self, name):
+        """Tracks whose album is name (ignoring case), in file order"""
+        column = self.columns.index('album')
+        name = name.strip().casefold()
+        return self.to_dicts(row for row in self.rows if row[column].casefold() == name)
+
+    def page(self, query, offset, limit):
+        """
+        One page of search results as row tuples.
+        Returns (rows, next_offset); next_offset is None on the last page.
+        """
+        end = offset + limit
+        # Rank one extra result to learn whether another page exists
+        row_ids = self.index.search(query, end + 1)
+        rows = self.rows
+        page = [rows[row_id] for row_id in row_ids[offset:end]]
+        return page, (end if len(row_ids) > end else None)
+
+    @property
+    def version_tag(self):
+        """Short string that changes whenever the catalog file does"""
+        mtime_ns, size = self.version
+        return f"{mtime_ns:x}.{size:x}"
+
+
+def _file_version(path):
+    """Cheap change detector for the catalog file: (mtime_ns, size), None if missing"""
+    try:
+        st = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return (st.st_mtime_ns, st.st_size)
+
+
+def _number(value):
+    """CSV text of an audio column as int/float, None when empty or invalid"""
+    try:
+        return int(value)
+    except ValueError:
+        try:
+            return float(value)
+        except ValueError:
+            return None
+
+
+def _load_snapshot(path, version):
+    if version is None:
+        return CatalogSnapshot(path, None, CATALOG_COLUMNS, [])
+
+    df = pd.read_csv(path, dtype=str, keep_default_na=False)
+    df = df.apply(lambda column: column.str.strip())
+    for column in AUDIO_COLUMNS:
+        if column in df.columns:
+            df[column] = pd.Series([_number(value) for value in df[column]], index=df.index, dtype=object)
+    rows = list(df.itertuples(index=False, name=None))
+    print(f"[Catalog] Loaded {len(rows)} tracks from {path}")
+    return CatalogSnapshot(path, version, df.columns, rows)
+
+
+class Catalog:
+    """
+    Per-worker resident copy of a tracks CSV.
+
+    The file is loaded and indexed once; afterwards its mtime/size is checked
+    at most once per stat_interval and a fresh snapshot is built in a
+    background thread when it changes. Readers keep using the current snapshot until the new one is
+    swapped in, so a search never waits on a reload.
+    """
+
+    def __init__(self, path, stat_interval=STAT_INTERVAL):
+        self.path = path
+        self.stat_interval = stat_interval
+        self._snapshot = None
+        self._next_check = 0.0
+        self._reload_lock = threading.Lock()
+
+    def snapshot(self):
+        """Return the current snapshot, scheduling a reload if the file changed"""
+        snapshot = self._snapshot
+        if snapshot is None:
+            return self._initial_load()
+
+        now = time.monotonic()
+        if now >= self._next_check:
+            self._next_check = now + self.stat_interval
+            if _file_version(self.path) != snapshot.version:
+                self._reload_in_background()
+        return snapshot
+
+    def invalidate(self):
+        """Force a change check on the next snapshot() call"""
+        self._next_check = 0.0
+
+    def _initial_load(self):
+        # Nothing to serve yet, so the very first load has to be synchronous
+        with self._reload_lock:
+            if self._snapshot is None:
+                self._snapshot = _load_snapshot(self.path, _file_version(self.path))
+                self._next_check = time.monotonic() + self.stat_interval
+        return self._snapshot
+
+    def _reload_in_background(self):
+        if not self._reload_lock.acquire(blocking=False):
+            return  # A reload is already in progress
+
+        def reload():
+            try:
+                # Read the version before the data so a write that races with
+                # the load is picked up by the next check
+                version = _file_version(self.path)
+                self._snapshot = _load_snapshot(self.path, version)
+            except Exception as e:
+                print(f"[Catalog] Reload of {self.path} failed, keeping previous snapshot: {str(e)}")
+                self.invalidate()
+            finally:
+                self._reload_lock.release()
+
+        threading.Thread(target=reload, name='catalog-reload', daemon=True).start()
+
+    def replace_tracks(self, tracks):
+        """Replace the whole CSV with tracks (dicts with CATALOG_COLUMNS keys)"""
+        with _write_lock(self.path):
+            write_catalog_csv(_tracks_frame(tracks), self.path)
+        return len(tracks)
+
+    def upsert_tracks(self, tracks):
+        """Insert or update tracks by file_id. Rewrites the whole CSV."""
+        with _write_lock(self.path):
+            if os.path.exists(self.path):
+                df = pd.read_csv(self.path, dtype=str, keep_default_na=False)
+            else:
+                df = pd.DataFrame(columns=CATALOG_COLUMNS)
+            df = pd.concat([df, _tracks_frame(tracks)], ignore_index=True)
+            df = df.drop_duplicates(subset='file_id', keep='last')
+            write_catalog_csv(df, self.path)
+        return len(tracks)
+
+
+def _tracks_frame(tracks):
+    """DataFrame of track dicts with the catalog columns first; object dtype keeps ints as ints"""
+    df = pd.DataFrame(list(tracks), dtype=object)
+    extra = [column for column in df.columns if column not in CATALOG_COLUMNS]
+    return df.reindex(columns=CATALOG_COLUMNS + extra)
+
+
+@contextlib.contextmanager
+def _write_lock(path):
+    """Exclusive lock serializing read-modify-write cycles on a CSV across processes"""
+    lock_path = f"{os.path.abspath(path)}.lock"
+    os.makedirs(os.path.dirname(lock_path), exist_ok=True)
+    fd = os.open(lock_path, os.O_RDWR | os.O_CREAT, 0o644)
+    try:
+        fcntl.flock(fd, fcntl.LOCK_EX)
+        yield
+    finally:
+        os.close(fd)
+
+
+def get_catalog(path):
+    """Return the process-wide Catalog for a CSV path"""
+    path = os.path.abspath(path)
+    catalog = _catalogs.get(path)
+    if catalog is None:
+        with _catalogs_lock:
+            catalog = _catalogs.setdefault(path, Catalog(path))
+    return catalog
+
+
+def active_catalog(csv_path):
+    """
+    The catalog the app reads and writes: the SQLite database when
+    CATALOG_BACKEND is 'sqlite', otherwise the CSV at csv_path.
+    """
+    if CATALOG_BACKEND == 'sqlite':
+        from utils.catalog_db import get_sqlite_catalog
+        return get_sqlite_catalog(CATALOG_DB_PATH)
+    return get_catalog(csv_path)
+
+
+def write_catalog_csv(df, path):
+    """
+    Atomically replace a tracks CSV (temp file + rename) so readers in other
+    workers never see a half-written file, then invalidate this worker's copy.
+    """
+    directory = os.path.dirname(os.path.abspath(path))
+    os.makedirs(directory, exist_ok=True)
+    tmp_path = os.path.join(directory, f".{os.path.basename(path)}.{os.getpid()}.tmp")
+    df.to_csv(tmp_path, index=False)
+    os.replace(tmp_path, path)
+
+    catalog = _catalogs.get(os.path.abspath(path))
+    if catalog is not None:
+        catalog.invalidate()
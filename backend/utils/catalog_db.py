@@ -0,0 +1,290 @@
+"""
+SQLite catalog backend.
+
+Tracks live in a `tracks` table keyed on file_id with an FTS5 index over
+title, artist and album. Writes are incremental upserts in a single
+transaction, and the database runs in WAL mode so readers in every worker
+keep searching while the uploader writes. Select it with
+CATALOG_BACKEND=sqlite.
+
+Import the existing CSVs with
+
+    python -m utils.catalog_db import [tracks.csv ...]
+"""
+import os
+import sqlite3
+import sys
+import threading
+import pandas as pd
+from config import CATALOG_DB_PATH, TRACKS_CSV_PATH
+from utils.catalog import CATALOG_COLUMNS, AUDIO_COLUMNS, PagedSnapshot
+from utils.search_engine import FIELD_WEIGHTS, normalize_text, phonetic_key, query_keys
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# The CSV copies older deployments may still have, oldest first, then the
+# catalog itself. On import, later files win for duplicate file_ids: the
+# catalog (backend/data/tracks.csv unless TRACKS_CSV is set) is the one the
+# API serves and the uploader writes, and it holds the curated metadata that
+# used to live in backend/tracks.csv.
+LEGACY_CSV_PATHS = [
+    os.path.join(os.path.dirname(BACKEND_DIR), 'data', 'tracks.csv'),
+    os.path.join(BACKEND_DIR, 'tracks.csv'),
+    TRACKS_CSV_PATH,
+]
+
+READ_BUSY_TIMEOUT_MS = 5000
+WRITE_BUSY_TIMEOUT_MS = 30000
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS tracks (
+    id INTEGER PRIMARY KEY,
+    file_id TEXT NOT NULL UNIQUE,
+    title TEXT NOT NULL DEFAULT '',
+    artist TEXT NOT NULL DEFAULT '',
+    album TEXT NOT NULL DEFAULT ''
+);
+CREATE VIRTUAL TABLE IF NOT EXISTS tracks_fts USING fts5(
+    title, artist, album, tokenize='unicode61', prefix='2 3'
+);
+CREATE TABLE IF NOT EXISTS catalog_meta (
+    key TEXT PRIMARY KEY,
+    value INTEGER NOT NULL
+);
+INSERT OR IGNORE INTO catalog_meta (key, value) VALUES ('generation', 0);
+"""
+
+# Columns added to tracks after the first release, created on open if missing
+AUDIO_COLUMN_TYPES = {
+    'duration': 'REAL',
+    'sample_rate': 'INTEGER',
+    'bit_depth': 'INTEGER',
+    'channels': 'INTEGER',
+    'total_samples': 'INTEGER',
+    'audio_offset': 'INTEGER',
+}
+
+TRACK_COLUMNS = CATALOG_COLUMNS + AUDIO_COLUMNS
+_SELECT_COLUMNS = ', '.join(f't.{column}' for column in TRACK_COLUMNS)
+
+_BM25_WEIGHTS = ', '.join(str(FIELD_WEIGHTS[column]) for column in ('title', 'artist', 'album'))
+
+_stores = {}
+_stores_lock = threading.Lock()
+
+
+def fold_text(value):
+    """Index form of a field: the same folded tokens the query side produces"""
+    return ' '.join(phonetic_key(token) for token in normalize_text(value).split())
+
+
+def fts_query(query):
+    """FTS5 MATCH expression requiring every query token as a prefix, or None for an empty query"""
+    keys = query_keys(query)
+    if not keys:
+        return None
+    # Keys are [a-z0-9]+, so quoting them is enough to keep FTS5 syntax out
+    return ' AND '.join(f'"{key}"*' for key in keys)
+
+
+def _track_values(track):
+    values = [str(track.get(column) or '').strip() for column in CATALOG_COLUMNS]
+    for column in AUDIO_COLUMNS:
+        value = track.get(column)
+        values.append(None if value is None or value == '' or value != value else value)
+    return values
+
+
+class SqliteSnapshot(PagedSnapshot):
+    """View of the SQLite catalog at one generation; queries run against the live database"""
+
+    __slots__ = ('store', 'version')
+
+    columns = tuple(TRACK_COLUMNS)
+
+    def __init__(self, store, version):
+        self.store = store
+        self.version = version
+
+    @property
+    def version_tag(self):
+        return f"db{self.version:x}"
+
+    def __len__(self):
+        return self.store.count()
+
+    def page(self, query, offset, limit):
+        rows = self.store.query(query, offset, limit + 1)
+        return rows[:limit], (offset + limit if len(rows) > limit else None)
+
+    def search(self, query, limit=None):
+        """Ranked search over title, artist and album; all tracks in insertion order if query is empty"""
+        return self.to_dicts(self.store.query(query, 0, limit))
+
+    def album(self, name):
+        """Tracks whose album is name (ignoring case), in insertion order"""
+        return self.to_dicts(self.store.album(name))
+
+
+class SqliteCatalog:
+    """
+    Catalog stored in a SQLite database.
+
+    Every write transaction bumps a generation counter. snapshot() reads it,
+    so response caches and ETags keyed on the snapshot version are
+    invalidated by writes from any process.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        conn = self._connect(WRITE_BUSY_TIMEOUT_MS)
+        try:
+            # WAL: readers never block on the writer, and the writer never waits on readers
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.executescript(SCHEMA)
+            existing = {row[1] for row in conn.execute('PRAGMA table_info(tracks)')}
+            for column, column_type in AUDIO_COLUMN_TYPES.items():
+                if column not in existing:
+                    conn.execute(f'ALTER TABLE tracks ADD COLUMN {column} {column_type}')
+        finally:
+            conn.close()
+
+    def _connect(self, busy_timeout_ms):
+        conn = sqlite3.connect(self.path, isolation_level=None, check_same_thread=False)
+        conn.execute(f'PRAGMA busy_timeout={busy_timeout_ms}')
+        conn.execute('PRAGMA synchronous=NORMAL')
+        return conn
+
+    def _reader(self):
+        """This thread's read connection (reopened after a fork)"""
+        local = self._local
+        if getattr(local, 'pid', None) != os.getpid():
+            local.conn = self._connect(READ_BUSY_TIMEOUT_MS)
+            local.conn.execute('PRAGMA query_only=ON')
+            local.pid = os.getpid()
+        return local.conn
+
+    def generation(self):
+        row = self._reader().execute(
+            "SELECT value FROM catalog_meta WHERE key = 'generation'").fetchone()
+        return row[0]
+
+    def snapshot(self):
+        return SqliteSnapshot(self, self.generation())
+
+    def invalidate(self):
+        """Nothing to do: every snapshot() reads the current generation"""
+
+    def count(self):
+        return self._reader().execute('SELECT count(*) FROM tracks').fetchone()[0]
+
+    def query(self, query, offset=0, limit=None):
+        """Row tuples (in TRACK_COLUMNS order) matching query, best match first"""
+        match = fts_query(query)
+        conn = self._reader()
+        if match is None:
+            return conn.execute(
+                f'SELECT {_SELECT_COLUMNS} FROM tracks t ORDER BY t.id LIMIT ? OFFSET ?',
+                (-1 if limit is None else limit, offset)).fetchall()
+
+        # The page is cut from the ranked matches before the join, so only
+        # the rows returned are read from tracks; rowid breaks ties so
+        # consecutive pages never overlap
+        return conn.execute(
+            f'SELECT {_SELECT_COLUMNS} '
+            f'FROM (SELECT rowid, bm25(tracks_fts, {_BM25_WEIGHTS}) AS score FROM tracks_fts '
+            f'      WHERE tracks_fts MATCH ? ORDER BY score, rowid LIMIT ? OFFSET ?) AS matches '
+            f'JOIN tracks t ON t.id = matches.rowid '
+            f'ORDER BY matches.score, t.id',
+            (match, -1 if limit is None else limit, offset)).fetchall()
+
+    def album(self, name):
+        """Row tuples of one album, matched ignoring (ASCII) case"""
+        return self._reader().execute(
+            f'SELECT {_SELECT_COLUMNS} FROM tracks t WHERE t.album = ? COLLATE NOCASE ORDER BY t.id',
+            (name.strip(),)).fetchall()
+
+    def _write(self, apply):
+        conn = self._connect(WRITE_BUSY_TIMEOUT_MS)
+        try:
+            # Take the write lock up front so concurrent writers queue instead of failing
+            conn.execute('BEGIN IMMEDIATE')
+            try:
+                written = apply(conn)
+                conn.execute("UPDATE catalog_meta SET value = value + 1 WHERE key = 'generation'")
+                conn.execute('COMMIT')
+            except BaseException:
+                conn.execute('ROLLBACK')
+                raise
+        finally:
+            conn.close()
+        return written
+
+    @staticmethod
+    def _upsert(conn, tracks):
+        count = 0
+        assignments = ', '.join(f'{column} = ?' for column in TRACK_COLUMNS)
+        placeholders = ', '.join('?' for _ in TRACK_COLUMNS)
+        for track in tracks:
+            values = _track_values(track)
+            title, artist, album, file_id = values[:4]
+            if not file_id:
+                continue
+            row = conn.execute('SELECT id FROM tracks WHERE file_id = ?', (file_id,)).fetchone()
+            if row is None:
+                track_id = conn.execute(
+                    f'INSERT INTO tracks ({", ".join(TRACK_COLUMNS)}) VALUES ({placeholders})',
+                    values).lastrowid
+            else:
+                track_id = row[0]
+                conn.execute(f'UPDATE tracks SET {assignments} WHERE id = ?', values + [track_id])
+                conn.execute('DELETE FROM tracks_fts WHERE rowid = ?', (track_id,))
+            conn.execute('INSERT INTO tracks_fts (rowid, title, artist, album) VALUES (?, ?, ?, ?)',
+                         (track_id, fold_text(title), fold_text(artist), fold_text(album)))
+            count += 1
+        return count
+
+    def upsert_tracks(self, tracks):
+        """Insert or update tracks (dicts with CATALOG_COLUMNS keys) by file_id"""
+        return self._write(lambda conn: self._upsert(conn, tracks))
+
+    def replace_tracks(self, tracks):
+        """Replace the whole catalog with tracks in one transaction"""
+        def apply(conn):
+            conn.execute('DELETE FROM tracks')
+            conn.execute('DELETE FROM tracks_fts')
+            return self._upsert(conn, tracks)
+        return self._write(apply)
+
+    def import_csv(self, path):
+        """Upsert every row of a tracks CSV; returns the number of rows written"""
+        df = pd.read_csv(path, dtype=str, keep_default_na=False)
+        return self.upsert_tracks(df.to_dict('records'))
+
+
+def get_sqlite_catalog(path=CATALOG_DB_PATH):
+    """Return the process-wide SqliteCatalog for a database path"""
+    path = os.path.abspath(path)
+    store = _stores.get(path)
+    if store is None:
+        with _stores_lock:
+            store = _stores.get(path)
+            if store is None:
+                store = _stores[path] = SqliteCatalog(path)
+    return store
+
+
+if __name__ == '__main__':
+    if len(sys.argv) < 2 or sys.argv[1] != 'import':
+        print(__doc__.strip())
+        sys.exit(1)
+
+    store = get_sqlite_catalog()
+    for csv_path in sys.argv[2:] or LEGACY_CSV_PATHS:
+        if not os.path.exists(csv_path):
+            print(f"[Catalog] Skipping missing {csv_path}")
+            continue
+        print(f"[Catalog] Imported {store.import_csv(csv_path)} rows from {csv_path}")
+    print(f"[Catalog] {store.count()} tracks in {store.path}")
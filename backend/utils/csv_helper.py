@@ -1,6 +1,6 @@
-import pandas as pd
 import os
 from config import TRACKS_CSV_PATH
+from utils.catalog import active_catalog
 
 def search_tracks(query):
     """
@@ -8,28 +8,19 @@ def search_tracks(query):
     Returns all tracks if query is empty
     """
     try:
+        snapshot = active_catalog(TRACKS_CSV_PATH).snapshot()
+
         # Verify CSV exists
-        if not os.path.exists(TRACKS_CSV_PATH):
+        if not snapshot.exists:
             print(f"[Error] CSV file not found at: {TRACKS_CSV_PATH}")
             return []
         
-        # Read CSV file
-        df = pd.read_csv(TRACKS_CSV_PATH)
-        print(f"[Search] Loaded {len(df)} tracks from CSV")
-        
-        # Return all tracks if query is empty
-        if not query:
-            return df.to_dict('records')
-        
-        # Convert query to lowercase for case-insensitive search
-        query = query.lower()
-        
-        # Search across all text columns
-        mask = df.apply(lambda x: x.astype(str).str.lower().str.contains(query, na=False)).any(axis=1)
-        results = df[mask]
+        # Ranked search across title, artist and album
+        results = snapshot.search(query)
         
-        print(f"[Search] Query '{query}' found {len(results)} matches")
-        return results.to_dict('records')
+        if query:
+            print(f"[Search] Query '{query.lower()}' found {len(results)} matches")
+        return results
         
     except Exception as e:
         print(f"[Error] Search failed: {str(e)}")
@@ -40,9 +31,8 @@ def search_tracks(query):
 def update_tracks_index(tracks_data):
     """Update or create the tracks index"""
     try:
-        df = pd.DataFrame(tracks_data)
-        df.to_csv(TRACKS_CSV_PATH, index=False)
-        print(f"[Update] Successfully wrote {len(df)} tracks to CSV")
+        count = active_catalog(TRACKS_CSV_PATH).replace_tracks(tracks_data)
+        print(f"[Update] Successfully wrote {count} tracks to the catalog")
     except Exception as e:
         print(f"[Error] Failed to update tracks index: {str(e)}")
         raise 
@@ -1,111 +1,121 @@
-from google.oauth2.credentials import Credentials
-from google_auth_oauthlib.flow import Flow
-from googleapiclient.discovery import build
-from googleapiclient.http import MediaIoBaseDownload
-import requests
-import io
+"""
+Streaming access to public Google Drive files, for scripts and tools.
+
+Metadata comes from the shared DriveResolver (a one-byte probe, cached), so
+looking a file up never downloads it. Contents are read as a generator of
+fixed-size chunks: every chunk is a memoryview into one bytearray that is
+refilled for the next, so a transfer holds O(chunk_size) memory however
+large the file is. Copy a chunk (bytes(chunk)) if it has to outlive the
+next iteration.
+"""
 import os
-import json
-from config import TEMP_DOWNLOAD_DIR
+import threading
+from config import (TEMP_DOWNLOAD_DIR, BASE_EXPORT_URL, RESOLVER_TTL, RESOLVER_NEGATIVE_TTL,
+                    DRIVE_STREAM_CHUNK_SIZE)
+from utils.drive_resolver import DriveResolver
 
 SCOPES = ['https://www.googleapis.com/auth/drive.readonly']
 
 DRIVE_FOLDER_ID = os.getenv("DRIVE_FOLDER_ID")
 
-# Base URL for Google Drive file download
-BASE_EXPORT_URL = "https://drive.google.com/uc?export=download&id="
-
-def get_drive_service(file_id):
-    try:
-        # Construct the file download URL
-        file_url = f"{BASE_EXPORT_URL}{file_id}"
-
-        # Send a GET request to download the file
-        response = requests.get(file_url, stream=True, allow_redirects=True)
-
-        if response.status_code == 404:
-            raise Exception("File not found. Ensure the file ID is correct and the file is publicly accessible.")
-
-        # Use file ID as fallback file name
-        file_name = f"{file_id}.file"
-
-        # Extract filename from headers if available
-        if 'content-disposition' in response.headers:
-            content_disposition = response.headers['content-disposition']
-            if 'filename=' in content_disposition:
-                file_name = content_disposition.split('filename=')[-1].strip('"')
-
-        # Ensure the download directory exists
-        if not os.path.exists(TEMP_DOWNLOAD_DIR):
-            os.makedirs(TEMP_DOWNLOAD_DIR)
-
-        file_path = os.path.join(TEMP_DOWNLOAD_DIR, file_name)
-
-        # Write the file content to disk
-        with open(file_path, 'wb') as file:
-            for chunk in response.iter_content(chunk_size=8192):
-                file.write(chunk)
-
-        print(f"File downloaded successfully: {file_path}")
-        return file_path
-
-    except requests.RequestException as e:
-        print(f"Error downloading file: {str(e)}")
-        raise Exception(f"Error downloading file: {str(e)}")
-
-def stream_file(file_id):
-    service = get_drive_service(file_id)
+_resolver = None
+_resolver_lock = threading.Lock()
+
+
+def get_resolver():
+    """Process-wide DriveResolver, created on first use"""
+    global _resolver
+    if _resolver is None:
+        with _resolver_lock:
+            if _resolver is None:
+                _resolver = DriveResolver(BASE_EXPORT_URL, RESOLVER_TTL, RESOLVER_NEGATIVE_TTL)
+    return _resolver
+
+
+def get_file_metadata(file_id):
+    """
+    {'id', 'name', 'mimeType', 'size', 'acceptsRanges'} for a file, from the
+    resolver's cache after the first call. size is None if Drive did not say.
+    """
+    resolution = get_resolver().resolve(file_id)
+    return {
+        'id': file_id,
+        'name': resolution.filename,
+        'mimeType': resolution.content_type,
+        'size': resolution.total_length,
+        'acceptsRanges': resolution.accepts_ranges,
+    }
+
+
+def _open(resolution, start, end):
+    """Upstream response for bytes start..end; the whole file when both are None"""
+    resolver = get_resolver()
+    if start is None and end is None:
+        response = resolver.open(resolution)
+        expected = 200
+    else:
+        if not resolution.accepts_ranges:
+            raise Exception(f"Drive does not serve {resolution.file_id} by byte range")
+        response = resolver.open(resolution, start or 0, end)
+        expected = 206
+    if response.status_code != expected:
+        response.close()
+        resolver.invalidate(resolution.file_id)
+        raise Exception(f"Failed to read {resolution.file_id} (upstream status {response.status_code})")
+    return response
+
+
+def iter_file(file_id, start=None, end=None, chunk_size=DRIVE_STREAM_CHUNK_SIZE):
+    """
+    Yield the file, or bytes start..end (inclusive; either may be None for
+    the start or end of the file), as memoryviews of at most chunk_size
+    bytes. All of them share one buffer, so each is only valid until the
+    next is requested.
+    """
+    response = _open(get_resolver().resolve(file_id), start, end)
+    buffer = bytearray(chunk_size)
+    view = memoryview(buffer)
+    raw = response.raw
+    raw.decode_content = True
     try:
-        # Get file metadata first
-        file_metadata = service.files().get(fileId=file_id, fields='id,name,mimeType').execute()
-        print(f"Streaming file metadata: {file_metadata}")
-
-        # Get the file content
-        request = service.files().get_media(fileId=file_id)
-        fh = io.BytesIO()
-        downloader = MediaIoBaseDownload(fh, request)
-
-        done = False
-        while not done:
-            status, done = downloader.next_chunk()
-            if status:
-                print(f"Download {int(status.progress() * 100)}%")
-
-        # Reset buffer position
-        fh.seek(0)
-
-        # Return the file data
-        return fh.read()
-    except Exception as e:
-        print(f"Error streaming file: {str(e)}")
-        raise Exception(f"Error streaming file: {str(e)}")
-
-def download_file(file_id):
-    service = get_drive_service(file_id)
-
+        while True:
+            filled = 0
+            # Fill the whole buffer where the socket allows, so chunks are full-size
+            while filled < chunk_size:
+                count = raw.readinto(view[filled:])
+                if not count:
+                    break
+                filled += count
+            if not filled:
+                break
+            yield view[:filled]
+            if filled < chunk_size:
+                break
+    finally:
+        response.close()
+
+
+def stream_file(file_id, start=None, end=None, chunk_size=DRIVE_STREAM_CHUNK_SIZE):
+    """(metadata, chunk generator) for a file or a byte range of it; see iter_file()"""
+    return get_file_metadata(file_id), iter_file(file_id, start, end, chunk_size)
+
+
+def download_file(file_id, directory=TEMP_DOWNLOAD_DIR):
+    """Save a file under its Drive name in directory and return the path"""
+    metadata = get_file_metadata(file_id)
+    name = os.path.basename(metadata['name'] or f"{file_id}.file")
+    os.makedirs(directory, exist_ok=True)
+    file_path = os.path.join(directory, name)
+    tmp_path = f"{file_path}.{os.getpid()}.tmp"
     try:
-        # First check if the file exists and is downloadable
-        file_metadata = service.files().get(fileId=file_id, fields='id,name,mimeType').execute()
-        print(f"File metadata: {file_metadata}")
-
-        if file_metadata.get('mimeType') == 'application/vnd.google-apps.folder':
-            raise Exception("Cannot download a folder. Please provide a file ID.")
-
-        request = service.files().get_media(fileId=file_id)
-
-        file_path = os.path.join(TEMP_DOWNLOAD_DIR, file_metadata['name'])
-        if not os.path.exists(TEMP_DOWNLOAD_DIR):
-            os.makedirs(TEMP_DOWNLOAD_DIR)
-
-        with open(file_path, 'wb') as fh:
-            downloader = MediaIoBaseDownload(fh, request)
-            done = False
-            while not done:
-                status, done = downloader.next_chunk()
-                if status:
-                    print(f"Download {int(status.progress() * 100)}%")
-
-        return file_path
+        with open(tmp_path, 'wb') as f:
+            for chunk in iter_file(file_id):
+                f.write(chunk)
+        os.replace(tmp_path, file_path)
     except Exception as e:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
         print(f"Error downloading file: {str(e)}")
         raise Exception(f"Error downloading file: {str(e)}")
+    print(f"File downloaded successfully: {file_path}")
+    return file_path
@@ -0,0 +1,176 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+from utils.upstream import get_client
+
+
+class DriveFileNotFound(Exception):
+    """Raised when Google Drive reports that a file_id does not exist"""
+
+
+def get_confirm_token(response):
+    """Extract confirmation token from Google Drive response"""
+    for key, value in response.cookies.items():
+        if key.startswith('download_warning'):
+            return value
+    return None
+
+
+def get_content_type(filename):
+    """Get the content type based on file extension"""
+    extension = os.path.splitext(filename)[1].lower()
+    if extension == '.flac':
+        return 'audio/flac'
+    elif extension == '.mp3':
+        return 'audio/mpeg'
+    elif extension == '.m4a':
+        return 'audio/mp4'
+    elif extension == '.wav':
+        return 'audio/wav'
+    return 'application/octet-stream'
+
+
+def _filename_from_headers(headers, default):
+    content_disposition = headers.get('content-disposition', '')
+    if 'filename=' in content_disposition:
+        return content_disposition.split('filename=')[-1].strip('"')
+    return default
+
+
+class Resolution:
+    """Everything needed to fetch a Drive file with a single upstream request"""
+
+    __slots__ = ('file_id', 'url', 'params', 'cookies', 'filename', 'content_type',
+                 'total_length', 'accepts_ranges')
+
+    def __init__(self, file_id, url, params, cookies, filename, content_type,
+                 total_length, accepts_ranges):
+        self.file_id = file_id
+        self.url = url
+        self.params = params
+        self.cookies = cookies
+        self.filename = filename
+        self.content_type = content_type
+        self.total_length = total_length
+        self.accepts_ranges = accepts_ranges
+
+
+class DriveResolver:
+    """
+    Resolves a file_id to its final download URL, confirm token, filename,
+    content type and total length, and caches the result.
+
+    Resolution costs one upstream round trip (two when Drive interposes its
+    confirmation page) using a bytes=0-0 probe. Successful results are kept
+    for ttl seconds, 404s for negative_ttl seconds, and concurrent resolutions
+    of the same file_id share one probe.
+    """
+
+    def __init__(self, base_url, ttl, negative_ttl, max_entries=4096):
+        self.base_url = base_url
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._key_locks = {}
+
+    def _cached(self, file_id):
+        with self._lock:
+            cached = self._entries.get(file_id)
+            if cached is None:
+                return None
+            expires, value = cached
+            if expires < time.monotonic():
+                del self._entries[file_id]
+                return None
+            self._entries.move_to_end(file_id)
+            return value
+
+    def _store(self, file_id, value, ttl):
+        with self._lock:
+            self._entries[file_id] = (time.monotonic() + ttl, value)
+            self._entries.move_to_end(file_id)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, file_id):
+        with self._lock:
+            self._entries.pop(file_id, None)
+
+    def resolve(self, file_id):
+        """Return the Resolution for file_id, raising DriveFileNotFound for missing files"""
+        value = self._cached(file_id)
+        if value is None:
+            with self._lock:
+                key_lock = self._key_locks.setdefault(file_id, threading.Lock())
+            with key_lock:
+                value = self._cached(file_id)
+                if value is None:
+                    try:
+                        value = self._probe(file_id)
+                        self._store(file_id, value, self.ttl)
+                    except DriveFileNotFound as e:
+                        value = e
+                        self._store(file_id, value, self.negative_ttl)
+            with self._lock:
+                self._key_locks.pop(file_id, None)
+
+        if isinstance(value, DriveFileNotFound):
+            raise value
+        return value
+
+    def _probe(self, file_id):
+        client = get_client()
+        url = f"{self.base_url}{file_id}"
+        params = None
+        probe_headers = {'Range': 'bytes=0-0'}
+
+        response = client.get(url, headers=probe_headers)
+        cookies = response.cookies.get_dict()
+        try:
+            if response.status_code == 404:
+                raise DriveFileNotFound(
+                    "File not found. Ensure the file ID is correct and the file is publicly accessible.")
+
+            # Large files are put behind a confirmation page first
+            token = get_confirm_token(response)
+            if token:
+                response.close()
+                params = {'id': file_id, 'confirm': token}
+                url = self.base_url
+                response = client.get(url, params=params, headers=probe_headers, cookies=cookies)
+                cookies.update(response.cookies.get_dict())
+
+            if response.status_code not in (200, 206):
+                raise Exception(f"Failed to access file (upstream status {response.status_code})")
+
+            filename = _filename_from_headers(response.headers, f"{file_id}.file")
+            if 'content-disposition' in response.headers:
+                content_type = get_content_type(filename)
+            else:
+                content_type = response.headers.get('Content-Type', 'audio/flac')
+
+            accepts_ranges = response.status_code == 206
+            if accepts_ranges:
+                total = response.headers.get('Content-Range', '').split('/')[-1]
+            else:
+                total = response.headers.get('Content-Length')
+            total_length = int(total) if total and total.isdigit() else None
+        finally:
+            response.close()
+
+        return Resolution(file_id, url, params, cookies, filename,
+                          content_type, total_length, accepts_ranges)
+
+    def open(self, resolution, first=None, last=None):
+        """
+        Issue the single upstream GET for a resolved file, optionally limited
+        to bytes first..last (inclusive). Returns a streaming response.
+        """
+        headers = {}
+        if first is not None:
+            headers['Range'] = f"bytes={first}-{'' if last is None else last}"
+        return get_client().get(resolution.url, params=resolution.params,
+                                cookies=resolution.cookies, headers=headers)
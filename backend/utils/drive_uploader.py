@@ -1,128 +1,299 @@
 from google.oauth2.credentials import Credentials
 from google_auth_oauthlib.flow import InstalledAppFlow
+from google_auth_httplib2 import AuthorizedHttp
 from googleapiclient.discovery import build
-from googleapiclient.http import MediaFileUpload
+from googleapiclient.http import BatchHttpRequest, MediaFileUpload
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+import argparse
+import hashlib
+import httplib2
+import json
 import os
 import sys
-import pandas as pd
+import threading
+import time
+from urllib.parse import urlparse
 
 # Add the parent directory to Python path for imports
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
-from config import GOOGLE_DRIVE_CREDENTIALS, TRACKS_CSV_PATH
+from config import (GOOGLE_DRIVE_CREDENTIALS, TRACKS_CSV_PATH, DRIVE_API_ROOT,
+                    UPLOAD_WORKERS, UPLOAD_MANIFEST_PATH)
+from utils.catalog import active_catalog
+from utils.flac_meta import catalog_fields
 
 SCOPES = ['https://www.googleapis.com/auth/drive.file']
 
+DEFAULT_API_ROOT = 'https://www.googleapis.com/'
+UPLOAD_CHUNK_SIZE = 8 * 1024 * 1024
+UPLOAD_RETRIES = 5
+PERMISSION_BATCH_SIZE = 100  # Drive accepts at most 100 calls per batch request
+HASH_CHUNK_SIZE = 1024 * 1024
+
+PUBLIC_READ = {
+    'type': 'anyone',
+    'role': 'reader'
+}
+
+_credentials = None
+_credentials_lock = threading.Lock()
+_local = threading.local()
+
+def get_credentials():
+    """Load (or obtain) OAuth credentials once per process"""
+    global _credentials
+    with _credentials_lock:
+        if _credentials is not None:
+            return _credentials
+        creds = None
+        if os.path.exists('token.json'):
+            creds = Credentials.from_authorized_user_file('token.json', SCOPES)
+        if not creds or not creds.valid:
+            flow = InstalledAppFlow.from_client_secrets_file(
+                GOOGLE_DRIVE_CREDENTIALS,
+                SCOPES,
+                redirect_uri='http://localhost:8080/oauth2callback'
+            )
+            creds = flow.run_local_server(
+                port=8080,
+                prompt='consent',
+                access_type='offline'
+            )
+            with open('token.json', 'w') as token:
+                token.write(creds.to_json())
+        _credentials = creds
+        return creds
+
+def _new_http():
+    if DRIVE_API_ROOT != DEFAULT_API_ROOT:
+        return httplib2.Http()  # Local fake Drive: no credentials needed
+    return AuthorizedHttp(get_credentials(), http=httplib2.Http())
+
 def get_drive_service():
-    creds = None
-    if os.path.exists('token.json'):
-        creds = Credentials.from_authorized_user_file('token.json', SCOPES)
-    if not creds or not creds.valid:
-        flow = InstalledAppFlow.from_client_secrets_file(
-            GOOGLE_DRIVE_CREDENTIALS, 
-            SCOPES,
-            redirect_uri='http://localhost:8080/oauth2callback'
-        )
-        creds = flow.run_local_server(
-            port=8080,
-            prompt='consent',
-            access_type='offline'
-        )
-        with open('token.json', 'w') as token:
-            token.write(creds.to_json())
-    return build('drive', 'v3', credentials=creds)
+    """
+    Drive client for the calling thread. Credentials are shared by the whole
+    process; the HTTP connection is per thread because httplib2 is not thread-safe.
+    """
+    service = getattr(_local, 'service', None)
+    if service is None:
+        options = None
+        if DRIVE_API_ROOT != DEFAULT_API_ROOT:
+            options = {'api_endpoint': f"{DRIVE_API_ROOT}drive/v3/"}
+        service = build('drive', 'v3', http=_new_http(), client_options=options,
+                        cache_discovery=False)
+        _local.service = service
+    return service
 
 def create_music_folder():
     service = get_drive_service()
-    
+
     # Create 'FLAC Music Store' folder
     folder_metadata = {
         'name': 'FLAC Music Store',
         'mimeType': 'application/vnd.google-apps.folder'
     }
-    
+
     folder = service.files().create(body=folder_metadata, fields='id').execute()
-    
+
     # Make folder publicly accessible for viewing
-    permission = {
-        'type': 'anyone',
-        'role': 'reader'
-    }
-    service.permissions().create(fileId=folder['id'], body=permission).execute()
-    
+    service.permissions().create(fileId=folder['id'], body=PUBLIC_READ).execute()
+
     return folder['id']
 
-def upload_music_file(file_path, folder_id):
+def upload_music_file(file_path, folder_id, share=True):
     service = get_drive_service()
-    
+
     file_name = os.path.basename(file_path)
     file_metadata = {
         'name': file_name,
         'parents': [folder_id]
     }
-    
+
     media = MediaFileUpload(
         file_path,
         mimetype='audio/flac',
+        chunksize=UPLOAD_CHUNK_SIZE,
         resumable=True
     )
-    
-    file = service.files().create(
+
+    request = service.files().create(
         body=file_metadata,
         media_body=media,
         fields='id'
-    ).execute()
-    
+    )
+    if DRIVE_API_ROOT != DEFAULT_API_ROOT:
+        # The client only swaps the host of media upload URLs, not the scheme
+        root = urlparse(DRIVE_API_ROOT)
+        request.uri = urlparse(request.uri)._replace(scheme=root.scheme, netloc=root.netloc).geturl()
+    # Send chunk by chunk; a failed chunk is retried with backoff from where
+    # the upload stopped instead of restarting the file
+    file = None
+    while file is None:
+        _, file = request.next_chunk(num_retries=UPLOAD_RETRIES)
+
     # Make file publicly accessible for viewing
-    permission = {
-        'type': 'anyone',
-        'role': 'reader'
-    }
-    service.permissions().create(fileId=file['id'], body=permission).execute()
-    
+    if share:
+        service.permissions().create(fileId=file['id'], body=PUBLIC_READ).execute()
+
     return {
         'title': os.path.splitext(file_name)[0],
         'file_id': file['id']
     }
 
+def grant_public_read(file_ids):
+    """Make files publicly readable using batch requests; returns the ids that succeeded"""
+    service = get_drive_service()
+    granted = []
+    failed = {}
+
+    def on_response(request_id, response, exception):
+        if exception is None:
+            granted.append(request_id)
+        else:
+            failed[request_id] = exception
+
+    for start in range(0, len(file_ids), PERMISSION_BATCH_SIZE):
+        # Built directly so the batch endpoint follows DRIVE_API_ROOT
+        batch = BatchHttpRequest(callback=on_response, batch_uri=f"{DRIVE_API_ROOT}batch/drive/v3")
+        for file_id in file_ids[start:start + PERMISSION_BATCH_SIZE]:
+            batch.add(service.permissions().create(fileId=file_id, body=PUBLIC_READ),
+                      request_id=file_id)
+        batch.execute()
+
+    for file_id, exception in failed.items():
+        print(f"[Upload] Could not share {file_id}: {str(exception)}")
+    return granted
+
+def file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+class UploadManifest:
+    """
+    Append-only JSON-lines record of uploaded files, keyed on content hash.
+
+    Each upload and each permission grant is appended (and fsynced) as soon as
+    it happens, so an interrupted run loses at most the files in flight.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.entries = {}
+        self._lock = threading.Lock()
+        if os.path.exists(path):
+            with open(path) as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        continue  # Torn final line from a crash
+                    self.entries.setdefault(record['sha256'], {}).update(record)
+
+    def get(self, digest):
+        with self._lock:
+            return self.entries.get(digest)
+
+    def record(self, digest, **fields):
+        with self._lock:
+            entry = self.entries.setdefault(digest, {'sha256': digest})
+            entry.update(fields)
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+            with open(self.path, 'a') as f:
+                f.write(json.dumps(dict(fields, sha256=digest)) + '\n')
+                f.flush()
+                os.fsync(f.fileno())
+            return entry
+
+def bulk_upload(music_dir, folder_id, workers=UPLOAD_WORKERS, manifest_path=UPLOAD_MANIFEST_PATH):
+    """
+    Upload every FLAC in music_dir with a pool of workers, skipping files the
+    manifest already has, share the new uploads in batches and add all of
+    them to the catalog in one write. Returns the catalog records.
+    """
+    manifest = UploadManifest(manifest_path)
+    paths = sorted(os.path.join(music_dir, name) for name in os.listdir(music_dir)
+                   if name.lower().endswith('.flac'))
+    started = time.monotonic()
+    counts = {'uploaded': 0, 'skipped': 0, 'failed': 0}
+
+    # Tags and stream details come from the FLAC headers alone (a few KB per
+    # file), parsed across processes while nothing else is running
+    with ProcessPoolExecutor() as pool:
+        fields = dict(zip(paths, pool.map(catalog_fields, paths, chunksize=16)))
+
+    def ingest(path):
+        digest = file_sha256(path)
+        entry = manifest.get(digest)
+        if entry and entry.get('file_id'):
+            return digest, False
+        track = upload_music_file(path, folder_id, share=False)
+        manifest.record(digest, file_id=track['file_id'], name=os.path.basename(path),
+                        title=track['title'], shared=False)
+        return digest, True
+
+    digests = {}
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        futures = {pool.submit(ingest, path): path for path in paths}
+        for future in as_completed(futures):
+            path = futures[future]
+            try:
+                digest, uploaded = future.result()
+            except Exception as e:
+                counts['failed'] += 1
+                print(f"[Upload] Failed {os.path.basename(path)}: {str(e)}")
+                continue
+            digests[path] = digest
+            counts['uploaded' if uploaded else 'skipped'] += 1
+            if uploaded:
+                print(f"[Upload] {os.path.basename(path)} "
+                      f"({counts['uploaded'] + counts['skipped']}/{len(paths)})")
+
+    unshared = {manifest.get(d)['file_id']: d for d in digests.values()
+                if not manifest.get(d).get('shared')}
+    for file_id in grant_public_read(list(unshared)):
+        manifest.record(unshared[file_id], shared=True)
+
+    tracks = []
+    for path in paths:
+        entry = manifest.get(digests[path]) if path in digests else None
+        if entry and entry.get('shared'):
+            tracks.append(dict(fields[path], file_id=entry['file_id']))
+    if tracks:
+        update_csv(tracks)
+
+    print(f"[Upload] {counts['uploaded']} uploaded, {counts['skipped']} already on Drive, "
+          f"{counts['failed']} failed, {len(tracks)} in catalog "
+          f"({time.monotonic() - started:.1f}s)")
+    return tracks
+
 def update_csv(tracks_data):
-    # Ensure the data directory exists
-    os.makedirs(os.path.dirname(TRACKS_CSV_PATH), exist_ok=True)
-    
-    if not os.path.exists(TRACKS_CSV_PATH):
-        df = pd.DataFrame(columns=['title', 'artist', 'album', 'file_id'])
-        df.to_csv(TRACKS_CSV_PATH, index=False)
-    
-    df = pd.read_csv(TRACKS_CSV_PATH)
-    new_df = pd.DataFrame(tracks_data)
-    df = pd.concat([df, new_df], ignore_index=True)
-    df.to_csv(TRACKS_CSV_PATH, index=False)
+    # Upserts by file_id into the configured catalog (tracks.csv or the SQLite
+    # database), so re-uploading a track updates its row instead of duplicating it
+    active_catalog(TRACKS_CSV_PATH).upsert_tracks(tracks_data)
 
 if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Upload a directory of FLAC files to Google Drive')
+    parser.add_argument('music_dir', nargs='?', help='directory containing .flac files')
+    parser.add_argument('--folder-id', default="1kRhz_VMqYj9fn9LwuqWo-uBbAIxYeypW")
+    parser.add_argument('--create-folder', action='store_true', help='create a new public folder first')
+    parser.add_argument('--workers', type=int, default=UPLOAD_WORKERS)
+    parser.add_argument('--manifest', default=UPLOAD_MANIFEST_PATH)
+    args = parser.parse_args()
+
     # Create the music folder
-    folder_id = "1kRhz_VMqYj9fn9LwuqWo-uBbAIxYeypW"
-    # folder_id = create_music_folder()
-    # print(f"Created folder with ID: {folder_id}")
-    
+    folder_id = args.folder_id
+    if args.create_folder:
+        folder_id = create_music_folder()
+        print(f"Created folder with ID: {folder_id}")
+
     # Update this path to your FLAC files directory
-    music_dir = input("Enter the path to your FLAC files directory: ")
-    
-    uploaded_tracks = []
-    for file in os.listdir(music_dir):
-        if file.endswith('.flac'):
-            print(f"Uploading {file}...")
-            file_path = os.path.join(music_dir, file)
-            track_info = upload_music_file(file_path, folder_id)
-            
-            # You can modify this to extract more metadata if needed
-            track_info['artist'] = file
-            track_info['album'] = file
-            
-            uploaded_tracks.append(track_info)
-    
-    # Update the CSV file with new tracks
-    update_csv(uploaded_tracks)
-    print("Upload complete! CSV file has been updated.")
-    
+    music_dir = args.music_dir or input("Enter the path to your FLAC files directory: ")
+
+    bulk_upload(music_dir, folder_id, args.workers, args.manifest)
+    print("Upload complete! The catalog has been updated.")
+
     # Print instructions for updating config.py
     print("\nIMPORTANT: Update your config.py with the following folder ID:")
-    print(f"DRIVE_FOLDER_ID = '{folder_id}'") 
\ No newline at end of file
+    print(f"DRIVE_FOLDER_ID = '{folder_id}'")
@@ -0,0 +1,425 @@
+import hashlib
+import json
+import os
+import threading
+import time
+
+try:
+    import fcntl
+except ImportError:  # Windows: single-flight is per process only
+    fcntl = None
+
+DATA_SUFFIX = '.data'
+META_SUFFIX = '.json'
+LOCK_SUFFIX = '.lock'
+PARTIAL_SUFFIX = '.partial'
+# Next to a partial file filled out of order: how many bytes from its start are complete
+WATERMARK_SUFFIX = '.watermark'
+
+READ_CHUNK_SIZE = 64 * 1024
+# How often a reader in another worker checks a growing partial file
+POLL_INTERVAL = 0.02
+# A partial file that stops growing for this long is checked for a dead writer
+STALL_CHECK_INTERVAL = 1.0
+
+
+class CacheEntry:
+    """A committed cache file plus the metadata recorded when it was fetched"""
+
+    __slots__ = ('key', 'path', 'size', 'filename', 'content_type', 'modified')
+
+    def __init__(self, key, path, size, filename, content_type, modified=None):
+        self.key = key
+        self.path = path
+        self.size = size
+        self.filename = filename
+        self.content_type = content_type
+        self.modified = modified  # When the download was committed (epoch seconds)
+
+
+class _Download:
+    """In-process state of one upstream transfer into a partial file"""
+
+    def __init__(self):
+        self.cond = threading.Condition()
+        self.written = 0
+        self.done = False
+        self.error = None
+
+
+class FileCache:
+    """
+    Size-bounded on-disk cache of upstream files, keyed by file_id.
+
+    A miss starts one upstream transfer on a background thread that writes
+    to a partial file; the client that caused it, and any client asking for
+    the same key meanwhile (in this worker or another one), read the partial
+    file as it grows. The entry is committed by renaming the partial file
+    into place once the transfer completes, so lookups only ever see complete
+    files, and a client hanging up does not abort the transfer. A per-key
+    lock file decides which worker downloads. The mtime of each data file is
+    bumped on every hit and doubles as the LRU clock, which keeps eviction
+    correct across gunicorn workers sharing the directory.
+    """
+
+    def __init__(self, directory, max_bytes):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.attaches = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+        self._downloads = {}
+        os.makedirs(directory, exist_ok=True)
+
+    def _base_path(self, key):
+        # Name files by a digest of the key so arbitrary ids are safe on disk
+        digest = hashlib.sha256(key.encode('utf-8')).hexdigest()
+        return os.path.join(self.directory, digest)
+
+    def get(self, key):
+        """Return the CacheEntry for key, or None on a miss"""
+        base = self._base_path(key)
+        data_path = base + DATA_SUFFIX
+        try:
+            with open(base + META_SUFFIX) as f:
+                meta = json.load(f)
+            size = os.stat(data_path).st_size
+            os.utime(data_path)
+        except (OSError, ValueError):
+            return None
+        with self._lock:
+            self.hits += 1
+        return CacheEntry(key, data_path, size, meta.get('filename'), meta.get('content_type'),
+                          meta.get('modified'))
+
+    def contains(self, key):
+        """Whether key is cached, without counting a hit or marking it recently used"""
+        base = self._base_path(key)
+        return os.path.exists(base + META_SUFFIX) and os.path.exists(base + DATA_SUFFIX)
+
+    def get_or_stream(self, key, open_upstream):
+        """
+        Return (entry, chunks). On a hit chunks is None and entry.path is the
+        complete file. Otherwise chunks yields the file as it is downloaded,
+        and entry.size is None if upstream did not say how long it is.
+
+        open_upstream() is called for a miss no other client is already
+        downloading. It returns (meta, chunks): a dict with 'filename',
+        'content_type' and 'size', and an iterator of the body (with close()).
+        Instead of an iterator, chunks may be an object whose fill(fd,
+        progress) writes the body itself at positional offsets (for a known
+        size), reporting how many leading bytes are complete, such as a
+        SegmentedFetch.
+        """
+        base = self._base_path(key)
+        while True:
+            entry = self.get(key)
+            if entry is not None:
+                return entry, None
+            lock_file = self._try_lock(key, base)
+            if lock_file is not None:
+                try:
+                    return self._start_download(key, base, lock_file, open_upstream)
+                except BaseException:
+                    self._unlock(key, lock_file)
+                    raise
+            attached = self._attach(key, base)
+            if attached is not None:
+                return attached
+            # The downloading worker has not published the partial file yet
+            time.sleep(POLL_INTERVAL)
+
+    def _try_lock(self, key, base):
+        """The key's lock file, locked, if no other thread or worker is downloading key"""
+        with self._lock:
+            if key in self._downloads:
+                return None
+            self._downloads[key] = None  # Reserved until the download starts
+        lock_file = open(base + LOCK_SUFFIX, 'a')
+        if fcntl is not None:
+            try:
+                fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                lock_file.close()
+                with self._lock:
+                    del self._downloads[key]
+                return None
+        return lock_file
+
+    def _unlock(self, key, lock_file):
+        with self._lock:
+            self._downloads.pop(key, None)
+        if fcntl is not None:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+        lock_file.close()
+
+    def _start_download(self, key, base, lock_file, open_upstream):
+        # Another worker may have committed the entry before we took the lock
+        entry = self.get(key)
+        if entry is not None:
+            self._unlock(key, lock_file)
+            return entry, None
+        with self._lock:
+            self.misses += 1
+
+        meta, chunks = open_upstream()
+        meta = {
+            'file_id': key,
+            'filename': meta.get('filename') or f"{key}.file",
+            'content_type': meta.get('content_type') or 'application/octet-stream',
+            'size': meta.get('size'),
+            'positional': hasattr(chunks, 'fill') and meta.get('size') is not None,
+        }
+        download = _Download()
+        with self._lock:
+            self._downloads[key] = download
+        partial_path = base + PARTIAL_SUFFIX
+        tmp_path = f"{base}.{os.getpid()}.{threading.get_ident()}.tmp"
+        data_file = None
+        try:
+            data_file = open(partial_path, 'wb')
+            if meta['positional']:
+                # Readers in other workers follow the watermark, not the file size
+                with open(partial_path + WATERMARK_SUFFIX, 'wb') as f:
+                    f.write(bytes(8))
+            with open(tmp_path, 'w') as f:
+                json.dump(meta, f)
+            # Readers in other workers attach once the partial metadata exists
+            os.replace(tmp_path, partial_path + META_SUFFIX)
+        except BaseException:
+            if data_file is not None:
+                data_file.close()
+            for path in (partial_path, partial_path + WATERMARK_SUFFIX, tmp_path):
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+            chunks.close()
+            raise
+
+        fd = os.open(partial_path, os.O_RDONLY)
+        threading.Thread(target=self._download, name=f"cache-fill-{key}", daemon=True,
+                         args=(key, base, lock_file, download, meta, data_file, chunks)).start()
+        entry = CacheEntry(key, base + DATA_SUFFIX, meta['size'], meta['filename'], meta['content_type'])
+        return entry, self._tailing(key, base, fd, None, meta['size'], download)
+
+    def _download(self, key, base, lock_file, download, meta, data_file, chunks):
+        """Copy upstream into the partial file, then commit it (runs on its own thread)"""
+        partial_path = base + PARTIAL_SUFFIX
+        committed = False
+        try:
+            with data_file:
+                if meta['positional']:
+                    self._fill(data_file.fileno(), partial_path, download, meta['size'], chunks)
+                else:
+                    for chunk in chunks:
+                        if not chunk:
+                            continue
+                        data_file.write(chunk)
+                        data_file.flush()
+                        with download.cond:
+                            download.written += len(chunk)
+                            download.cond.notify_all()
+            if meta['size'] is not None and download.written != meta['size']:
+                raise IOError(f"Upstream ended early for {key} at byte {download.written}")
+
+            with open(partial_path + '.commit', 'w') as f:
+                committed_meta = {k: meta[k] for k in ('file_id', 'filename', 'content_type')}
+                json.dump(dict(committed_meta, modified=time.time()), f)
+            # Metadata first: an entry only counts as present once its data is
+            os.replace(partial_path + '.commit', base + META_SUFFIX)
+            os.replace(partial_path, base + DATA_SUFFIX)
+            committed = True
+        except Exception as e:
+            print(f"[Cache] Download of {key} failed: {str(e)}")
+            download.error = e
+        finally:
+            chunks.close()
+            stale = [partial_path + META_SUFFIX, partial_path + '.commit', partial_path + WATERMARK_SUFFIX]
+            if not committed:
+                stale.append(partial_path)
+            for path in stale:
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+            with download.cond:
+                download.done = True
+                download.cond.notify_all()
+            self._unlock(key, lock_file)
+        if committed:
+            self._evict(keep=base + DATA_SUFFIX)
+
+    def _fill(self, fd, partial_path, download, size, filler):
+        """Let filler write a preallocated partial file, publishing its watermark"""
+        os.ftruncate(fd, size)
+        watermark_fd = os.open(partial_path + WATERMARK_SUFFIX, os.O_WRONLY)
+
+        def progress(written):
+            os.pwrite(watermark_fd, written.to_bytes(8, 'big'), 0)
+            with download.cond:
+                download.written = written
+                download.cond.notify_all()
+
+        try:
+            filler.fill(fd, progress)
+        finally:
+            os.close(watermark_fd)
+
+    def _attach(self, key, base):
+        """(entry, chunks) following a download already in progress, or None"""
+        with self._lock:
+            download = self._downloads.get(key)
+        partial_path = base + PARTIAL_SUFFIX
+        try:
+            with open(partial_path + META_SUFFIX) as f:
+                meta = json.load(f)
+            fd = os.open(partial_path, os.O_RDONLY)
+        except (OSError, ValueError):
+            return None
+        watermark_fd = None
+        if meta.get('positional'):
+            try:
+                watermark_fd = os.open(partial_path + WATERMARK_SUFFIX, os.O_RDONLY)
+            except OSError:
+                os.close(fd)  # Gone already: committed or abandoned, so look again
+                return None
+        with self._lock:
+            self.misses += 1
+            self.attaches += 1
+        entry = CacheEntry(key, base + DATA_SUFFIX, meta.get('size'), meta.get('filename'),
+                           meta.get('content_type'))
+        return entry, self._tailing(key, base, fd, watermark_fd, meta.get('size'), download)
+
+    def _available(self, fd, watermark_fd, download):
+        """How many leading bytes of a partial file are final"""
+        if download is not None:
+            return download.written
+        if watermark_fd is not None:
+            return int.from_bytes(os.pread(watermark_fd, 8, 0), 'big')
+        return os.fstat(fd).st_size
+
+    def _tailing(self, *args):
+        """
+        _tail() advanced to its first yield, so that closing it releases its
+        file descriptors even if it is never read (e.g. an archive whose
+        client hangs up before reaching this track).
+        """
+        tail = self._tail(*args)
+        next(tail)
+        return tail
+
+    def _tail(self, key, base, fd, watermark_fd, size, download):
+        """
+        Yield a growing partial file from fd until it is complete. download is
+        the in-process transfer, or None when another worker is writing, in
+        which case progress is polled on disk: the file size, or the
+        watermark file for a partial file filled out of order.
+        """
+        position = 0
+        stalled_since = None
+        try:
+            yield b''  # Consumed by _tailing()
+            while size is None or position < size:
+                available = self._available(fd, watermark_fd, download)
+                chunk = b''
+                if available > position:
+                    chunk = os.pread(fd, min(READ_CHUNK_SIZE, available - position), position)
+                if chunk:
+                    position += len(chunk)
+                    stalled_since = None
+                    yield chunk
+                    continue
+
+                if download is not None:
+                    with download.cond:
+                        if download.written > position:
+                            continue
+                        if download.done:
+                            if download.error is not None:
+                                raise IOError(f"Download of {key} failed: {str(download.error)}")
+                            break  # Complete; size was unknown
+                        download.cond.wait(STALL_CHECK_INTERVAL)
+                    continue
+
+                if not os.path.exists(base + PARTIAL_SUFFIX + META_SUFFIX):
+                    # The writer finished: complete if the entry was committed
+                    if self._available(fd, watermark_fd, None) > position:
+                        continue
+                    if os.path.exists(base + DATA_SUFFIX) and size is None:
+                        break
+                    raise IOError(f"Download of {key} was abandoned at byte {position}")
+                now = time.monotonic()
+                if stalled_since is None:
+                    stalled_since = now
+                elif now - stalled_since > STALL_CHECK_INTERVAL and self._writer_died(key, base):
+                    # Unless it just committed, the writer exited without cleaning up
+                    if os.path.exists(base + PARTIAL_SUFFIX + META_SUFFIX):
+                        raise IOError(f"Download of {key} was abandoned at byte {position}")
+                    continue
+                time.sleep(POLL_INTERVAL)
+        finally:
+            os.close(fd)
+            if watermark_fd is not None:
+                os.close(watermark_fd)
+
+    def _writer_died(self, key, base):
+        """True if no worker holds the key's lock any more"""
+        if fcntl is None:
+            return False
+        with open(base + LOCK_SUFFIX, 'a') as lock_file:
+            try:
+                fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                return False
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+        return True
+
+    def _evict(self, keep=None):
+        """Remove least recently used entries until the directory fits the budget"""
+        entries = []
+        total = 0
+        for item in os.scandir(self.directory):
+            if not item.name.endswith(DATA_SUFFIX):
+                continue
+            try:
+                st = item.stat()
+            except FileNotFoundError:
+                continue
+            entries.append((st.st_mtime, item.path, st.st_size))
+            total += st.st_size
+
+        entries.sort()
+        for _, path, size in entries:
+            if total <= self.max_bytes:
+                break
+            if path == keep:
+                continue
+            base = path[:-len(DATA_SUFFIX)]
+            for stale in (path, base + META_SUFFIX):
+                try:
+                    os.remove(stale)
+                except FileNotFoundError:
+                    pass
+            total -= size
+            with self._lock:
+                self.evictions += 1
+            print(f"[Cache] Evicted {os.path.basename(path)} ({size} bytes)")
+
+    def stats(self):
+        """
+        Hit/miss/eviction counters for this worker. A lookup that follows a
+        download already in progress is a miss, counted in attaches too.
+        """
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'attaches': self.attaches,
+                'evictions': self.evictions,
+                'hit_ratio': self.hits / lookups if lookups else 0.0,
+                'max_bytes': self.max_bytes,
+            }
@@ -0,0 +1,301 @@
+"""
+Header-only FLAC metadata reader.
+
+Reads the metadata blocks at the start of a FLAC stream (STREAMINFO,
+VORBIS_COMMENT, SEEKTABLE) and seeks past everything else, including embedded
+pictures, so the cost is a few KB of I/O regardless of file size. Audio frames
+are never read.
+"""
+import os
+import struct
+
+STREAMINFO = 0
+PADDING = 1
+APPLICATION = 2
+SEEKTABLE = 3
+VORBIS_COMMENT = 4
+CUESHEET = 5
+PICTURE = 6
+
+# Seek points with this sample number are placeholders
+PLACEHOLDER_SEEKPOINT = 0xFFFFFFFFFFFFFFFF
+
+# Refuse absurd blocks from corrupt files instead of reading megabytes
+MAX_PARSED_BLOCK_SIZE = 1024 * 1024
+
+# Longest possible frame header: sync, 7-byte coded number, 16-bit block
+# size, 16-bit sample rate and CRC-8
+MAX_FRAME_HEADER_SIZE = 16
+
+
+def _crc8_table():
+    table = []
+    for byte in range(256):
+        crc = byte
+        for _ in range(8):
+            crc = ((crc << 1) ^ 0x07) & 0xFF if crc & 0x80 else (crc << 1) & 0xFF
+        table.append(crc)
+    return bytes(table)
+
+
+_CRC8_TABLE = _crc8_table()
+
+
+class FlacError(Exception):
+    """Raised when a file is not a FLAC stream or its metadata is malformed"""
+
+
+class FlacMetadata:
+    """What the catalog and the streaming code need to know about a FLAC file"""
+
+    __slots__ = ('sample_rate', 'channels', 'bits_per_sample', 'total_samples',
+                 'min_block_size', 'max_block_size', 'min_frame_size', 'max_frame_size',
+                 'md5', 'tags', 'seektable', 'audio_offset')
+
+    def __init__(self):
+        self.sample_rate = None
+        self.channels = None
+        self.bits_per_sample = None
+        self.total_samples = None
+        self.min_block_size = None
+        self.max_block_size = None
+        self.min_frame_size = None
+        self.max_frame_size = None
+        self.md5 = None
+        self.tags = {}        # lowercased field name -> list of values
+        self.seektable = []   # (sample_number, byte offset from audio_offset, samples in frame)
+        self.audio_offset = None  # byte offset of the first audio frame
+
+    @property
+    def duration(self):
+        """Length in seconds, or None if the encoder did not record the sample count"""
+        if not self.sample_rate or not self.total_samples:
+            return None
+        return self.total_samples / self.sample_rate
+
+    def tag(self, name, default=None):
+        """All values of a Vorbis comment field joined with ', '"""
+        values = self.tags.get(name.lower())
+        return ', '.join(values) if values else default
+
+    def seek_point(self, sample):
+        """(sample, byte offset from audio_offset) of the last seek point at or before sample"""
+        best = (0, 0)  # The first frame always starts at audio_offset
+        for point_sample, offset, _ in self.seektable:
+            if point_sample > sample:
+                break
+            best = (point_sample, offset)
+        return best
+
+    def stream_header(self, total_samples):
+        """
+        A minimal FLAC header (marker plus STREAMINFO only) describing
+        total_samples samples, for serving a stream that starts mid-file.
+        """
+        packed = (self.sample_rate << 44) | ((self.channels - 1) << 41) | \
+            ((self.bits_per_sample - 1) << 36) | (total_samples & 0xFFFFFFFFF)
+        data = struct.pack('>HH', self.min_block_size, self.max_block_size) + \
+            self.min_frame_size.to_bytes(3, 'big') + self.max_frame_size.to_bytes(3, 'big') + \
+            packed.to_bytes(8, 'big') + bytes(16)  # MD5 unknown for a partial stream
+        return b'fLaC' + bytes([0x80 | STREAMINFO]) + len(data).to_bytes(3, 'big') + data
+
+
+def crc8(data):
+    crc = 0
+    for byte in data:
+        crc = _CRC8_TABLE[crc ^ byte]
+    return crc
+
+
+def _read_exact(f, size):
+    data = f.read(size)
+    if len(data) != size:
+        raise FlacError("Unexpected end of file in metadata")
+    return data
+
+
+def _skip_id3v2(f):
+    """Some taggers prepend an ID3v2 tag; return the 4 bytes after it"""
+    marker = _read_exact(f, 4)
+    if marker[:3] != b'ID3':
+        return marker
+    header = marker + _read_exact(f, 6)
+    size = 0
+    for byte in header[6:10]:  # Syncsafe integer: 7 bits per byte
+        size = (size << 7) | (byte & 0x7F)
+    footer = 10 if header[5] & 0x10 else 0
+    f.seek(size + footer, os.SEEK_CUR)
+    return _read_exact(f, 4)
+
+
+def _parse_streaminfo(meta, data):
+    if len(data) < 34:
+        raise FlacError("STREAMINFO block is too short")
+    meta.min_block_size, meta.max_block_size = struct.unpack('>HH', data[0:4])
+    meta.min_frame_size = int.from_bytes(data[4:7], 'big')
+    meta.max_frame_size = int.from_bytes(data[7:10], 'big')
+    # 20 bits sample rate, 3 bits channels-1, 5 bits bps-1, 36 bits total samples
+    packed = int.from_bytes(data[10:18], 'big')
+    meta.sample_rate = packed >> 44
+    meta.channels = ((packed >> 41) & 0x7) + 1
+    meta.bits_per_sample = ((packed >> 36) & 0x1F) + 1
+    meta.total_samples = packed & 0xFFFFFFFFF
+    meta.md5 = data[18:34].hex()
+
+
+def _parse_seektable(meta, data):
+    for offset in range(0, len(data) - len(data) % 18, 18):
+        sample, byte_offset, frame_samples = struct.unpack_from('>QQH', data, offset)
+        if sample != PLACEHOLDER_SEEKPOINT:
+            meta.seektable.append((sample, byte_offset, frame_samples))
+
+
+def _parse_vorbis_comment(meta, data):
+    # Unlike the rest of FLAC, Vorbis comment lengths are little-endian
+    try:
+        (vendor_length,) = struct.unpack_from('<I', data, 0)
+        position = 4 + vendor_length
+        (count,) = struct.unpack_from('<I', data, position)
+        position += 4
+        for _ in range(count):
+            (length,) = struct.unpack_from('<I', data, position)
+            position += 4
+            comment = data[position:position + length].decode('utf-8', 'replace')
+            position += length
+            name, sep, value = comment.partition('=')
+            if sep and value.strip():
+                meta.tags.setdefault(name.strip().lower(), []).append(value.strip())
+    except struct.error:
+        raise FlacError("Malformed VORBIS_COMMENT block")
+
+
+def read_flac_metadata(source):
+    """
+    Parse the metadata of a FLAC file (path or binary file object positioned
+    at the start of the stream). Raises FlacError for non-FLAC input.
+    """
+    if isinstance(source, (str, bytes, os.PathLike)):
+        with open(source, 'rb') as f:
+            return read_flac_metadata(f)
+
+    f = source
+    if _skip_id3v2(f) != b'fLaC':
+        raise FlacError("Not a FLAC stream")
+
+    meta = FlacMetadata()
+    seen_streaminfo = False
+    while True:
+        header = _read_exact(f, 4)
+        is_last = header[0] & 0x80
+        block_type = header[0] & 0x7F
+        length = int.from_bytes(header[1:4], 'big')
+
+        if block_type in (STREAMINFO, SEEKTABLE, VORBIS_COMMENT):
+            if length > MAX_PARSED_BLOCK_SIZE:
+                raise FlacError(f"Metadata block of {length} bytes is too large")
+            data = _read_exact(f, length)
+            if block_type == STREAMINFO:
+                _parse_streaminfo(meta, data)
+                seen_streaminfo = True
+            elif block_type == SEEKTABLE:
+                _parse_seektable(meta, data)
+            else:
+                _parse_vorbis_comment(meta, data)
+        elif block_type == 127:
+            raise FlacError("Invalid metadata block type")
+        else:
+            f.seek(length, os.SEEK_CUR)  # PICTURE, PADDING, ...: never read
+
+        if is_last:
+            break
+
+    if not seen_streaminfo:
+        raise FlacError("Missing STREAMINFO block")
+    meta.audio_offset = f.tell()
+    return meta
+
+
+def parse_frame_header(data, position, meta):
+    """
+    Validate a frame header at data[position:]. Returns (first sample, block
+    size, header length), or None if the bytes there are not a frame header.
+    Needs MAX_FRAME_HEADER_SIZE bytes unless the header ends the data.
+    """
+    end = len(data)
+    if end - position < 6 or data[position] != 0xFF or data[position + 1] & 0xFE != 0xF8:
+        return None
+    variable_blocking = data[position + 1] & 0x01
+    block_size_code = data[position + 2] >> 4
+    sample_rate_code = data[position + 2] & 0x0F
+    channels = data[position + 3] >> 4
+    sample_size_code = (data[position + 3] >> 1) & 0x07
+    if (block_size_code == 0 or sample_rate_code == 15 or channels > 10
+            or sample_size_code == 3 or data[position + 3] & 0x01):
+        return None
+
+    # Frame (or sample) number, coded like UTF-8 but up to 36 bits
+    cursor = position + 4
+    lead = data[cursor]
+    if lead < 0x80:
+        number, extra = lead, 0
+    elif 0xC0 <= lead < 0xFF:
+        extra = 1
+        while lead & (0x40 >> extra):
+            extra += 1
+        number = lead & (0x3F >> extra)
+    else:
+        return None
+    if cursor + 1 + extra > end:
+        return None
+    for byte in data[cursor + 1:cursor + 1 + extra]:
+        if byte & 0xC0 != 0x80:
+            return None
+        number = (number << 6) | (byte & 0x3F)
+    cursor += 1 + extra
+
+    if block_size_code == 1:
+        block_size = 192
+    elif block_size_code <= 5:
+        block_size = 576 << (block_size_code - 2)
+    elif block_size_code == 6:
+        block_size = data[cursor] + 1 if cursor < end else None
+        cursor += 1
+    elif block_size_code == 7:
+        block_size = int.from_bytes(data[cursor:cursor + 2], 'big') + 1 if cursor + 2 <= end else None
+        cursor += 2
+    else:
+        block_size = 256 << (block_size_code - 8)
+    cursor += {12: 1, 13: 2, 14: 2}.get(sample_rate_code, 0)
+
+    if block_size is None or cursor >= end or crc8(data[position:cursor]) != data[cursor]:
+        return None
+    sample = number if variable_blocking else number * meta.max_block_size
+    if meta.total_samples and sample >= meta.total_samples:
+        return None
+    return sample, block_size, cursor + 1 - position
+
+
+def catalog_fields(path):
+    """
+    Catalog record fields for a FLAC file: title/artist/album from its tags
+    (falling back to the file name) plus the stream's technical values.
+    """
+    stem = os.path.splitext(os.path.basename(path))[0]
+    try:
+        meta = read_flac_metadata(path)
+    except (FlacError, OSError) as e:
+        print(f"[Metadata] Could not read {os.path.basename(path)}: {str(e)}")
+        return {'title': stem, 'artist': stem, 'album': stem}
+
+    duration = meta.duration
+    return {
+        'title': meta.tag('title', stem),
+        'artist': meta.tag('artist', meta.tag('albumartist', stem)),
+        'album': meta.tag('album', stem),
+        'duration': round(duration, 3) if duration is not None else None,
+        'sample_rate': meta.sample_rate,
+        'bit_depth': meta.bits_per_sample,
+        'channels': meta.channels,
+        'total_samples': meta.total_samples,
+        'audio_offset': meta.audio_offset,
+    }
@@ -0,0 +1,207 @@
+"""
+Time-based seeking into FLAC streams.
+
+SeekIndex keeps each track's parsed FLAC header (STREAMINFO and SEEKTABLE),
+read once with a small Range request. A seek to t seconds then starts at the
+last seek point before t, and FrameLocator walks the frame headers in the
+bytes that arrive from there to the frame containing t, so the whole seek is
+a single upstream range fetch that starts on a frame boundary.
+"""
+import os
+import threading
+from collections import OrderedDict
+from utils.flac_meta import (FlacError, MAX_FRAME_HEADER_SIZE, parse_frame_header,
+                             read_flac_metadata)
+
+
+class _RangeReader:
+    """
+    Read-only file object over a remote file. Reads are served from the last
+    fetched window; a read outside it fetches probe_bytes from that position,
+    and seeks (e.g. past embedded pictures) fetch nothing.
+    """
+
+    def __init__(self, fetch_range, total_length, probe_bytes):
+        self.fetch_range = fetch_range
+        self.total_length = total_length
+        self.probe_bytes = probe_bytes
+        self.position = 0
+        self.window_start = 0
+        self.window = b''
+        self.fetches = 0
+
+    def read(self, size):
+        start = self.position - self.window_start
+        if start < 0 or start + size > len(self.window):
+            last = min(self.position + max(size, self.probe_bytes), self.total_length) - 1
+            if last < self.position:
+                return b''
+            self.window = self.fetch_range(self.position, last)
+            self.window_start = self.position
+            self.fetches += 1
+            start = 0
+        data = self.window[start:start + size]
+        self.position += len(data)
+        return data
+
+    def seek(self, offset, whence=os.SEEK_SET):
+        self.position = offset if whence == os.SEEK_SET else self.position + offset
+        return self.position
+
+    def tell(self):
+        return self.position
+
+
+class SeekIndex:
+    """
+    Per-worker LRU of FLAC headers keyed on (file_id, total_length), so a
+    re-uploaded file with a new size is parsed again. Files that are not
+    FLAC are remembered as None and streamed without time seeking.
+    """
+
+    def __init__(self, probe_bytes, max_entries=4096):
+        self.probe_bytes = probe_bytes
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self.header_fetches = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._key_locks = {}
+
+    def _cached(self, key):
+        with self._lock:
+            if key not in self._entries:
+                return False, None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return True, self._entries[key]
+
+    def get(self, file_id, total_length, fetch_range):
+        """
+        FlacMetadata for a track, or None if it is not FLAC. fetch_range(first,
+        last) must return the bytes first..last; it is only called on a miss.
+        """
+        key = (file_id, total_length)
+        found, meta = self._cached(key)
+        if found:
+            return meta
+
+        with self._lock:
+            key_lock = self._key_locks.setdefault(key, threading.Lock())
+        with key_lock:
+            found, meta = self._cached(key)
+            if not found:
+                reader = _RangeReader(fetch_range, total_length, self.probe_bytes)
+                try:
+                    meta = read_flac_metadata(reader)
+                except FlacError as e:
+                    print(f"[Seek] {file_id} has no usable FLAC header: {str(e)}")
+                    meta = None
+                with self._lock:
+                    self.misses += 1
+                    self.header_fetches += reader.fetches
+                    self._entries[key] = meta
+                    while len(self._entries) > self.max_entries:
+                        self._entries.popitem(last=False)
+        with self._lock:
+            self._key_locks.pop(key, None)
+        return meta
+
+    def stats(self):
+        with self._lock:
+            return {
+                'entries': len(self._entries),
+                'hits': self.hits,
+                'misses': self.misses,
+                'header_fetches': self.header_fetches,
+            }
+
+
+def seek_target(meta, seconds, total_length):
+    """
+    Where a seek to `seconds` starts: (byte offset of a frame at or before
+    the target, target sample). None when the time is outside the track or
+    the track cannot be seeked by time.
+    """
+    if meta is None or not meta.sample_rate or not meta.max_block_size:
+        return None
+    target = int(seconds * meta.sample_rate)
+    if target <= 0 or not meta.total_samples or target >= meta.total_samples:
+        return None
+
+    _, offset = meta.seek_point(target)
+    if not meta.seektable:
+        # No seek table: estimate from the average bitrate, starting a
+        # second early so bitrate variation rarely puts us past the target.
+        # FrameLocator finds the first real frame from there.
+        audio_bytes = total_length - meta.audio_offset
+        offset = max(0, audio_bytes * (target - meta.sample_rate) // meta.total_samples)
+    return meta.audio_offset + offset, target
+
+
+class FrameLocator:
+    """
+    Fed the bytes of a track starting at a known offset, finds the frame
+    containing the target sample. Once a first frame is found, each next
+    frame must start exactly where the previous one ends (in samples), which
+    rules out sync codes that happen to appear inside audio data.
+    """
+
+    def __init__(self, meta, target, offset, scan_limit):
+        self.meta = meta
+        self.target = target
+        self.scan_limit = scan_limit
+        self.buffer = bytearray()
+        self.buffer_offset = offset  # File offset of buffer[0]
+        self.start_offset = offset
+        self.position = 0            # Next buffer index to examine
+        self.expected = None         # First sample of the next frame, once one is found
+        self.frame = None            # (file offset, first sample) of the best frame so far
+        self.done = False
+
+    def feed(self, chunk):
+        """Add the next bytes; returns True once the frame is known"""
+        self.buffer += chunk
+        buffer = self.buffer
+        while not self.done:
+            index = buffer.find(b'\xff', self.position)
+            if index < 0 or len(buffer) - index < MAX_FRAME_HEADER_SIZE:
+                self.position = len(buffer) if index < 0 else index
+                break
+            header = parse_frame_header(buffer, index, self.meta)
+            if header is None or (self.expected is not None and header[0] != self.expected):
+                self.position = index + 1
+                continue
+
+            sample, block_size, header_size = header
+            if self.frame is not None and sample > self.target:
+                self.done = True  # The previous frame holds the target
+                break
+            # Nothing before this frame is needed any more
+            del buffer[:index]
+            self.buffer_offset += index
+            self.frame = (self.buffer_offset, sample)
+            self.expected = sample + block_size
+            self.position = header_size
+            self.done = sample + block_size > self.target
+
+        if self.frame is None:
+            # Keep only a possible partial header while searching for the first frame
+            drop = max(0, self.position - 1)
+            del buffer[:drop]
+            self.buffer_offset += drop
+            self.position -= drop
+        if not self.done and self.buffer_offset + len(buffer) - self.start_offset > self.scan_limit:
+            self.done = True
+        return self.done
+
+    def result(self):
+        """
+        (file offset, first sample, bytes from that offset already received)
+        of the frame to start from; raises FlacError if none was found.
+        """
+        if self.frame is None:
+            raise FlacError(f"No FLAC frame found after byte {self.start_offset}")
+        offset, sample = self.frame
+        return offset, sample, bytes(self.buffer[offset - self.buffer_offset:])
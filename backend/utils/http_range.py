@@ -0,0 +1,98 @@
+from utils import metrics
+
+# Headers we could not use; the response is then the whole file
+IGNORED = metrics.Counter('http_range_ignored_total', 'Range headers answered with the whole file')
+
+
+class RangeNotSatisfiable(Exception):
+    """The requested range starts beyond the end of the file (HTTP 416)"""
+
+
+def parse_range(range_header, content_length):
+    """
+    Parse a single 'bytes=start-end' Range header, or a suffix range
+    ('bytes=-500', the last 500 bytes), against content_length.
+
+    Returns an inclusive (start, end) tuple, or None when there is no header
+    or it cannot be used, e.g. an end before its start (the caller then
+    serves the full file). Raises RangeNotSatisfiable when the range does
+    not overlap the file.
+    """
+    if not range_header:
+        return None
+    unit, _, spec = range_header.strip().partition('=')
+    first, sep, last = spec.strip().partition('-')
+    try:
+        if unit.strip() != 'bytes' or not sep:
+            raise ValueError(f"not a byte range: {range_header!r}")
+        if first.strip():
+            start = int(first)
+            end = int(last) if last.strip() else max(start, content_length - 1)
+            if end < start:
+                raise ValueError(f"end before start: {range_header!r}")
+        else:
+            suffix = int(last)
+            if suffix <= 0:
+                raise RangeNotSatisfiable(f"{range_header} of {content_length}")
+            start, end = max(0, content_length - suffix), content_length - 1
+    except ValueError:
+        IGNORED.inc()
+        return None
+
+    if start >= content_length:
+        raise RangeNotSatisfiable(f"bytes {start}- of {content_length}")
+
+    # Adjust end if it exceeds content_length
+    return start, min(end, content_length - 1)
+
+
+# More ranges than this in one request are answered with the whole file
+MAX_RANGES = 32
+
+
+def parse_ranges(range_header, content_length):
+    """
+    Parse a 'bytes=' Range header that may list several ranges, including
+    suffix ranges ('-500'), against content_length.
+
+    Returns a sorted list of inclusive (start, end) tuples with overlapping or
+    adjacent ranges merged, or None when there is no usable header (the
+    caller then serves the full file). Raises RangeNotSatisfiable when no
+    listed range overlaps the file.
+    """
+    if not range_header or not range_header.strip().startswith('bytes='):
+        return None
+    ranges = []
+    for spec in range_header.strip()[len('bytes='):].split(','):
+        spec = spec.strip()
+        if not spec:
+            continue
+        first, sep, last = spec.partition('-')
+        if not sep:
+            return None
+        try:
+            if first.strip():
+                start = int(first)
+                end = int(last) if last.strip() else max(start, content_length - 1)
+                if end < start:
+                    return None
+            else:
+                suffix = int(last)
+                if suffix <= 0:
+                    continue
+                start, end = max(0, content_length - suffix), content_length - 1
+        except ValueError:
+            return None
+        if start < content_length:
+            ranges.append((start, min(end, content_length - 1)))
+
+    if not ranges:
+        raise RangeNotSatisfiable(f"{range_header} of {content_length}")
+    ranges.sort()
+    merged = [ranges[0]]
+    for start, end in ranges[1:]:
+        if start <= merged[-1][1] + 1:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], end))
+        else:
+            merged.append((start, end))
+    return merged if len(merged) <= MAX_RANGES else None
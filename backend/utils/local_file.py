@@ -0,0 +1,155 @@
+"""
+HTTP responses for files on local disk, shared by /api/download and /stream.
+
+plan_file_response() works out the status, headers and byte ranges of a GET
+(validators, conditional requests, single and multi-range); the servers
+then send the bytes without reading them into Python where they can:
+os.sendfile through wsgi.file_wrapper under gunicorn, the ASGI zero-copy
+extension where the server offers it, and mmap slices otherwise.
+"""
+import mmap
+import uuid
+from email.utils import formatdate, parsedate_to_datetime
+from utils.http_range import parse_ranges, RangeNotSatisfiable
+
+# Size of the slices taken from an mmap when zero-copy is not available
+MMAP_CHUNK_SIZE = 1024 * 1024
+
+
+def file_validators(st, modified=None):
+    """
+    (strong ETag, Last-Modified) of a file. The file cache bumps mtime on
+    every hit to track recency, so the ETag comes from the inode and size
+    and Last-Modified from the time the file was written, when known.
+    """
+    modified = modified or st.st_mtime
+    etag = f'"{st.st_ino:x}-{st.st_size:x}-{int(modified):x}"'
+    return etag, formatdate(modified, usegmt=True)
+
+
+def _not_modified(headers, etag, last_modified):
+    if_none_match = headers.get('If-None-Match')
+    if if_none_match:
+        tags = [tag.strip() for tag in if_none_match.split(',')]
+        return '*' in tags or etag in tags or f'W/{etag}' in tags
+    if_modified_since = headers.get('If-Modified-Since')
+    if if_modified_since:
+        try:
+            return parsedate_to_datetime(last_modified) <= parsedate_to_datetime(if_modified_since)
+        except (TypeError, ValueError):
+            return False
+    return False
+
+
+def _range_applies(headers, etag, last_modified):
+    """If-Range: only honor Range when the client's copy is this exact file"""
+    if_range = headers.get('If-Range')
+    if not if_range:
+        return True
+    if_range = if_range.strip()
+    if if_range.startswith('"') or if_range.startswith('W/'):
+        return if_range == etag  # Strong comparison; weak tags never match
+    return if_range == last_modified
+
+
+class FilePlan:
+    """Status, response headers and body ranges of a GET for a local file"""
+
+    __slots__ = ('status', 'headers', 'ranges', 'boundary', 'parts')
+
+    def __init__(self, status, headers, ranges=(), boundary=None, parts=()):
+        self.status = status
+        self.headers = headers
+        self.ranges = ranges      # (start, end) inclusive byte ranges to send
+        self.boundary = boundary  # multipart/byteranges boundary, if several ranges
+        self.parts = parts        # (part header bytes, start, end) for multipart bodies
+
+    @property
+    def multipart(self):
+        return self.boundary is not None
+
+    def closing(self):
+        return f"\r\n--{self.boundary}--\r\n".encode('ascii')
+
+
+def plan_file_response(request_headers, size, content_type, etag, last_modified, extra_headers=None):
+    """
+    Evaluate a GET against a file of size bytes. request_headers only needs
+    .get(name); returns a FilePlan with status 200, 206, 304 or 416.
+    """
+    headers = {'ETag': etag, 'Last-Modified': last_modified, 'Accept-Ranges': 'bytes'}
+    headers.update(extra_headers or {})
+
+    if _not_modified(request_headers, etag, last_modified):
+        return FilePlan(304, headers)
+
+    ranges = None
+    if _range_applies(request_headers, etag, last_modified):
+        try:
+            ranges = parse_ranges(request_headers.get('Range'), size)
+        except RangeNotSatisfiable:
+            headers['Content-Range'] = f'bytes */{size}'
+            headers['Content-Length'] = '0'
+            return FilePlan(416, headers)
+
+    if not ranges:
+        headers['Content-Type'] = content_type
+        headers['Content-Length'] = str(size)
+        return FilePlan(200, headers, [(0, size - 1)] if size else [])
+
+    if len(ranges) == 1:
+        start, end = ranges[0]
+        headers['Content-Type'] = content_type
+        headers['Content-Range'] = f'bytes {start}-{end}/{size}'
+        headers['Content-Length'] = str(end - start + 1)
+        return FilePlan(206, headers, ranges)
+
+    boundary = uuid.uuid4().hex
+    parts = []
+    length = 0
+    for start, end in ranges:
+        part_header = (f"\r\n--{boundary}\r\nContent-Type: {content_type}\r\n"
+                       f"Content-Range: bytes {start}-{end}/{size}\r\n\r\n").encode('latin-1')
+        parts.append((part_header, start, end))
+        length += len(part_header) + end - start + 1
+    plan = FilePlan(206, headers, ranges, boundary, parts)
+    headers['Content-Type'] = f'multipart/byteranges; boundary={boundary}'
+    headers['Content-Length'] = str(length + len(plan.closing()))
+    return plan
+
+
+def mmap_body(f, plan):
+    """
+    Body of a plan as slices of a read-only mapping of the open file f
+    (closed when done): the kernel pages the file in, with no read() calls
+    or file object buffering in between.
+    """
+    try:
+        if not plan.ranges:
+            return
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            if plan.multipart:
+                parts = plan.parts
+            else:
+                parts = [(b'', start, end) for start, end in plan.ranges]
+            for part_header, start, end in parts:
+                if part_header:
+                    yield part_header
+                for offset in range(start, end + 1, MMAP_CHUNK_SIZE):
+                    yield mapped[offset:min(offset + MMAP_CHUNK_SIZE, end + 1)]
+            if plan.multipart:
+                yield plan.closing()
+    finally:
+        f.close()
+
+
+def seek_to_body(f, plan):
+    """
+    Position f at the start of a single-range or whole-file plan, so a
+    sendfile-based sender can take the byte count from Content-Length.
+    Returns False for multipart plans, which need mmap_body().
+    """
+    if plan.multipart:
+        return False
+    f.seek(plan.ranges[0][0] if plan.ranges else 0)
+    return True
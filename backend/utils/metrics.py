@@ -0,0 +1,434 @@
+"""
+Process metrics with a Prometheus text endpoint that covers every worker.
+
+Counters, gauges and histograms live in plain dicts in each process;
+recording a value is a lock and a few additions. In a server process,
+start() (called from gunicorn's post_fork) runs a thread that writes the
+process's values to METRICS_DIR/<pid>.json every METRICS_FLUSH_INTERVAL
+seconds; scripts that merely import the app write nothing. render() merges
+its own values with every worker's file: counters and histograms from all
+of them, gauges only from workers that are still alive. Files of workers
+that have exited are folded into one retired.json, so a recycled worker
+keeps its totals without leaving a file behind.
+"""
+import atexit
+import bisect
+import fcntl
+import json
+import os
+import threading
+import time
+from config import METRICS_DIR, METRICS_FLUSH_INTERVAL
+
+# Seconds: request latency, time to first byte, search phases
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+# Bytes per second of upstream transfers
+THROUGHPUT_BUCKETS = (1e5, 2.5e5, 5e5, 1e6, 2.5e6, 5e6, 1e7, 2.5e7, 5e7, 1e8)
+
+RETIRED_FILE = 'retired.json'  # Counters and histograms of workers that have exited
+RETIRE_LOCK_FILE = 'retire.lock'
+
+_metrics = []
+_ratios = []
+_lock = threading.Lock()
+_started_pid = None
+
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name, help_text, labels=()):
+        self.name = name
+        self.help = help_text
+        self.labels = tuple(labels)
+        self.values = {}  # label values tuple -> value
+        self.lock = threading.Lock()
+        with _lock:
+            _metrics.append(self)
+
+    def reset(self):
+        with self.lock:
+            self.values = {}
+
+    def dump(self):
+        with self.lock:
+            return [[list(labels), value] for labels, value in self.values.items()]
+
+
+class Counter(_Metric):
+    kind = 'counter'
+
+    def inc(self, *labels, amount=1):
+        with self.lock:
+            self.values[labels] = self.values.get(labels, 0) + amount
+
+
+class Gauge(_Metric):
+    """Summed across live workers"""
+    kind = 'gauge'
+
+    def inc(self, *labels, amount=1):
+        with self.lock:
+            self.values[labels] = self.values.get(labels, 0) + amount
+
+    def dec(self, *labels, amount=1):
+        self.inc(*labels, amount=-amount)
+
+
+class Histogram(_Metric):
+    kind = 'histogram'
+
+    def __init__(self, name, help_text, labels=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, help_text, labels)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, *labels):
+        index = bisect.bisect_left(self.buckets, value)
+        with self.lock:
+            state = self.values.get(labels)
+            if state is None:
+                # Per-bucket (not cumulative) counts, one extra for +Inf, then sum
+                state = self.values[labels] = [0] * (len(self.buckets) + 1) + [0.0]
+            state[index] += 1
+            state[-1] += value
+
+    def dump(self):
+        with self.lock:
+            return [[list(labels), list(state)] for labels, state in self.values.items()]
+
+
+class Collected(_Metric):
+    """A counter or gauge read from elsewhere (e.g. a cache's stats()) when values are written"""
+
+    def __init__(self, name, help_text, labels, kind, collect):
+        super().__init__(name, help_text, labels)
+        self.kind = kind
+        self.collect = collect
+
+    def dump(self):
+        try:
+            return [[list(labels), value] for labels, value in self.collect().items()]
+        except Exception as e:
+            print(f"[Metrics] Collecting {self.name} failed: {str(e)}")
+            return []
+
+
+class Ratio:
+    """hits / (hits + misses) per label set, computed by render() from the merged counters"""
+
+    def __init__(self, name, help_text, hits, misses):
+        self.name = name
+        self.help = help_text
+        self.hits = hits
+        self.misses = misses
+        with _lock:
+            _ratios.append(self)
+
+    def derive(self, merged):
+        if self.hits not in merged:
+            return None
+        _, _, labels, _, hits = merged[self.hits]
+        misses = merged[self.misses][4] if self.misses in merged else {}
+        values = {}
+        for key, count in hits.items():
+            lookups = count + misses.get(key, 0)
+            values[key] = count / lookups if lookups else 0.0
+        return 'gauge', self.help, labels, None, values
+
+
+def _snapshot():
+    with _lock:
+        metrics = list(_metrics)
+    entry = {}
+    for metric in metrics:
+        entry[metric.name] = {'type': metric.kind, 'help': metric.help, 'labels': list(metric.labels),
+                              'values': metric.dump()}
+        if metric.kind == 'histogram':
+            entry[metric.name]['buckets'] = list(metric.buckets)
+    return {'pid': os.getpid(), 'metrics': entry}
+
+
+def flush():
+    """Write this process's values where render() in any worker can read them"""
+    path = os.path.join(METRICS_DIR, f"{os.getpid()}.json")
+    tmp_path = f"{path}.tmp"
+    try:
+        with open(tmp_path, 'w') as f:
+            json.dump(_snapshot(), f)
+        os.replace(tmp_path, path)
+    except OSError as e:
+        print(f"[Metrics] Could not write {path}: {str(e)}")
+
+
+def clear():
+    """Forget every worker's values; the gunicorn master calls this on start"""
+    os.makedirs(METRICS_DIR, exist_ok=True)
+    for name in os.listdir(METRICS_DIR):
+        if name.endswith('.json') or name.endswith('.tmp'):
+            try:
+                os.remove(os.path.join(METRICS_DIR, name))
+            except FileNotFoundError:
+                pass
+
+
+def _alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def _worker_pid(name):
+    """pid of a worker's values file name, or None for other files"""
+    stem, _, suffix = name.partition('.')
+    return int(stem) if suffix == 'json' and stem.isdigit() else None
+
+
+def _read(name):
+    try:
+        with open(os.path.join(METRICS_DIR, name)) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def _add(merged, data, gauges):
+    """Add one values file to merged, {name: (type, help, labels, buckets, {label values: value})}"""
+    for metric_name, metric in data['metrics'].items():
+        if metric['type'] == 'gauge' and not gauges:
+            continue
+        kind, _, _, buckets, values = merged.setdefault(
+            metric_name, (metric['type'], metric['help'], metric['labels'], metric.get('buckets'), {}))
+        for labels, value in metric['values']:
+            labels = tuple(labels)
+            if kind == 'histogram':
+                state = values.setdefault(labels, [0] * len(value))
+                for i, count in enumerate(value):
+                    state[i] += count
+            else:
+                values[labels] = values.get(labels, 0) + value
+
+
+def _retire():
+    """Fold the files of workers that have exited into RETIRED_FILE"""
+    try:
+        names = os.listdir(METRICS_DIR)
+    except FileNotFoundError:
+        return
+    if not any(_worker_pid(name) is not None and not _alive(_worker_pid(name)) for name in names):
+        return
+    with open(os.path.join(METRICS_DIR, RETIRE_LOCK_FILE), 'a') as lock:
+        # One worker folds at a time, or a file could be counted twice
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        merged = {}
+        retired = _read(RETIRED_FILE)
+        if retired is not None:
+            _add(merged, retired, gauges=False)
+        folded = []
+        for name in os.listdir(METRICS_DIR):
+            pid = _worker_pid(name)
+            if pid is None or _alive(pid):
+                continue
+            data = _read(name)
+            if data is not None:
+                _add(merged, data, gauges=False)
+            folded.append(name)
+        if not folded:
+            return
+        entry = {}
+        for name, (kind, help_text, labels, buckets, values) in merged.items():
+            entry[name] = {'type': kind, 'help': help_text, 'labels': labels,
+                           'values': [[list(key), value] for key, value in values.items()]}
+            if buckets is not None:
+                entry[name]['buckets'] = buckets
+        path = os.path.join(METRICS_DIR, RETIRED_FILE)
+        with open(f"{path}.tmp", 'w') as f:
+            json.dump({'pid': None, 'metrics': entry}, f)
+        os.replace(f"{path}.tmp", path)
+        for name in folded:
+            try:
+                os.remove(os.path.join(METRICS_DIR, name))
+            except FileNotFoundError:
+                pass
+
+
+def _merge():
+    """This process's values plus every other worker's file, in _add()'s form"""
+    merged = {}
+    own = f"{os.getpid()}.json"
+    try:
+        names = os.listdir(METRICS_DIR)
+    except FileNotFoundError:
+        names = []
+    for name in names:
+        if not name.endswith('.json') or name == own:
+            continue
+        data = _read(name)
+        if data is None:
+            continue
+        _add(merged, data, gauges=data['pid'] is not None and _alive(data['pid']))
+    _add(merged, _snapshot(), gauges=True)
+    return merged
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _label_text(names, values, extra=()):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    pairs.extend(f'{name}="{value}"' for name, value in extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def _number(value):
+    if isinstance(value, float) and value.is_integer() and abs(value) < 1e15:
+        return str(int(value))
+    return repr(value)
+
+
+def render():
+    """Prometheus text exposition of every worker's metrics"""
+    try:
+        _retire()
+    except OSError as e:
+        print(f"[Metrics] Could not fold exited workers' values: {str(e)}")
+    merged = _merge()
+    for ratio in _ratios:
+        derived = ratio.derive(merged)
+        if derived is not None:
+            merged[ratio.name] = derived
+    lines = []
+    for name, (kind, help_text, label_names, buckets, values) in sorted(merged.items()):
+        lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} {kind}")
+        for labels, value in sorted(values.items()):
+            if kind != 'histogram':
+                lines.append(f"{name}{_label_text(label_names, labels)} {_number(value)}")
+                continue
+            cumulative = 0
+            for bound, count in zip(list(buckets) + ['+Inf'], value[:-1]):
+                cumulative += count
+                le = bound if bound == '+Inf' else _number(float(bound))
+                lines.append(f"{name}_bucket{_label_text(label_names, labels, [('le', le)])} {cumulative}")
+            lines.append(f"{name}_sum{_label_text(label_names, labels)} {_number(value[-1])}")
+            lines.append(f"{name}_count{_label_text(label_names, labels)} {cumulative}")
+    return '\n'.join(lines) + '\n'
+
+
+def _flush_loop():
+    while True:
+        time.sleep(METRICS_FLUSH_INTERVAL)
+        flush()
+
+
+def start():
+    """Share this process's values with render() in other workers (once per process)"""
+    global _started_pid
+    with _lock:
+        if _started_pid == os.getpid():
+            return
+        _started_pid = os.getpid()
+    os.makedirs(METRICS_DIR, exist_ok=True)
+    threading.Thread(target=_flush_loop, name='metrics-flush', daemon=True).start()
+    atexit.register(flush)
+
+
+def _after_fork():
+    # A forked worker starts from zero, or the parent's counts would be counted twice
+    for metric in _metrics:
+        metric.reset()
+
+
+os.register_at_fork(after_in_child=_after_fork)
+
+
+class MetricsMiddleware:
+    """
+    WSGI middleware recording, per route: latency to the response headers,
+    response bytes sent, and responses whose body is still being sent. The
+    route is the Flask URL rule, left in environ['metrics.route'].
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    def __call__(self, environ, start_response):
+        started = time.perf_counter()
+        response = {}
+
+        def recording_start_response(status, headers, exc_info=None):
+            response['status'] = status.split(' ', 1)[0]
+            for name, value in headers:
+                if name.lower() == 'content-length':
+                    response['length'] = int(value)
+            return start_response(status, headers, exc_info)
+
+        body = self.app(environ, recording_start_response)
+        route = environ.get('metrics.route', 'unmatched')
+        REQUEST_LATENCY.observe(time.perf_counter() - started, route, environ['REQUEST_METHOD'],
+                                response.get('status', '500'))
+        ACTIVE_RESPONSES.inc(route)
+
+        file_wrapper = environ.get('wsgi.file_wrapper')
+        if file_wrapper is not None and isinstance(body, file_wrapper):
+            # Sent with sendfile: wrapping the body would turn that off, so
+            # count the declared length and only hook close()
+            original_close = getattr(body, 'close', None)
+
+            def close():
+                try:
+                    if original_close is not None:
+                        original_close()
+                finally:
+                    RESPONSE_BYTES.inc(route, amount=response.get('length', 0))
+                    ACTIVE_RESPONSES.dec(route)
+            body.close = close
+            return body
+        return _CountedBody(body, route)
+
+
+class _CountedBody:
+    __slots__ = ('body', 'route', 'sent', 'closed')
+
+    def __init__(self, body, route):
+        self.body = body
+        self.route = route
+        self.sent = 0
+        self.closed = False
+
+    def __iter__(self):
+        for chunk in self.body:
+            self.sent += len(chunk)
+            yield chunk
+
+    def close(self):
+        if self.closed:
+            return
+        self.closed = True
+        try:
+            close = getattr(self.body, 'close', None)
+            if close is not None:
+                close()
+        finally:
+            RESPONSE_BYTES.inc(self.route, amount=self.sent)
+            ACTIVE_RESPONSES.dec(self.route)
+
+
+REQUEST_LATENCY = Histogram('http_request_duration_seconds',
+                            'Time from request to response headers, by route',
+                            ('route', 'method', 'status'))
+RESPONSE_BYTES = Counter('http_response_bytes_total', 'Response body bytes sent, by route', ('route',))
+ACTIVE_RESPONSES = Gauge('http_responses_active',
+                         'Responses whose body is still being sent (active streams and downloads)',
+                         ('route',))
+UPSTREAM_TTFB = Histogram('upstream_ttfb_seconds', 'Time from a Drive request to its response headers')
+UPSTREAM_THROUGHPUT = Histogram('upstream_throughput_bytes_per_second',
+                                'Rate of Drive transfers while reading (time spent waiting on the '
+                                'reader excluded)', buckets=THROUGHPUT_BUCKETS)
+UPSTREAM_BYTES = Counter('upstream_bytes_total', 'Bytes read from Drive')
+SEARCH_PHASE = Histogram('search_phase_seconds', 'Time spent in each phase of /api/search',
+                         ('phase',))
@@ -0,0 +1,260 @@
+"""
+Background prefetch of stream heads, so playback of a likely track starts
+from local disk instead of after several round trips to Drive.
+
+Candidates are the top results of each search and, every
+PREFETCH_POPULAR_INTERVAL seconds, the tracks this worker has seen played
+most. A bounded queue feeds a few worker threads, which call
+warm(file_id, admit) (supplied by the app: resolve the track and read its
+first seconds through the range cache, admitting each upstream read).
+Prefetching yields to live traffic: a job only runs if an upstream slot is
+free at once, its reads are paced as they come in to PREFETCH_RATE and to
+the bandwidth live traffic leaves spare (a spare admission ticket), and it
+stops while more than PREFETCH_MAX_BYTES of warmed heads are still waiting
+to be played.
+
+Each warmed head leaves a marker file in PREFETCH_DIR, so a play in any
+worker claims it: the worker that plays it counts it as used, the one that
+warmed it as expired if nobody played it within PREFETCH_TTL. The hit
+ratio in stats() is this worker's share; /metrics sums every worker's.
+"""
+import os
+import queue
+import threading
+import time
+from config import (PREFETCH_WORKERS, PREFETCH_QUEUE_SIZE, PREFETCH_RATE, PREFETCH_MAX_BYTES,
+                    PREFETCH_TTL, PREFETCH_POPULAR_COUNT, PREFETCH_POPULAR_INTERVAL, PREFETCH_DIR)
+from utils.admission import BULK, Overloaded
+
+POPULAR_MAX_TRACKS = 1000  # Play counts are halved (and the rarest dropped) beyond this many tracks
+
+
+def is_playback_start(range_header):
+    """Whether a /stream request starts at the first byte, as playback does"""
+    return not range_header or range_header.replace(' ', '').startswith('bytes=0-')
+
+
+class Prefetcher:
+    def __init__(self, warm, admission, workers=PREFETCH_WORKERS, queue_size=PREFETCH_QUEUE_SIZE,
+                 rate=PREFETCH_RATE, max_bytes=PREFETCH_MAX_BYTES, ttl=PREFETCH_TTL,
+                 popular_count=PREFETCH_POPULAR_COUNT, popular_interval=PREFETCH_POPULAR_INTERVAL,
+                 directory=PREFETCH_DIR):
+        """
+        warm(file_id, admit) fetches a track's head and returns the bytes it
+        read from Drive (0 if it was cached already), or None to skip the
+        track. It calls admit() before each upstream read for the ticket that
+        paces it (and must be released when the read ends); admit() raises
+        Overloaded when no upstream slot is free.
+        """
+        self.warm = warm
+        self.admission = admission
+        self.directory = directory
+        self.workers = workers
+        self.rate = rate
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.popular_count = popular_count
+        self.popular_interval = popular_interval
+        self._queue = queue.Queue(queue_size)
+        self._pending = set()
+        self._warmed = {}  # file_id -> (upstream bytes, warmed at), until played or expired
+        self._warmed_bytes = 0
+        self._plays = {}
+        self._paced_until = 0.0
+        self._lock = threading.Lock()
+        self._started = False
+        self.requested = 0
+        self.dropped = 0
+        self.busy = 0
+        self.over_budget = 0
+        self.errors = 0
+        self.warmed = 0
+        self.warmed_bytes_total = 0
+        self.used = 0
+        self.expired = 0
+
+    def _start(self):
+        # Threads start on first use, in the worker process that uses them
+        for i in range(self.workers):
+            threading.Thread(target=self._work, name=f'prefetch-{i}', daemon=True).start()
+        if self.popular_interval > 0:
+            threading.Thread(target=self._refresh_popular, name='prefetch-popular',
+                             daemon=True).start()
+
+    def request(self, file_ids):
+        """Queue tracks for prefetch; ones already warm or queued are skipped, and a full queue drops the rest"""
+        with self._lock:
+            if not self._started:
+                self._started = True
+                self._start()
+            self._expire(time.monotonic())
+            for file_id in file_ids:
+                if file_id in self._pending or file_id in self._warmed:
+                    continue
+                self.requested += 1
+                try:
+                    self._queue.put_nowait(file_id)
+                except queue.Full:
+                    self.dropped += 1
+                    continue
+                self._pending.add(file_id)
+
+    def _marker(self, file_id):
+        return os.path.join(self.directory, file_id)
+
+    def _claim(self, file_id):
+        """Remove file_id's warmed marker; its age if this call removed it, else None"""
+        path = self._marker(file_id)
+        try:
+            age = time.time() - os.stat(path).st_mtime
+            os.unlink(path)
+        except FileNotFoundError:
+            return None
+        return age
+
+    def started(self, file_id):
+        """Record that playback of file_id started, counting it as used if its head was prefetched (by any worker)"""
+        age = self._claim(file_id)
+        with self._lock:
+            self._plays[file_id] = self._plays.get(file_id, 0) + 1
+            if len(self._plays) > POPULAR_MAX_TRACKS:
+                self._plays = {key: count // 2 for key, count in self._plays.items() if count > 1}
+            warmed = self._warmed.pop(file_id, None)
+            if warmed is not None:
+                self._warmed_bytes -= warmed[0]
+            if age is not None:
+                if age <= self.ttl:
+                    self.used += 1
+                else:
+                    self.expired += 1
+
+    def popular(self, count):
+        """The count most played tracks, most played first"""
+        with self._lock:
+            plays = sorted(self._plays.items(), key=lambda item: item[1], reverse=True)
+        return [file_id for file_id, _ in plays[:count]]
+
+    def _expire(self, now, played_elsewhere=False):
+        """
+        Drop warmed heads nobody played within ttl and, with
+        played_elsewhere, ones another worker played (called with _lock held)
+        """
+        for file_id, (size, warmed_at) in list(self._warmed.items()):
+            if now - warmed_at > self.ttl:
+                # Unless a play in another worker just claimed it
+                if self._claim(file_id) is not None:
+                    self.expired += 1
+            elif not (played_elsewhere and not os.path.exists(self._marker(file_id))):
+                continue
+            del self._warmed[file_id]
+            self._warmed_bytes -= size
+
+    def _refresh_popular(self):
+        while True:
+            time.sleep(self.popular_interval)
+            popular = self.popular(self.popular_count)
+            if popular:
+                self.request(popular)
+
+    def _work(self):
+        while True:
+            file_id = self._queue.get()
+            try:
+                self._prefetch(file_id)
+            except Exception as e:
+                with self._lock:
+                    self.errors += 1
+                print(f"[Prefetch] {file_id} failed: {str(e)}")
+            finally:
+                with self._lock:
+                    self._pending.discard(file_id)
+
+    def _pace(self, amount):
+        """Seconds to hold back amount bytes, to keep to rate across this worker's prefetch threads"""
+        if not self.rate:
+            return 0.0
+        with self._lock:
+            now = time.monotonic()
+            wait = max(0.0, self._paced_until - now)
+            self._paced_until = max(self._paced_until, now) + amount / self.rate
+        return wait
+
+    def _prefetch(self, file_id):
+        with self._lock:
+            if self._warmed_bytes >= self.max_bytes:
+                # Heads played in other workers no longer count against the budget
+                self._expire(time.monotonic(), played_elsewhere=True)
+            if self._warmed_bytes >= self.max_bytes:
+                self.over_budget += 1
+                return
+
+        ticket = self.admission.try_admit(BULK, 'prefetch', spare=True)
+        if ticket is None:
+            with self._lock:
+                self.busy += 1
+            return
+        unused = [ticket]
+
+        def admit():
+            # The job's own slot serves its first upstream read
+            admitted = unused.pop() if unused else self.admission.try_admit(BULK, 'prefetch', spare=True)
+            if admitted is None:
+                raise Overloaded(self.admission.retry_after)
+            return _Paced(admitted, self._pace)
+
+        try:
+            size = self.warm(file_id, admit)
+        except Overloaded:
+            with self._lock:
+                self.busy += 1
+            return
+        finally:
+            if unused:
+                ticket.release()
+        if not size:
+            # Skipped, or the head was on disk already: nothing to count as used
+            return
+
+        os.makedirs(self.directory, exist_ok=True)
+        with open(self._marker(file_id), 'w') as marker:
+            marker.write(str(size))
+        with self._lock:
+            self._warmed[file_id] = (size, time.monotonic())
+            self._warmed_bytes += size
+            self.warmed += 1
+            self.warmed_bytes_total += size
+
+    def stats(self):
+        with self._lock:
+            self._expire(time.monotonic(), played_elsewhere=True)
+            settled = self.used + self.expired
+            return {
+                'requested': self.requested,
+                'warmed': self.warmed,
+                'warmed_bytes': self.warmed_bytes_total,
+                'used': self.used,
+                'expired': self.expired,
+                'hit_ratio': self.used / settled if settled else 0.0,
+                'waiting': len(self._warmed),
+                'waiting_bytes': self._warmed_bytes,
+                'max_bytes': self.max_bytes,
+                'queued': len(self._pending),
+                'dropped': self.dropped,
+                'busy': self.busy,
+                'over_budget': self.over_budget,
+                'errors': self.errors,
+            }
+
+
+class _Paced:
+    """An admission ticket whose delay also keeps to the prefetcher's own rate"""
+
+    def __init__(self, ticket, pace):
+        self.ticket = ticket
+        self.pace = pace
+
+    def delay(self, amount):
+        return max(self.ticket.delay(amount), self.pace(amount))
+
+    def release(self):
+        self.ticket.release()
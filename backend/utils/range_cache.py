@@ -0,0 +1,417 @@
+import asyncio
+import hashlib
+import os
+import threading
+import time
+from utils.broadcast import AsyncBroadcast, Broadcast, Detached
+from utils.relay import Relay
+
+PART_SUFFIX = '.part'
+BLOCKS_SUFFIX = '.blocks'
+
+# Size of the pread() calls used to serve cached blocks
+READ_CHUNK_SIZE = 64 * 1024
+# Minimum time between two eviction scans of the cache directory
+EVICT_INTERVAL = 5.0
+
+
+class RangeCache:
+    """
+    Sparse, block-aligned byte-range cache for streamed tracks.
+
+    Each file_id gets a sparse data file of the track's full length and a
+    presence map with one byte per block. Reads are served from the blocks
+    that are present; each run of missing blocks is fetched upstream with a
+    single block-aligned Range request, written in place and marked present.
+    Within a worker, that request is a broadcast: listeners that need the
+    same bytes while it runs read from its ring buffer instead of opening
+    their own upstream request.
+    The presence map lives on disk, so every worker sees blocks fetched by the
+    others. Whole tracks are evicted least recently used first once the disk
+    space actually allocated by the data files exceeds max_bytes.
+    """
+
+    def __init__(self, directory, max_bytes, block_size, buffer_bytes=4 * 1024 * 1024):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.block_size = block_size
+        # A listener that falls out of the buffer resumes from disk, so it
+        # must hold at least the block that listener is in
+        self.buffer_bytes = max(buffer_bytes, 2 * block_size)
+        self.hit_bytes = 0
+        self.miss_bytes = 0
+        self.upstream_bytes = 0
+        self.evictions = 0
+        self.broadcasts_started = 0
+        self.joins = 0
+        self.detaches = 0
+        self._broadcasts = {}  # (key, total_length) -> running broadcasts
+        self._lock = threading.Lock()
+        self._next_evict = 0.0
+        os.makedirs(directory, exist_ok=True)
+
+    def _base_path(self, key):
+        digest = hashlib.sha256(key.encode('utf-8')).hexdigest()
+        return os.path.join(self.directory, digest)
+
+    def _open(self, key, total_length):
+        """Open (creating or resetting as needed) the data file and presence map for key"""
+        base = self._base_path(key)
+        block_count = (total_length + self.block_size - 1) // self.block_size
+        data_fd = os.open(base + PART_SUFFIX, os.O_RDWR | os.O_CREAT, 0o644)
+        blocks_fd = os.open(base + BLOCKS_SUFFIX, os.O_RDWR | os.O_CREAT, 0o644)
+        if os.fstat(data_fd).st_size != total_length or os.fstat(blocks_fd).st_size != block_count:
+            # New entry, or the upstream file changed size: start from empty
+            os.ftruncate(blocks_fd, 0)
+            os.ftruncate(blocks_fd, block_count)
+            os.ftruncate(data_fd, total_length)
+        os.utime(base + BLOCKS_SUFFIX)
+        return data_fd, blocks_fd
+
+    def _runs(self, blocks_fd, total_length, start, end):
+        """Split start..end into block-aligned (cached, first_byte, last_byte) runs"""
+        block_size = self.block_size
+        first_block = start // block_size
+        last_block = end // block_size
+        block_span = last_block - first_block + 1
+        present = os.pread(blocks_fd, block_span, first_block).ljust(block_span, b'\x00')
+
+        runs = []
+        block = first_block
+        while block <= last_block:
+            cached = present[block - first_block]
+            run_end = block
+            while run_end + 1 <= last_block and present[run_end + 1 - first_block] == cached:
+                run_end += 1
+            runs.append((bool(cached), block * block_size,
+                         min((run_end + 1) * block_size, total_length) - 1))
+            block = run_end + 1
+        return runs
+
+    def _read_cached(self, key, data_fd, position, stop):
+        while position <= stop:
+            chunk = os.pread(data_fd, min(READ_CHUNK_SIZE, stop - position + 1), position)
+            if not chunk:
+                raise IOError(f"Cached range for {key} is truncated")
+            position += len(chunk)
+            with self._lock:
+                self.hit_bytes += len(chunk)
+            yield chunk
+
+    def _join(self, kind, key, total_length, position, first, last):
+        """
+        Attach to a running broadcast of key that can serve position, or create
+        one for the missing run first..last. Returns (broadcast, token, created).
+        """
+        with self._lock:
+            running = self._broadcasts.setdefault((key, total_length), [])
+            for broadcast in running:
+                if isinstance(broadcast, kind):
+                    token = broadcast.attach(position)
+                    if token is not None:
+                        self.joins += 1
+                        return broadcast, token, False
+            broadcast = kind(key, first, last, self.buffer_bytes)
+            running.append(broadcast)
+            self.broadcasts_started += 1
+            return broadcast, broadcast.attach(position), True
+
+    def _retire(self, broadcast, total_length):
+        with self._lock:
+            running = self._broadcasts.get((broadcast.key, total_length), [])
+            if broadcast in running:
+                running.remove(broadcast)
+            if not running:
+                self._broadcasts.pop((broadcast.key, total_length), None)
+
+    def _produce(self, broadcast, total_length, fetch_range, admit):
+        """Producer thread: the one upstream read behind a Broadcast"""
+        error = None
+        ticket = None
+        data_fd, blocks_fd = self._open(broadcast.key, total_length)
+        try:
+            writer = _RunWriter(self, data_fd, blocks_fd, broadcast.start, broadcast.end)
+            if admit is not None:
+                ticket = admit()
+            response = fetch_range(broadcast.start, broadcast.end)
+            try:
+                drain_to = None
+                for view in Relay(response, pace=ticket.delay if ticket is not None else None):
+                    writer.feed(view)
+                    if drain_to is None:
+                        # The ring keeps chunks after the relay buffer is reused
+                        if broadcast.publish(bytes(view)):
+                            continue
+                        # Every listener left: complete the block being filled, so it is cached
+                        drain_to = writer.block_end()
+                    if writer.offset > drain_to:
+                        break
+                else:
+                    writer.finish(broadcast.key)
+            finally:
+                response.close()
+        except Exception as e:
+            print(f"[RangeCache] Upstream read for {broadcast.key} failed: {str(e)}")
+            error = e
+        finally:
+            if ticket is not None:
+                ticket.release()
+            os.close(data_fd)
+            os.close(blocks_fd)
+            self._retire(broadcast, total_length)
+            broadcast.finish(error)
+
+    async def _aproduce(self, broadcast, total_length, afetch_range, aadmit):
+        """Producer task: the one upstream read behind an AsyncBroadcast"""
+        error = None
+        ticket = None
+        data_fd, blocks_fd = self._open(broadcast.key, total_length)
+        try:
+            writer = _RunWriter(self, data_fd, blocks_fd, broadcast.start, broadcast.end)
+            if aadmit is not None:
+                ticket = await aadmit()
+            chunks = afetch_range(broadcast.start, broadcast.end)
+            try:
+                drain_to = None
+                async for chunk in chunks:
+                    if ticket is not None:
+                        wait = ticket.delay(len(chunk))
+                        if wait:
+                            await asyncio.sleep(wait)
+                    writer.feed(chunk)
+                    if drain_to is None:
+                        if await broadcast.publish(chunk):
+                            continue
+                        drain_to = writer.block_end()
+                    if writer.offset > drain_to:
+                        break
+                else:
+                    writer.finish(broadcast.key)
+            finally:
+                await chunks.aclose()
+        except Exception as e:
+            print(f"[RangeCache] Upstream read for {broadcast.key} failed: {str(e)}")
+            error = e
+        finally:
+            if ticket is not None:
+                ticket.release()
+            os.close(data_fd)
+            os.close(blocks_fd)
+            self._retire(broadcast, total_length)
+            await broadcast.finish(error)
+
+    def _served(self, position, end, data):
+        data = data[:end - position + 1]
+        with self._lock:
+            self.miss_bytes += len(data)
+        return data
+
+    def _detached(self, key, position):
+        with self._lock:
+            self.detaches += 1
+        print(f"[RangeCache] Listener on {key} fell behind at byte {position}, reading from disk")
+
+    def cached(self, key, total_length, start, end):
+        """Whether bytes start..end of the track are all on disk already (without creating an entry)"""
+        base = self._base_path(key)
+        try:
+            blocks_fd = os.open(base + BLOCKS_SUFFIX, os.O_RDONLY)
+        except FileNotFoundError:
+            return False
+        try:
+            if os.fstat(blocks_fd).st_size != (total_length + self.block_size - 1) // self.block_size:
+                return False
+            runs = self._runs(blocks_fd, total_length, start, end)
+        finally:
+            os.close(blocks_fd)
+        return len(runs) == 1 and runs[0][0]
+
+    def read(self, key, total_length, start, end, fetch_range, admit=None):
+        """
+        Yield bytes start..end (inclusive) of a track of total_length bytes.
+
+        fetch_range(first, last) must return a requests-style streaming
+        response for upstream bytes first..last; it is only called for runs
+        of blocks that are not cached yet, and by at most one broadcast at a
+        time for any byte.
+
+        admit(), if given, is called before each such upstream read and
+        returns an admission ticket that paces it and is released when it
+        ends, so reads served from disk or a running broadcast take no slot.
+        Its errors (such as Overloaded) are raised to the listeners.
+        """
+        data_fd, blocks_fd = self._open(key, total_length)
+        try:
+            position = start
+            while position <= end:
+                cached, first, last = self._runs(blocks_fd, total_length, position, end)[0]
+                if cached:
+                    yield from self._read_cached(key, data_fd, position, min(last, end))
+                    position = min(last, end) + 1
+                    continue
+                broadcast, token, created = self._join(Broadcast, key, total_length, position, first, last)
+                if created:
+                    threading.Thread(target=self._produce,
+                                     args=(broadcast, total_length, fetch_range, admit),
+                                     daemon=True).start()
+                try:
+                    while position <= end:
+                        data = broadcast.read(token)
+                        if data is None:
+                            break  # Past this broadcast; the next run decides
+                        data = self._served(position, end, data)
+                        position += len(data)
+                        yield data
+                except Detached:
+                    self._detached(key, position)
+                finally:
+                    broadcast.leave(token)
+        finally:
+            os.close(data_fd)
+            os.close(blocks_fd)
+            self._maybe_evict()
+
+    async def aread(self, key, total_length, start, end, afetch_range, aadmit=None):
+        """
+        Async twin of read() for the ASGI server: afetch_range(first, last)
+        returns an async iterator of upstream chunks, read by a task, and
+        aadmit() is awaited for its ticket. Local block I/O is small
+        pread/pwrite calls and stays on the event loop.
+        """
+        data_fd, blocks_fd = self._open(key, total_length)
+        try:
+            position = start
+            while position <= end:
+                cached, first, last = self._runs(blocks_fd, total_length, position, end)[0]
+                if cached:
+                    for chunk in self._read_cached(key, data_fd, position, min(last, end)):
+                        yield chunk
+                    position = min(last, end) + 1
+                    continue
+                broadcast, token, created = self._join(AsyncBroadcast, key, total_length,
+                                                       position, first, last)
+                if created:
+                    broadcast.task = asyncio.ensure_future(
+                        self._aproduce(broadcast, total_length, afetch_range, aadmit))
+                try:
+                    while position <= end:
+                        data = await broadcast.read(token)
+                        if data is None:
+                            break
+                        data = self._served(position, end, data)
+                        position += len(data)
+                        yield data
+                except Detached:
+                    self._detached(key, position)
+                finally:
+                    await broadcast.leave(token)
+        finally:
+            os.close(data_fd)
+            os.close(blocks_fd)
+            self._maybe_evict()
+
+    def _maybe_evict(self):
+        now = time.monotonic()
+        if now < self._next_evict:
+            return
+        self._next_evict = now + EVICT_INTERVAL
+        self.evict()
+
+    def evict(self):
+        """Drop least recently used tracks until allocated bytes fit the budget"""
+        entries = []
+        total = 0
+        for item in os.scandir(self.directory):
+            if not item.name.endswith(PART_SUFFIX):
+                continue
+            base = item.path[:-len(PART_SUFFIX)]
+            try:
+                used = item.stat().st_blocks * 512
+                last_access = os.stat(base + BLOCKS_SUFFIX).st_mtime
+            except FileNotFoundError:
+                continue
+            entries.append((last_access, base, used))
+            total += used
+
+        entries.sort()
+        for _, base, used in entries:
+            if total <= self.max_bytes:
+                break
+            for path in (base + BLOCKS_SUFFIX, base + PART_SUFFIX):
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+            total -= used
+            with self._lock:
+                self.evictions += 1
+            print(f"[RangeCache] Evicted {os.path.basename(base)} ({used} bytes)")
+
+    def stats(self):
+        """
+        Byte-level counters for this worker. hit_bytes were served from disk
+        and miss_bytes from a broadcast; upstream_ratio is upstream bytes per
+        byte served, which drops below the miss share as listeners share reads.
+        """
+        with self._lock:
+            served = self.hit_bytes + self.miss_bytes
+            return {
+                'hit_bytes': self.hit_bytes,
+                'miss_bytes': self.miss_bytes,
+                'evictions': self.evictions,
+                'byte_hit_ratio': self.hit_bytes / served if served else 0.0,
+                'max_bytes': self.max_bytes,
+                'block_size': self.block_size,
+                'broadcast': {
+                    'active': sum(len(running) for running in self._broadcasts.values()),
+                    'listeners': sum(len(broadcast.listeners) for running in self._broadcasts.values()
+                                     for broadcast in running),
+                    'started': self.broadcasts_started,
+                    'joins': self.joins,
+                    'detaches': self.detaches,
+                    'buffer_bytes': self.buffer_bytes,
+                },
+                'upstream_bytes': self.upstream_bytes,
+                'downstream_bytes': served,
+                'upstream_ratio': self.upstream_bytes / served if served else 0.0,
+            }
+
+
+class _RunWriter:
+    """Persists one upstream run in place, marking each block present once it is complete"""
+
+    def __init__(self, cache, data_fd, blocks_fd, fetch_start, fetch_end):
+        self.cache = cache
+        self.data_fd = data_fd
+        self.blocks_fd = blocks_fd
+        self.fetch_end = fetch_end
+        self.offset = fetch_start
+        self.marked = fetch_start  # Runs start on a block boundary
+
+    def feed(self, chunk):
+        """Store an upstream chunk (any bytes-like object)"""
+        if not chunk:
+            return
+        os.pwrite(self.data_fd, chunk, self.offset)
+        self.offset += len(chunk)
+        with self.cache._lock:
+            self.cache.upstream_bytes += len(chunk)
+
+        # Mark the blocks completed by this chunk (the last one may be short)
+        block_size = self.cache.block_size
+        complete = self.offset if self.offset > self.fetch_end else self.offset - self.offset % block_size
+        if complete > self.marked:
+            first_block = self.marked // block_size
+            last_block = (complete - 1) // block_size
+            os.pwrite(self.blocks_fd, b'\x01' * (last_block - first_block + 1), first_block)
+            self.marked = (last_block + 1) * block_size
+
+    def block_end(self):
+        """Last byte of the block being filled (or of the one just completed)"""
+        block_size = self.cache.block_size
+        return min(self.fetch_end, ((self.offset - 1) // block_size + 1) * block_size - 1)
+
+    def finish(self, key):
+        """Fail if upstream ended before the end of the run"""
+        if self.offset <= self.fetch_end:
+            raise IOError(f"Upstream ended early for {key} at byte {self.offset}")
@@ -0,0 +1,145 @@
+"""
+Relay of an upstream response body through one reusable buffer.
+
+iter_content() allocates a new bytes object for every chunk, and small
+chunks mean one write per few kilobytes downstream. Relay reads with
+readinto() straight from the response's socket reader into a preallocated
+bytearray and yields memoryviews of it, sized to the observed end-to-end
+rate: how fast upstream fills the buffer and how fast the consumer hands
+control back. Fast transfers move in large chunks; slow ones in small
+chunks that still arrive every RELAY_TARGET_INTERVAL. A pace callable
+(such as an admission ticket's delay) holds back reading from upstream
+to the rate it allows.
+
+Reading from the socket reader goes under urllib3 to the http.client
+response it wraps, so it is only done when that is exactly what is
+there; any other raw body is read through its public readinto(), or
+through iter_content() if it has none.
+"""
+import http.client
+import time
+from config import RELAY_MIN_CHUNK_SIZE, RELAY_MAX_CHUNK_SIZE, RELAY_TARGET_INTERVAL
+from utils.metrics import UPSTREAM_BYTES, UPSTREAM_THROUGHPUT
+
+
+def _socket_readinto(response):
+    """
+    readinto() of the http.client response under requests/urllib3 when the
+    body is sent as-is, so bytes land in our buffer without an intermediate
+    copy; urllib3's own readinto() reads into a temporary bytes first.
+    Returns None when the body is compressed and has to be decoded, or the
+    raw body is not a urllib3 response over http.client.
+    """
+    if response.headers.get('Content-Encoding', 'identity') != 'identity':
+        return None
+    fp = getattr(response.raw, '_fp', None)
+    return fp.readinto if isinstance(fp, http.client.HTTPResponse) else None
+
+
+def _content_readinto(response, chunk_size):
+    """readinto() over iter_content(), for a raw body that has no readinto() of its own"""
+    chunks = response.iter_content(chunk_size)
+    pending = memoryview(b'')
+
+    def readinto(view):
+        nonlocal pending
+        if not pending:
+            pending = memoryview(next(chunks, b''))
+        count = min(len(view), len(pending))
+        view[:count] = pending[:count]
+        pending = pending[count:]
+        return count
+
+    return readinto
+
+
+class Relay:
+    """
+    Iterate to get the body of a requests streaming response as memoryviews
+    of a single buffer. Each view is only valid until the next is requested:
+    write it out, or copy it (bytes(view)) to keep it. The response is
+    closed when iteration ends or the generator is closed.
+
+    pace(n), if given, is called with the size of each chunk read and
+    returns the seconds to wait before reading on.
+    """
+
+    def __init__(self, response, min_size=RELAY_MIN_CHUNK_SIZE, max_size=RELAY_MAX_CHUNK_SIZE,
+                 target_interval=RELAY_TARGET_INTERVAL, pace=None):
+        self.response = response
+        self.pace = pace
+        self.min_size = min_size
+        self.max_size = max(min_size, max_size)
+        self.target_interval = target_interval
+        self.chunk_size = min_size
+        self.chunks = 0
+        self.bytes = 0
+
+    def _next_size(self, filled, fill_time, drain_time):
+        """Chunk size carrying about target_interval of data at the rate just seen"""
+        elapsed = fill_time + drain_time
+        if elapsed <= 0:
+            wanted = self.chunk_size * 2
+        else:
+            wanted = filled / elapsed * self.target_interval
+        # Move gradually (at most doubling or halving), in powers of two
+        size = self.chunk_size
+        if wanted >= size * 2:
+            size *= 2
+        elif wanted < size // 2:
+            size //= 2
+        return min(self.max_size, max(self.min_size, size))
+
+    def __iter__(self):
+        response = self.response
+        socket_readinto = _socket_readinto(response)
+        readinto = socket_readinto
+        if readinto is None and hasattr(response.raw, 'readinto'):
+            response.raw.decode_content = True
+            readinto = response.raw.readinto
+        elif readinto is None:
+            readinto = _content_readinto(response, self.max_size)
+        buffer = bytearray(self.chunk_size)
+        view = memoryview(buffer)
+        eof = False
+        reading = 0.0
+        try:
+            while not eof:
+                if len(buffer) != self.chunk_size:
+                    # Views of the old buffer may still be held; start a new one
+                    buffer = bytearray(self.chunk_size)
+                    view = memoryview(buffer)
+                started = time.monotonic()
+                deadline = started + self.target_interval
+                filled = 0
+                # Fill the buffer, but hand over what has arrived once the interval is up
+                while filled < len(buffer):
+                    count = readinto(view[filled:])
+                    if not count:
+                        eof = True
+                        break
+                    filled += count
+                    if time.monotonic() >= deadline:
+                        break
+                if not filled:
+                    break
+                filled_at = time.monotonic()
+                reading += filled_at - started
+                self.chunks += 1
+                self.bytes += filled
+                if self.pace is not None:
+                    wait = self.pace(filled)
+                    if wait:
+                        time.sleep(wait)
+                yield view[:filled]
+                self.chunk_size = self._next_size(filled, filled_at - started,
+                                                  time.monotonic() - filled_at)
+            if socket_readinto is not None:
+                # The body was read to its end behind urllib3's back: hand the
+                # connection back to the pool rather than letting close() drop it
+                response.raw.release_conn()
+        finally:
+            response.close()
+            UPSTREAM_BYTES.inc(amount=self.bytes)
+            if self.bytes and reading > 0:
+                UPSTREAM_THROUGHPUT.observe(self.bytes / reading)
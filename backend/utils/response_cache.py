@@ -0,0 +1,70 @@
+import threading
+from collections import OrderedDict
+
+
+class ResponseCache:
+    """
+    Bounded LRU cache of serialized responses for one catalog version.
+
+    Entries are stored under (version, key). The first lookup with a new
+    version drops everything cached for the previous one, so a catalog write
+    (which changes the version) empties the cache without explicit hooks.
+    """
+
+    def __init__(self, max_bytes, max_entry_bytes=None):
+        self.max_bytes = max_bytes
+        self.max_entry_bytes = max_entry_bytes if max_entry_bytes is not None else max_bytes // 8
+        self._version = None
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def _switch_version(self, version):
+        if version != self._version:
+            self._version = version
+            self._entries.clear()
+            self._bytes = 0
+
+    def get(self, version, key):
+        """Return (body, extra) cached for key, or None"""
+        with self._lock:
+            self._switch_version(version)
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry
+
+    def put(self, version, key, body, extra=None):
+        """Cache body (bytes) plus any small extra value under key"""
+        if len(body) > self.max_entry_bytes:
+            return
+        with self._lock:
+            self._switch_version(version)
+            previous = self._entries.pop(key, None)
+            if previous is not None:
+                self._bytes -= len(previous[0])
+            self._entries[key] = (body, extra)
+            self._bytes += len(body)
+            while self._bytes > self.max_bytes:
+                _, (evicted, _) = self._entries.popitem(last=False)
+                self._bytes -= len(evicted)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def stats(self):
+        with self._lock:
+            return {
+                'entries': len(self._entries),
+                'bytes': self._bytes,
+                'max_bytes': self.max_bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+            }
@@ -0,0 +1,96 @@
+import json
+import zlib
+
+# Optional accelerators: orjson for serialization, brotli for compression.
+# Without them responses fall back to the json module and gzip.
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+GZIP_LEVEL = 5
+BROTLI_QUALITY = 4
+
+
+def dumps(obj):
+    """Serialize obj to compact JSON bytes"""
+    if orjson is not None:
+        return orjson.dumps(obj)
+    return json.dumps(obj, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+
+
+def _accepted_codings(accept_encoding):
+    """Map each coding in an Accept-Encoding header to its q-value"""
+    codings = {}
+    for part in accept_encoding.split(','):
+        name, _, params = part.strip().partition(';')
+        name = name.strip().lower()
+        if not name:
+            continue
+        q = 1.0
+        params = params.strip()
+        if params.startswith('q='):
+            try:
+                q = float(params[2:])
+            except ValueError:
+                q = 0.0
+        codings[name] = q
+    return codings
+
+
+def choose_encoding(accept_encoding):
+    """Pick 'br', 'gzip' or None for a request's Accept-Encoding header"""
+    codings = _accepted_codings(accept_encoding or '')
+    wildcard = codings.get('*', 0.0)
+    candidates = ['br', 'gzip'] if brotli is not None else ['gzip']
+    best, best_q = None, 0.0
+    for name in candidates:
+        q = codings.get(name, wildcard)
+        if q > best_q:
+            best, best_q = name, q
+    return best
+
+
+def compress(body, encoding):
+    """Compress a complete response body with the chosen encoding"""
+    if encoding == 'br':
+        return brotli.compress(body, quality=BROTLI_QUALITY)
+    if encoding == 'gzip':
+        compressor = zlib.compressobj(GZIP_LEVEL, zlib.DEFLATED, 31)
+        return compressor.compress(body) + compressor.flush()
+    return body
+
+
+class StreamCompressor:
+    """
+    Incremental compressor for streamed bodies. flush() emits everything fed
+    so far, so the client can decode each batch as soon as it arrives.
+    """
+
+    def __init__(self, encoding):
+        self.encoding = encoding
+        if encoding == 'br':
+            self._compressor = brotli.Compressor(quality=BROTLI_QUALITY)
+        elif encoding == 'gzip':
+            self._compressor = zlib.compressobj(GZIP_LEVEL, zlib.DEFLATED, 31)
+        else:
+            self._compressor = None
+
+    def flush(self, data):
+        if self.encoding == 'br':
+            return self._compressor.process(data) + self._compressor.flush()
+        if self.encoding == 'gzip':
+            return self._compressor.compress(data) + self._compressor.flush(zlib.Z_SYNC_FLUSH)
+        return data
+
+    def finish(self):
+        if self.encoding == 'br':
+            return self._compressor.finish()
+        if self.encoding == 'gzip':
+            return self._compressor.flush()
+        return b''
@@ -0,0 +1,474 @@
+import bisect
+import functools
+import re
+import unicodedata
+from collections import defaultdict
+import numpy as np
+
+# Columns that are indexed, with the weight a match in each one carries
+FIELD_WEIGHTS = {'title': 1.0, 'artist': 0.8, 'album': 0.6}
+
+# Per-term scores: exact > prefix > fuzzy
+EXACT_SCORE = 1.0
+PREFIX_SCORE = 0.6
+FUZZY_SCORE = 0.4
+
+# Bonus when a whole field equals / starts with the whole query
+PHRASE_EXACT_BONUS = 1.0
+PHRASE_PREFIX_BONUS = 0.4
+
+# Bounds that keep lookups flat as the catalog grows
+MAX_PREFIX_TERMS = 64
+MAX_FUZZY_TERMS = 16
+MIN_FUZZY_SIMILARITY = 0.5
+
+# Rows scored in the first chunk of a limited search (the chunk is at
+# least twice the limit, and doubles until the results are settled)
+MIN_CHUNK_ROWS = 256
+
+_TOKEN_RE = re.compile(r'[a-z0-9]+')
+
+# Spelling variants that are common when Hindi/Urdu lyrics are romanized,
+# e.g. "dil"/"dill", "jaana"/"jana", "pyaar"/"pyar", "zindagi"/"jindagi"
+_DOUBLED_LETTERS = (re.compile(r'([a-z])\1+'), r'\1')  # aa, nn, yy, ...
+_TRANSLITERATION_RULES = [
+    _DOUBLED_LETTERS,
+    (re.compile(r'([bcdgjkpt])h'), r'\1'),  # aspirated consonants: bh, chh, dh, kh, th
+    (re.compile(r'sh'), 's'),
+    (re.compile(r'ph'), 'f'),
+    (re.compile(r'w'), 'v'),
+    (re.compile(r'z'), 'j'),
+    (re.compile(r'q'), 'k'),
+    (re.compile(r'ck'), 'k'),
+    (re.compile(r'(ee|ii)'), 'i'),
+    (re.compile(r'(oo|uu|ou)'), 'u'),
+    (re.compile(r'(ai|ae)'), 'e'),
+    (re.compile(r'ey$'), 'e'),
+    (re.compile(r'(?<=.)y$'), 'i'),
+    _DOUBLED_LETTERS,
+]
+
+
+def normalize_text(value):
+    """Lowercase, strip accents and collapse punctuation to single spaces"""
+    if not value.isascii():
+        value = unicodedata.normalize('NFKD', value)
+        value = ''.join(ch for ch in value if not unicodedata.combining(ch))
+    return ' '.join(_TOKEN_RE.findall(value.lower()))
+
+
+@functools.lru_cache(maxsize=65536)
+def phonetic_key(token):
+    """Fold a normalized token so common transliteration variants compare equal"""
+    if token.isdigit():
+        return token
+    for pattern, replacement in _TRANSLITERATION_RULES:
+        token = pattern.sub(replacement, token)
+    return token
+
+
+def _trigrams(key):
+    padded = f' {key} '
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+def query_keys(query):
+    """The distinct folded tokens a query is matched on, in query order"""
+    keys = [phonetic_key(token) for token in normalize_text(query).split()]
+    return list(dict.fromkeys(keys))
+
+
+def query_key(query):
+    """Canonical form of a query: queries with the same key get the same results"""
+    return ' '.join(query_keys(query))
+
+
+class SearchIndex:
+    """
+    Inverted token index with a trigram index over the vocabulary.
+
+    Rows are matched term by term against exact, prefix and fuzzy (trigram)
+    vocabulary matches of each query token, and ranked by field-weighted
+    score. The candidates are the rows that match the most selective query
+    token. A limited search scores them in ascending row id chunks, through
+    a forward index of each row's terms, along with the rows that get a
+    query token's or the query phrase's highest score, and stops once no
+    row left could rank ahead of the results so far. A strong match late in
+    the postings is never cut off by the limit, and results never depend on
+    it. Work depends on how soon the results settle rather than on how many
+    rows match: a chunk or two when the best possible matches are common,
+    every candidate when no row comes close to them.
+    """
+
+    def __init__(self, columns, rows):
+        columns = list(columns)
+        self.fields = [(columns.index(name), weight)
+                       for name, weight in FIELD_WEIGHTS.items() if name in columns]
+        self.field_weights = tuple(weight for _, weight in self.fields)
+        self.row_count = len(rows)
+
+        field_postings = [defaultdict(list) for _ in self.fields]
+        field_terms = [[] for _ in self.fields]
+        field_phrases = [[] for _ in self.fields]
+        for row_id, row in enumerate(rows):
+            for field_no, (column, weight) in enumerate(self.fields):
+                normalized = normalize_text(row[column])
+                keys = tuple(dict.fromkeys(phonetic_key(t) for t in normalized.split()))
+                for key in keys:
+                    field_postings[field_no][key].append(row_id)
+                field_terms[field_no].append(keys)
+                field_phrases[field_no].append(' '.join(keys))
+
+        # One array of row ids per term, grouped by the best field the term
+        # is in (fields are in descending weight); field_ends[term] marks
+        # where each group ends
+        self.postings = {}
+        self.field_ends = {}
+        for key in set().union(*field_postings):
+            ids = []
+            ends = []
+            seen = set()
+            for postings in field_postings:
+                for row_id in postings.get(key, ()):
+                    if row_id not in seen:
+                        seen.add(row_id)
+                        ids.append(row_id)
+                ends.append(len(ids))
+            self.postings[key] = np.array(ids, dtype=np.int32)
+            self.field_ends[key] = tuple(ends)
+        self.vocabulary = sorted(self.postings)
+        self.term_ids = {term: term_id for term_id, term in enumerate(self.vocabulary)}
+
+        # Forward index: per field, the term ids of row r are
+        # terms[offsets[r]:offsets[r + 1]]
+        self.forward = []
+        for terms in field_terms:
+            offsets = np.zeros(len(terms) + 1, dtype=np.int64)
+            offsets[1:] = np.cumsum([len(keys) for keys in terms])
+            term_ids = np.array([self.term_ids[key] for keys in terms for key in keys], dtype=np.int32)
+            self.forward.append((offsets, term_ids))
+
+        # Field phrases in sorted order, with each row's position in it: rows
+        # whose field equals or starts with the query phrase are the ones
+        # whose position falls in a range one bisect away
+        self.phrase_index = []
+        for phrases in field_phrases:
+            order = sorted(range(len(phrases)), key=phrases.__getitem__)
+            positions = np.empty(len(order), dtype=np.int32)
+            positions[order] = np.arange(len(order), dtype=np.int32)
+            self.phrase_index.append(([phrases[i] for i in order], np.array(order, dtype=np.int32),
+                                      positions))
+
+        # Trigram -> ids of the vocabulary terms containing it
+        trigram_index = defaultdict(list)
+        for term_id, key in enumerate(self.vocabulary):
+            for gram in _trigrams(key):
+                trigram_index[gram].append(term_id)
+        self.trigram_index = {gram: np.array(ids, dtype=np.int32) for gram, ids in trigram_index.items()}
+        self.term_lengths = np.array([len(term) for term in self.vocabulary], dtype=np.float64)
+
+    def _match_terms(self, key):
+        """Map vocabulary terms matching one query key to their term score"""
+        matches = {}
+        if key in self.postings:
+            matches[key] = EXACT_SCORE
+
+        # Exact and prefix matches are one run of the sorted vocabulary
+        start = end = bisect.bisect_left(self.vocabulary, key)
+        if len(key) >= 2:
+            for term in self.vocabulary[start:start + MAX_PREFIX_TERMS]:
+                if not term.startswith(key):
+                    break
+                end += 1
+                if term not in matches:
+                    # Shorter completions are closer to what was typed
+                    matches[term] = PREFIX_SCORE * (0.5 + 0.5 * len(key) / len(term))
+
+        if len(key) >= 3:
+            grams = _trigrams(key)
+            found = [self.trigram_index[gram] for gram in grams if gram in self.trigram_index]
+            if found:
+                # Shared trigram count of every term with any, then their Dice similarity
+                term_ids = np.sort(np.concatenate(found))
+                starts = np.flatnonzero(np.concatenate(([True], term_ids[1:] != term_ids[:-1])))
+                counts = np.diff(np.append(starts, len(term_ids)))
+                term_ids = term_ids[starts]
+                similarity = 2.0 * counts / (len(grams) + self.term_lengths[term_ids])
+                keep = (similarity >= MIN_FUZZY_SIMILARITY) & ((term_ids < start) | (term_ids >= end))
+                term_ids, similarity = term_ids[keep], similarity[keep]
+                # Most similar first; among equals, the term that sorts last
+                best = np.lexsort((-term_ids, -similarity))[:MAX_FUZZY_TERMS]
+                for term_id, value in zip(term_ids[best].tolist(), similarity[best].tolist()):
+                    matches[self.vocabulary[term_id]] = FUZZY_SCORE * value
+
+        return matches
+
+    def _key_tiers(self, matches):
+        """
+        (top, high, low) for one query key: top holds the rows (ascending)
+        that get its best score, high; every other row gets at most low
+        """
+        high = low = 0.0
+        groups = []
+        for term, score in matches.items():
+            start = 0
+            for end, weight in zip(self.field_ends[term], self.field_weights):
+                if end > start:
+                    value = score * weight
+                    if value > high:
+                        high, low = value, max(low, high)
+                        groups = [(term, start, end)]
+                    elif value == high:
+                        groups.append((term, start, end))
+                    elif value > low:
+                        low = value
+                start = end
+        top = _union([self.postings[term][start:end] for term, start, end in groups])
+        return top, high, low
+
+    def _phrase_tiers(self, phrase):
+        """
+        Per field: None if no row's field starts with phrase, else (range,
+        top, high, low) where range is (low, exact, high) positions in the
+        field's phrase order, top the rows (ascending) whose field equals
+        phrase with bonus high, and low the most any other row gets
+        """
+        tiers = []
+        for (phrases, order, _), weight in zip(self.phrase_index, self.field_weights):
+            low = bisect.bisect_left(phrases, phrase)
+            # Phrases are [a-z0-9 ], so '~' sorts after every continuation
+            high = bisect.bisect_left(phrases, phrase + '~', low)
+            if low == high:
+                tiers.append(None)
+                continue
+            exact = bisect.bisect_right(phrases, phrase, low, high)
+            prefix_bonus = PHRASE_PREFIX_BONUS * weight if exact < high else 0.0
+            # Equal phrases keep row order, so the exact rows are ascending
+            tiers.append(((low, exact, high), order[low:exact],
+                          PHRASE_EXACT_BONUS * weight if exact > low else prefix_bonus, prefix_bonus))
+        return tiers
+
+    def _score(self, rows, key_terms, driver, phrase_tiers, key_count):
+        """
+        (ranking, candidate) for each row: ranking is the negated score, so
+        ascending is best first, and candidate whether the driver key matches
+        """
+        key_scores = [np.zeros(len(rows)) for _ in key_terms]
+        for (offsets, terms), weight in zip(self.forward, self.field_weights):
+            starts = offsets[rows]
+            counts = offsets[rows + 1] - starts
+            owner = np.repeat(np.arange(len(rows)), counts)
+            # Position in terms of every term of these rows in this field
+            first = np.cumsum(counts) - counts
+            tokens = terms[np.repeat(starts - first, counts) + np.arange(len(owner))]
+            for best, (term_ids, scores) in zip(key_scores, key_terms):
+                if len(term_ids) == 1:
+                    np.maximum.at(best, owner[tokens == term_ids[0]], scores[0] * weight)
+                    continue
+                found = np.minimum(np.searchsorted(term_ids, tokens), len(term_ids) - 1)
+                hit = term_ids[found] == tokens
+                np.maximum.at(best, owner[hit], scores[found[hit]] * weight)
+
+        total = np.zeros(len(rows))
+        matched = np.zeros(len(rows))
+        for best in key_scores:
+            total += best
+            matched += best > 0
+        for (_, _, positions), tier, weight in zip(self.phrase_index, phrase_tiers, self.field_weights):
+            if tier is not None:
+                low, exact, high = tier[0]
+                position = positions[rows]
+                bonus = np.zeros(len(rows))
+                bonus[(position >= low) & (position < high)] = PHRASE_PREFIX_BONUS * weight
+                bonus[(position >= low) & (position < exact)] = PHRASE_EXACT_BONUS * weight
+                total += bonus
+        # Rows that miss some query tokens rank below rows that match them all
+        coverage = matched / key_count
+        return -(total * coverage * coverage), key_scores[driver] > 0
+
+    def search(self, query, limit=None):
+        """
+        Return row ids ranked by relevance, best first.
+        An empty query returns every row in catalog order.
+        """
+        keys = query_keys(query)
+        if not keys:
+            row_ids = range(self.row_count)
+            return list(row_ids if limit is None else row_ids[:limit])
+        if limit is not None and limit <= 0:
+            return []
+
+        term_matches = [self._match_terms(key) for key in keys]
+
+        # Drive candidate generation from the most selective query token
+        sized = [(sum(len(self.postings[t]) for t in m), i)
+                 for i, m in enumerate(term_matches) if m]
+        if not sized:
+            return []
+        _, driver = min(sized)
+        candidates = _union([self.postings[t] for t in term_matches[driver]])
+
+        # Keys nothing matched score zero everywhere and drop out
+        driver = [i for _, i in sized].index(driver)
+        term_matches = [matches for matches in term_matches if matches]
+        key_terms = []
+        for matches in term_matches:
+            ids = np.array([self.term_ids[term] for term in matches], dtype=np.int32)
+            order = np.argsort(ids)
+            key_terms.append((ids[order], np.array(list(matches.values()))[order]))
+        phrase_tiers = self._phrase_tiers(' '.join(keys))
+
+        def score(rows):
+            return self._score(rows, key_terms, driver, phrase_tiers, len(keys))
+
+        if limit is None or len(candidates) <= 2 * max(MIN_CHUNK_ROWS, 2 * limit):
+            # Few enough to score in one go
+            ranking, _ = score(candidates)
+            kept, ranking = _best(candidates, ranking, limit)
+            return kept[np.lexsort((kept, ranking))].tolist()
+
+        # Threshold search. Each source is a list of rows in ascending id
+        # order, scored a growing chunk at a time: the candidates, and per
+        # query key (and per field the query phrase starts) the rows that
+        # get its high score. A row not scored yet is past the cursor of
+        # every source it is in, so between cursors the best score it could
+        # reach is known; scoring stops once no row still unscored could
+        # rank ahead of the limit-th kept row.
+        end = self.row_count
+        scan = _Source(candidates, 0.0, 0.0, limit, end)
+        sources = [_Source(*self._key_tiers(matches), limit, end) for matches in term_matches]
+        sources += [_Source(*tier[1:], limit, end) for tier in phrase_tiers if tier is not None]
+        coverage = len(key_terms) / len(keys)
+        bounded = [s for s in sources if s.high > s.low]
+
+        # Only rows in every bounded source reach the highest score; below
+        # the ceiling's cursor an unscored row misses at least one of them
+        ceiling = _Ceiling(bounded, limit, end) if len(bounded) > 1 else None
+
+        def bound(point):
+            """Best ranking an unscored row from point up to the next cursor could reach"""
+            high = [s.cursor <= point for s in sources]
+            if ceiling is not None and ceiling.cursor > point and \
+                    all(h for s, h in zip(sources, high) if s.high > s.low):
+                # Summed in _score()'s order, so a row that reaches it ranks exactly equal
+                best = max(sum(s.high if h and s is not missed else s.low for s, h in zip(sources, high))
+                           for missed in bounded)
+            else:
+                best = sum(s.high if h else s.low for s, h in zip(sources, high))
+            return -(best * coverage * coverage)
+
+        # First round: the ceiling rows (and the candidates, unless those
+        # alone fill the results) plus every source that fits one chunk
+        parts = [ceiling.take()] if ceiling is not None else []
+        if sum(len(rows) for rows in parts) < limit:
+            parts.append(scan.take())
+        parts += [s.take() for s in sources if 0 < s.remaining() <= 2 * s.chunk]
+
+        kept = np.zeros(0, dtype=candidates.dtype)
+        ranking = np.zeros(0)
+        while True:
+            rows = _union(parts)
+            rows = rows[~_member(np.sort(kept), rows)]
+            chunk, candidate = score(rows)
+            kept = np.concatenate((kept, rows[candidate]))
+            kept, ranking = _best(kept, np.concatenate((ranking, chunk[candidate])), limit)
+
+            if scan.cursor == end:
+                break
+            source = scan
+            if len(kept) == limit:
+                cutoff = ranking.max()
+                cutoff_id = kept[ranking == cutoff].max()
+                start = scan.cursor
+                cursors = [s.cursor for s in sources + [ceiling] if s is not None]
+                for point in sorted({start, *(c for c in cursors if start < c < end)}):
+                    best = bound(point)
+                    if best < cutoff or (best == cutoff and point <= cutoff_id):
+                        # Rows from point on might still rank ahead: lower the
+                        # bound there through the shortest source that is
+                        # high at point, unless scanning on is about as cheap
+                        narrow = [s for s in bounded if s.cursor <= point and s.remaining()]
+                        if narrow:
+                            shortest = min(narrow, key=_Source.remaining)
+                            if 4 * shortest.remaining() < scan.remaining():
+                                source = shortest
+                        break
+                else:
+                    break
+            parts = [source.take()]
+
+        order = np.lexsort((kept, ranking))
+        return kept[order].tolist()
+
+
+def _best(rows, ranking, limit):
+    """The limit best rows and their ranking (all of them if limit is None); ties go to the lowest ids"""
+    if limit is None or len(rows) <= limit:
+        return rows, ranking
+    cutoff = np.partition(ranking, limit - 1)[limit - 1]
+    keep = ranking < cutoff
+    tied = np.flatnonzero(ranking == cutoff)
+    tied = tied[np.argsort(rows[tied], kind='stable')]
+    keep[tied[:limit - np.count_nonzero(keep)]] = True
+    return rows[keep], ranking[keep]
+
+
+def _union(arrays):
+    """Sorted, distinct values of arrays that each hold distinct values"""
+    if len(arrays) == 1:
+        return np.sort(arrays[0])
+    values = np.sort(np.concatenate(arrays))
+    return values[np.concatenate(([True], values[1:] != values[:-1]))]
+
+
+def _member(sorted_values, values):
+    """Mask of values that are in sorted_values"""
+    if len(sorted_values) == 0:
+        return np.zeros(len(values), dtype=bool)
+    found = np.minimum(np.searchsorted(sorted_values, values), len(sorted_values) - 1)
+    return sorted_values[found] == values
+
+
+class _Source:
+    """Rows in ascending id order, high scoring, taken a growing chunk at a time; see SearchIndex.search()"""
+
+    def __init__(self, rows, high, low, limit, end):
+        self.rows = rows
+        self.high = high
+        self.low = low
+        self.end = end
+        self.taken = 0
+        self.chunk = max(MIN_CHUNK_ROWS, 2 * limit)
+        self.cursor = int(rows[0]) if len(rows) else end
+
+    def remaining(self):
+        return len(self.rows) - self.taken
+
+    def take(self):
+        """The next chunk of rows (all of them if at most twice that remain); the cursor moves past it"""
+        size = self.chunk if self.remaining() > 2 * self.chunk else self.remaining()
+        rows = self.rows[self.taken:self.taken + size]
+        self.taken += len(rows)
+        self.chunk *= 2
+        self.cursor = int(self.rows[self.taken]) if self.taken < len(self.rows) else self.end
+        return rows
+
+
+class _Ceiling(_Source):
+    """Rows of the shortest of sources that are in all the others, found a chunk at a time"""
+
+    def __init__(self, sources, limit, end):
+        shortest = min(sources, key=_Source.remaining)
+        super().__init__(shortest.rows, 0.0, 0.0, limit, end)
+        self.others = [s.rows for s in sources if s is not shortest]
+        self.limit = limit
+
+    def take(self):
+        """At least limit more rows, unless fewer are left; the cursor moves past the rows examined"""
+        found = [self.rows[:0]]
+        while sum(len(rows) for rows in found) < self.limit and self.remaining():
+            rows = super().take()
+            for others in self.others:
+                rows = rows[_member(others, rows)]
+            found.append(rows)
+        return np.concatenate(found)
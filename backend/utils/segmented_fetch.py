@@ -0,0 +1,186 @@
+"""
+Parallel ranged download of one upstream file into a local file.
+
+Drive caps the throughput of a single connection, so a large track is split
+into a few byte ranges fetched at the same time and written in place with
+pwrite(). The bytes are exposed in order through a contiguous watermark, so
+a client streaming the file while it downloads still reads it front to back.
+"""
+import os
+import threading
+import time
+from utils.relay import Relay
+
+# Delay before the first retry of a failed segment; doubles on each retry
+RETRY_BACKOFF = 0.5
+
+
+class RangesUnsupported(Exception):
+    """Upstream answered a Range request with the whole file"""
+
+
+class _Segment:
+    __slots__ = ('start', 'end', 'received', 'attempts')
+
+    def __init__(self, start, end):
+        self.start = start
+        self.end = end        # Inclusive
+        self.received = 0
+        self.attempts = 0
+
+    @property
+    def complete(self):
+        return self.start + self.received > self.end
+
+
+def plan_segments(total_length, segments, min_segment_size):
+    """Split 0..total_length-1 into at most `segments` ranges of at least min_segment_size"""
+    count = max(1, min(segments, total_length // max(1, min_segment_size)))
+    size = -(-total_length // count)
+    return [_Segment(start, min(start + size, total_length) - 1) for start in range(0, total_length, size)]
+
+
+class SegmentedFetch:
+    """
+    Body of an upstream file for FileCache that writes itself: fill() runs
+    one thread per segment, each issuing fetch_range(first, last) and writing
+    what arrives at its offset. A failed segment is retried from the byte it
+    stopped at, up to max_retries times. If upstream ignores Range, the
+    segments are dropped and the file is read once with fetch_all().
+
+    Both callables return requests-style streaming responses. An admission
+    ticket, if given, paces what every segment reads from upstream and is
+    released by close().
+    """
+
+    def __init__(self, key, total_length, fetch_range, fetch_all, segments, min_segment_size,
+                 max_retries=3, ticket=None):
+        self.key = key
+        self.total_length = total_length
+        self.fetch_range = fetch_range
+        self.fetch_all = fetch_all
+        self.segments = plan_segments(total_length, segments, min_segment_size)
+        self.max_retries = max_retries
+        self.ticket = ticket
+        self.retries = 0
+        self._lock = threading.Lock()
+        self._closed = False
+        self._failed = threading.Event()  # A segment gave up; the others stop too
+        self._watermark = 0
+
+    def close(self):
+        """Stop every segment at its next chunk"""
+        self._closed = True
+        if self.ticket is not None:
+            self.ticket.release()
+
+    def _relay(self, response):
+        return Relay(response, pace=self.ticket.delay if self.ticket is not None else None)
+
+    def _stopping(self):
+        return self._closed or self._failed.is_set()
+
+    def _contiguous(self):
+        """Bytes available from the start of the file with no gaps"""
+        watermark = 0
+        for segment in self.segments:
+            watermark = segment.start + segment.received
+            if not segment.complete:
+                break
+        return watermark
+
+    def _advance(self, progress):
+        # Under the lock, so the watermark reported never goes backwards
+        with self._lock:
+            watermark = self._contiguous()
+            if watermark > self._watermark:
+                self._watermark = watermark
+                progress(watermark)
+
+    def _fetch_segment(self, fd, segment, progress):
+        """Fetch what is left of one segment, retrying from where each attempt stopped"""
+        while not segment.complete and not self._stopping():
+            response = None
+            try:
+                response = self.fetch_range(segment.start + segment.received, segment.end)
+                if response.status_code == 200:
+                    raise RangesUnsupported(f"Upstream ignored Range for {self.key}")
+                if response.status_code != 206:
+                    raise IOError(f"Upstream status {response.status_code} for {self.key}")
+                for chunk in self._relay(response):
+                    if self._stopping():
+                        return
+                    chunk = chunk[:segment.end + 1 - segment.start - segment.received]
+                    if not chunk:
+                        continue
+                    os.pwrite(fd, chunk, segment.start + segment.received)
+                    segment.received += len(chunk)
+                    self._advance(progress)
+                if not segment.complete:
+                    raise IOError(f"Segment {segment.start}-{segment.end} of {self.key} ended early")
+            except RangesUnsupported:
+                raise
+            except Exception as e:
+                segment.attempts += 1
+                if segment.attempts > self.max_retries:
+                    raise
+                with self._lock:
+                    self.retries += 1
+                print(f"[Segments] Retrying {self.key} from byte {segment.start + segment.received}: {str(e)}")
+                time.sleep(RETRY_BACKOFF * (2 ** (segment.attempts - 1)))
+            finally:
+                if response is not None:
+                    response.close()
+
+    def _fetch_whole(self, fd, progress):
+        """Fallback: one sequential read of the whole file"""
+        response = self.fetch_all()
+        try:
+            if response.status_code != 200:
+                raise IOError(f"Upstream status {response.status_code} for {self.key}")
+            offset = 0
+            for chunk in self._relay(response):
+                if self._closed:
+                    raise IOError(f"Download of {self.key} was cancelled")
+                if not chunk:
+                    continue
+                os.pwrite(fd, chunk, offset)
+                offset += len(chunk)
+                if offset > self._watermark:
+                    self._watermark = offset
+                    progress(offset)
+            if offset != self.total_length:
+                raise IOError(f"Upstream ended early for {self.key} at byte {offset}")
+        finally:
+            response.close()
+
+    def fill(self, fd, progress):
+        """
+        Write the whole file into fd (already sized to total_length), calling
+        progress(n) whenever the first n bytes become complete. Raises the
+        first segment error that retries could not fix.
+        """
+        errors = []
+
+        def run(segment):
+            try:
+                self._fetch_segment(fd, segment, progress)
+            except Exception as e:
+                errors.append(e)
+                self._failed.set()
+
+        threads = [threading.Thread(target=run, args=(segment,), name=f"segment-{self.key}-{i}",
+                                    daemon=True)
+                   for i, segment in enumerate(self.segments)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        if any(isinstance(e, RangesUnsupported) for e in errors):
+            print(f"[Segments] {self.key}: upstream does not support ranges, reading it whole")
+            return self._fetch_whole(fd, progress)
+        if errors:
+            raise errors[0]
+        if self._closed:
+            raise IOError(f"Download of {self.key} was cancelled")
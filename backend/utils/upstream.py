@@ -0,0 +1,177 @@
+import http.cookiejar
+import random
+import threading
+import time
+import requests
+from requests.adapters import HTTPAdapter
+from config import (UPSTREAM_POOL_SIZE, UPSTREAM_CONNECT_TIMEOUT, UPSTREAM_READ_TIMEOUT,
+                    UPSTREAM_MAX_RETRIES, UPSTREAM_BACKOFF_BASE, UPSTREAM_BACKOFF_MAX,
+                    BREAKER_FAILURE_THRESHOLD, BREAKER_RESET_TIMEOUT)
+from utils.metrics import UPSTREAM_TTFB
+
+# Upstream statuses that count as a failure and may be retried
+RETRYABLE_STATUSES = {429, 500, 502, 503, 504}
+
+_client = None
+_client_lock = threading.Lock()
+
+
+class CircuitOpenError(Exception):
+    """Raised instead of calling upstream while the circuit breaker is open"""
+
+    def __init__(self, retry_after):
+        super().__init__(f"Upstream is unavailable, retry in {retry_after:.0f}s")
+        self.retry_after = retry_after
+
+
+class CircuitBreaker:
+    """
+    Consecutive-failure circuit breaker.
+
+    After failure_threshold failures in a row the circuit opens and calls fail
+    fast for reset_timeout seconds. Then a single trial call is let through:
+    success closes the circuit, failure opens it again. before_call() returns
+    a token to the call that is the trial (None to any other), and only that
+    call's record_failure() or end_trial() settles the trial.
+    """
+
+    def __init__(self, failure_threshold, reset_timeout):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._failures = 0
+        self._opened_at = None
+        self._trial = None
+        self._trials = 0
+        self._lock = threading.Lock()
+
+    @property
+    def state(self):
+        with self._lock:
+            if self._opened_at is None:
+                return 'closed'
+            if time.monotonic() - self._opened_at >= self.reset_timeout:
+                return 'half-open'
+            return 'open'
+
+    def before_call(self):
+        """Raise CircuitOpenError while open; return a trial token if this call is the half-open trial"""
+        with self._lock:
+            if self._opened_at is None:
+                return None
+            remaining = self.reset_timeout - (time.monotonic() - self._opened_at)
+            if remaining > 0 or self._trial is not None:
+                raise CircuitOpenError(max(remaining, 1.0))
+            self._trials += 1
+            self._trial = self._trials
+            return self._trial
+
+    def record_success(self):
+        with self._lock:
+            self._failures = 0
+            self._opened_at = None
+            self._trial = None
+
+    def record_failure(self, trial=None):
+        with self._lock:
+            self._failures += 1
+            failed_trial = trial is not None and trial == self._trial
+            if failed_trial or self._failures >= self.failure_threshold:
+                if self._opened_at is None:
+                    print(f"[Upstream] Circuit opened after {self._failures} consecutive failures")
+                self._opened_at = time.monotonic()
+            if failed_trial:
+                self._trial = None
+
+    def end_trial(self, trial):
+        """The call before_call() gave trial to is over: if it recorded nothing, let another one try"""
+        with self._lock:
+            if trial is not None and trial == self._trial:
+                self._trial = None
+
+
+class UpstreamClient:
+    """
+    Process-wide HTTP client for Google Drive.
+
+    One keep-alive connection pool shared by every request in the worker,
+    connect/read timeouts on every call, bounded retries with jittered
+    exponential backoff for idempotent ranged GETs, and a circuit breaker that
+    fails fast while Drive is erroring.
+    """
+
+    def __init__(self, pool_size, connect_timeout, read_timeout, max_retries,
+                 backoff_base, backoff_max, breaker):
+        self.timeout = (connect_timeout, read_timeout)
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.breaker = breaker
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=4, pool_maxsize=pool_size, max_retries=0)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+        # Cookies are passed per request; never let one file's confirm
+        # cookies leak into another request through the shared session
+        self.session.cookies.set_policy(http.cookiejar.DefaultCookiePolicy(allowed_domains=[]))
+
+    def _backoff(self, attempt):
+        delay = min(self.backoff_max, self.backoff_base * (2 ** attempt))
+        time.sleep(random.uniform(0, delay))
+
+    def get(self, url, params=None, headers=None, cookies=None, stream=True, retry=None):
+        """
+        GET url through the shared pool and return the (streaming) response.
+
+        Requests carrying a Range header are retried by default; pass retry to
+        override. Raises CircuitOpenError without contacting upstream while the
+        breaker is open.
+        """
+        if retry is None:
+            retry = bool(headers and 'Range' in headers)
+        attempts = 1 + (self.max_retries if retry else 0)
+
+        for attempt in range(attempts):
+            trial = self.breaker.before_call()
+            try:
+                started = time.perf_counter()
+                try:
+                    response = self.session.get(url, params=params, headers=headers, cookies=cookies,
+                                                stream=stream, timeout=self.timeout)
+                except (requests.ConnectionError, requests.Timeout):
+                    self.breaker.record_failure(trial)
+                    if attempt + 1 >= attempts:
+                        raise
+                    self._backoff(attempt)
+                    continue
+                except requests.RequestException:
+                    # Not worth retrying (TLS, bad URL, broken body), but still a failed call
+                    self.breaker.record_failure(trial)
+                    raise
+                UPSTREAM_TTFB.observe(time.perf_counter() - started)
+
+                if response.status_code in RETRYABLE_STATUSES:
+                    self.breaker.record_failure(trial)
+                    if attempt + 1 < attempts:
+                        response.close()
+                        self._backoff(attempt)
+                        continue
+                else:
+                    self.breaker.record_success()
+                return response
+            finally:
+                # However the call ended, a half-open trial must not stay in flight
+                self.breaker.end_trial(trial)
+
+
+def get_client():
+    """Return the process-wide UpstreamClient, creating it on first use"""
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                _client = UpstreamClient(
+                    UPSTREAM_POOL_SIZE, UPSTREAM_CONNECT_TIMEOUT, UPSTREAM_READ_TIMEOUT,
+                    UPSTREAM_MAX_RETRIES, UPSTREAM_BACKOFF_BASE, UPSTREAM_BACKOFF_MAX,
+                    CircuitBreaker(BREAKER_FAILURE_THRESHOLD, BREAKER_RESET_TIMEOUT))
+    return _client
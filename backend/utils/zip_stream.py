@@ -0,0 +1,96 @@
+"""
+ZIP archives written as a stream, for album and playlist downloads.
+
+Entries are STORED (FLAC does not compress further) and use data
+descriptors, so each member's CRC and size are written after its bytes and
+nothing has to be known, buffered or seeked back to in advance. Every
+record is ZIP64, so neither member nor archive size is limited to 4 GiB.
+"""
+import struct
+import time
+import zlib
+
+ZIP64_VERSION = 45
+FLAG_DATA_DESCRIPTOR = 0x0008
+FLAG_UTF8 = 0x0800
+MAX_32 = 0xFFFFFFFF
+MAX_16 = 0xFFFF
+UNIX_MODE = 0o100644 << 16  # Regular file, rw-r--r--, in the external attributes
+
+
+def _dos_datetime(timestamp):
+    t = time.localtime(timestamp)
+    year = max(t.tm_year, 1980)
+    return ((t.tm_hour << 11) | (t.tm_min << 5) | (t.tm_sec // 2),
+            ((year - 1980) << 9) | (t.tm_mon << 5) | t.tm_mday)
+
+
+class _Member:
+    __slots__ = ('name', 'flags', 'dos_time', 'dos_date', 'offset', 'crc', 'size')
+
+    def __init__(self, name, flags, dos_time, dos_date, offset):
+        self.name = name
+        self.flags = flags
+        self.dos_time = dos_time
+        self.dos_date = dos_date
+        self.offset = offset
+        self.crc = 0
+        self.size = 0
+
+
+class ZipStream:
+    """
+    Builds one archive: yield from member() for each file in order, then
+    from finish(). Only the central directory, a few dozen bytes per member,
+    is kept until the end.
+    """
+
+    def __init__(self):
+        self.offset = 0
+        self.members = []
+
+    def _out(self, data):
+        self.offset += len(data)
+        return data
+
+    def member(self, name, chunks, modified=None):
+        """Yield a member called name whose contents are the byte strings in chunks"""
+        encoded = name.encode('utf-8')
+        dos_time, dos_date = _dos_datetime(modified or time.time())
+        member = _Member(encoded, FLAG_DATA_DESCRIPTOR | FLAG_UTF8, dos_time, dos_date, self.offset)
+
+        # Sizes go in the ZIP64 extra field (as zero: they follow in the descriptor)
+        extra = struct.pack('<HHQQ', 0x0001, 16, 0, 0)
+        yield self._out(struct.pack('<IHHHHHIIIHH', 0x04034B50, ZIP64_VERSION, member.flags, 0,
+                                    dos_time, dos_date, 0, MAX_32, MAX_32, len(encoded), len(extra))
+                        + encoded + extra)
+        crc = 0
+        for chunk in chunks:
+            if not chunk:
+                continue
+            crc = zlib.crc32(chunk, crc)
+            member.size += len(chunk)
+            yield self._out(chunk)
+        member.crc = crc
+        yield self._out(struct.pack('<IIQQ', 0x08074B50, crc, member.size, member.size))
+        self.members.append(member)
+
+    def finish(self):
+        """Yield the central directory and end records"""
+        directory_offset = self.offset
+        for member in self.members:
+            extra = struct.pack('<HHQQQ', 0x0001, 24, member.size, member.size, member.offset)
+            yield self._out(struct.pack('<IHHHHHHIIIHHHHHII', 0x02014B50, (3 << 8) | ZIP64_VERSION,
+                                        ZIP64_VERSION, member.flags, 0, member.dos_time,
+                                        member.dos_date, member.crc, MAX_32, MAX_32,
+                                        len(member.name), len(extra), 0, 0, 0, UNIX_MODE, MAX_32)
+                            + member.name + extra)
+        directory_size = self.offset - directory_offset
+
+        end_offset = self.offset
+        count = len(self.members)
+        yield self._out(struct.pack('<IQHHIIQQQQ', 0x06064B50, 44, ZIP64_VERSION, ZIP64_VERSION,
+                                    0, 0, count, count, directory_size, directory_offset))
+        yield self._out(struct.pack('<IIQI', 0x07064B50, 0, end_offset, 1))
+        yield self._out(struct.pack('<IHHHHIIH', 0x06054B50, 0, 0, min(count, MAX_16),
+                                    min(count, MAX_16), MAX_32, MAX_32, 0))
@@ -1,4 +1,6 @@
-from app import app
-
-if __name__ == "__main__":
-    app.run() 
+from app import app
+from utils import metrics
+
+if __name__ == "__main__":
+    metrics.start()
+    app.run() 
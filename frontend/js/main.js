@@ -9,25 +9,41 @@ let audioPlayer;
 let currentAudio = null;
 let seeking = false;
 
+// Seeking reloads the stream from /stream/<id>?t=<seconds>; the element's
+// currentTime then counts from streamOffset rather than from the track start
+let currentStreamUrl = null;
+let streamOffset = 0;
+
+// Search paging: results are fetched SEARCH_PAGE_SIZE at a time
+const SEARCH_PAGE_SIZE = 50;
+let lastSearchQuery = '';
+let nextSearchCursor = null;
+
 function initializeAudioPlayer(audioElement) {
     const seekSlider = document.getElementById('seek-slider');
     const currentTimeDisplay = document.getElementById('current-time');
     const durationDisplay = document.getElementById('duration');
     const playPauseBtn = document.getElementById('play-pause');
 
+    // Listeners are attached once; playTrack() reuses the same element
+    if (audioElement.dataset.initialized) return;
+    audioElement.dataset.initialized = 'true';
+
     // Update time displays
     audioElement.addEventListener('loadedmetadata', () => {
-        seekSlider.max = Math.floor(audioElement.duration);
-        durationDisplay.textContent = formatTime(audioElement.duration);
-        currentTimeDisplay.textContent = '0:00';
-        seekSlider.value = 0;
+        const duration = streamOffset + audioElement.duration;
+        seekSlider.max = Math.floor(duration);
+        durationDisplay.textContent = formatTime(duration);
+        currentTimeDisplay.textContent = formatTime(streamOffset);
+        seekSlider.value = Math.floor(streamOffset);
     });
 
     // Update current time
     audioElement.addEventListener('timeupdate', () => {
         if (!seeking) {
-            seekSlider.value = Math.floor(audioElement.currentTime);
-            currentTimeDisplay.textContent = formatTime(audioElement.currentTime);
+            const position = streamOffset + audioElement.currentTime;
+            seekSlider.value = Math.floor(position);
+            currentTimeDisplay.textContent = formatTime(position);
         }
     });
 
@@ -45,7 +61,7 @@ function initializeAudioPlayer(audioElement) {
 
     seekSlider.addEventListener('mouseup', () => {
         seeking = false;
-        audioElement.currentTime = seekSlider.value;
+        seekTo(audioElement, Number(seekSlider.value));
     });
 
     // Handle loading states
@@ -71,6 +87,19 @@ function initializeAudioPlayer(audioElement) {
     });
 }
 
+// Restart the stream at a time; the server starts it at the frame holding it
+function seekTo(audioElement, seconds) {
+    if (!currentStreamUrl) return;
+    streamOffset = seconds;
+    audioElement.src = seconds > 0 ? `${currentStreamUrl}&t=${seconds}` : currentStreamUrl;
+    const playPromise = audioElement.play();
+    if (playPromise !== undefined) {
+        playPromise.catch(error => {
+            console.error('Playback error:', error);
+        });
+    }
+}
+
 async function playTrack(fileId, title) {
     try {
         const playerContainer = document.getElementById('player-container');
@@ -86,11 +115,13 @@ async function playTrack(fileId, title) {
         playerContainer.classList.remove('hidden');
         nowPlaying.textContent = title;
         
-        // Add timestamp to prevent caching
-        const timestamp = new Date().getTime();
-        const streamUrl = `${API_URL}/stream/${fileId}?t=${timestamp}`;
+        // Add a version to prevent caching (t= is the seek time)
+        const version = new Date().getTime();
+        const streamUrl = `${API_URL}/stream/${fileId}?v=${version}`;
         
         // Reset player state
+        currentStreamUrl = streamUrl;
+        streamOffset = 0;
         audioPlayer.src = streamUrl;
         playPauseBtn.innerHTML = '<i class="fas fa-spinner fa-spin"></i>';
         
@@ -174,14 +205,18 @@ function togglePlay() {
 }
 
 
-async function searchTracks(query) {
+async function searchTracks(query, cursor = null) {
     try {
+        nextSearchCursor = null;
         if (!query || query.trim() === '') {
             console.log('Empty search query');
             return [];
         }
         
-        const searchUrl = `${API_URL}/api/search?q=${encodeURIComponent(query)}`;
+        let searchUrl = `${API_URL}/api/search?q=${encodeURIComponent(query)}&limit=${SEARCH_PAGE_SIZE}`;
+        if (cursor) {
+            searchUrl += `&cursor=${encodeURIComponent(cursor)}`;
+        }
         console.log('Searching:', searchUrl);
         console.log('API URL being used:', API_URL);
         
@@ -207,7 +242,8 @@ async function searchTracks(query) {
         
         // Remove the data.success check since the API returns the array directly
         if (Array.isArray(data)) {
-            displayResults(data);
+            // Present only when more results are available
+            nextSearchCursor = response.headers.get('X-Next-Cursor');
             return data;
         } else {
             console.error('Invalid response format:', data);
@@ -224,13 +260,19 @@ async function searchTracks(query) {
     }
 }
 
-function displayResults(results) {
+function displayResults(results, append = false) {
     const resultsContainer = document.getElementById('results');
-    resultsContainer.innerHTML = ''; // Clear previous results
+    const previousLoadMore = document.getElementById('load-more');
+    if (previousLoadMore) {
+        previousLoadMore.remove();
+    }
+    if (!append) {
+        resultsContainer.innerHTML = ''; // Clear previous results
+    }
 
     console.log('Displaying results:', results);
 
-    if (!results || results.length === 0) {
+    if (!append && (!results || results.length === 0)) {
         resultsContainer.innerHTML = '<p>No results found</p>';
         return;
     }
@@ -249,10 +291,28 @@ function displayResults(results) {
             <div class="track-buttons">
                 <button class="play-button" onclick="playTrack('${track.file_id}', '${cleanTitle.replace(/'/g, "\\'")}')">Play</button>
                 <button class="download-button" onclick="downloadTrack('${track.file_id}')">Download</button>
+                ${track.album ? `<button class="download-button" onclick="downloadAlbum('${track.album.replace(/'/g, "\\'")}')">Album</button>` : ''}
             </div>
         `;
         resultsContainer.appendChild(trackElement);
     });
+
+    if (nextSearchCursor) {
+        const loadMoreButton = document.createElement('button');
+        loadMoreButton.id = 'load-more';
+        loadMoreButton.textContent = 'Load more';
+        loadMoreButton.onclick = loadMoreResults;
+        resultsContainer.appendChild(loadMoreButton);
+    }
+}
+
+async function loadMoreResults() {
+    const loadMoreButton = document.getElementById('load-more');
+    if (loadMoreButton) {
+        loadMoreButton.disabled = true;
+    }
+    const results = await searchTracks(lastSearchQuery, nextSearchCursor);
+    displayResults(results, true);
 }
 
 
@@ -269,6 +329,7 @@ async function handleSearch() {
     try {
         const searchInput = document.getElementById('search-input');
         const query = searchInput.value;
+        lastSearchQuery = query;
         
         // Show loading state
         const results = await searchTracks(query);
@@ -299,6 +360,16 @@ function downloadTrack(fileId) {
     }
 }
 
+function downloadAlbum(album) {
+    // One request: the server streams the whole album as a ZIP
+    const link = document.createElement('a');
+    link.href = `${API_URL}/api/download/batch?album=${encodeURIComponent(album)}`;
+    link.download = '';
+    document.body.appendChild(link);
+    link.click();
+    document.body.removeChild(link);
+}
+
 // Initialize when the page loads
 document.addEventListener('DOMContentLoaded', () => {
     console.log('Page loaded, initializing...');